@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  Batch encoding of Milight 3.0 (LimitlessLED Wifi Bridge v6.0) request frames with NumPy
+
+  Effect streams, scenes and benchmarks need thousands of frames. Instead of building one bytearray per frame,
+  the frames are encoded at once from arrays of actions, values, zones, session IDs and sequence numbers into
+  a contiguous (N, 22) uint8 matrix, the checksums being computed for all the frames at once:
+
+    encoder = MilightBatchEncoder()
+    frames = encoder.encode(actions=[encoder.actionIndex("setColor")] * 1000, values=range(1000), zones=1)
+    milight.sendFrames(MilightBatchEncoder.frameViews(frames))
+
+  Note: NumPy is an optional dependency, it is only needed by this module (pip install numpy)
+"""
+
+import getopt
+import logging
+import sys
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from MilightWifiBridge import MilightWifiBridge
+
+
+class MilightBatchEncoder:
+  """Encode request frames in batch (see MilightWifiBridge.buildCommandFrame() for a single frame)"""
+
+  # Actions which can be encoded, in the order of their index
+  ACTIONS = ("turnOn", "turnOff", "setNightMode", "setWhiteMode", "speedUpDiscoMode", "slowDownDiscoMode",
+             "link", "unlink", "setColor", "setBrightness", "setSaturation", "setTemperature", "setDiscoMode",
+             "turnOnWifiBridgeLamp", "turnOffWifiBridgeLamp", "setWhiteModeBridgeLamp", "speedUpDiscoModeBridgeLamp",
+             "slowDownDiscoModeBridgeLamp", "setColorBridgeLamp", "setBrightnessBridgeLamp", "setDiscoModeBridgeLamp")
+
+  def __init__(self):
+    """Build the command tables of all the actions and values (done once per encoder)"""
+    if numpy is None:
+      raise ImportError("MilightBatchEncoder needs NumPy (pip install numpy)")
+
+    # Command (9 bytes) of each action and value, built by the single frame encoder so that both encoders always
+    # give the same frames (values are clamped the same way)
+    self.commands = numpy.zeros((len(MilightBatchEncoder.ACTIONS), 256, 9), dtype=numpy.uint8)
+    # Zone forced by the action (wifi bridge lamp actions), -1 if the zone of the frame is used
+    self.forcedZones = numpy.full(len(MilightBatchEncoder.ACTIONS), -1, dtype=numpy.int16)
+    for index, action in enumerate(MilightBatchEncoder.ACTIONS):
+      for value in range(256):
+        frame = MilightWifiBridge.buildCommandFrame(action, 0, value)
+        self.commands[index, value] = numpy.frombuffer(bytes(frame[10:19]), dtype=numpy.uint8)
+      if frame[19] != 0:
+        self.forcedZones[index] = frame[19]
+
+    # Sum of the command bytes of each action and value (the checksum only adds the zone to it)
+    self.commandSums = self.commands.sum(axis=2, dtype=numpy.int32)
+
+  @staticmethod
+  def actionIndex(action):
+    """Give the index of an action
+
+    Keyword arguments:
+      action -- (string) Action (see MilightBatchEncoder.ACTIONS)
+
+    return: (int) Index of the action
+    """
+    return MilightBatchEncoder.ACTIONS.index(action)
+
+  def encode(self, actions, values=0, zones=0, sessionId1=0, sessionId2=0, sequenceNumbers=0):
+    """Encode request frames
+
+    Note: Each argument is an array (one item per frame) or a single value used for all the frames.
+          Session IDs and sequence numbers can be left to 0, sendFrames() fills them before sending.
+
+    Keyword arguments:
+      actions -- (array of int) Action indexes (see actionIndex())
+      values -- (array of int, optional) Values of the actions (clamped to the range of the action)
+      zones -- (array of int, optional) Zone IDs (between 0 and 4, ignored for wifi bridge lamp actions)
+      sessionId1 -- (array of int, optional) First part of the session IDs
+      sessionId2 -- (array of int, optional) Second part of the session IDs
+      sequenceNumbers -- (array of int, optional) Sequence numbers
+
+    return: (numpy.ndarray) Request frames, uint8 matrix of shape (N, 22)
+    """
+    actions = numpy.asarray(actions, dtype=numpy.intp).reshape(-1)
+    count = len(actions)
+    if count and (actions.min() < 0 or actions.max() >= len(MilightBatchEncoder.ACTIONS)):
+      raise ValueError("Invalid action index")
+    values = numpy.clip(numpy.broadcast_to(numpy.asarray(values, dtype=numpy.int64), (count,)), 0, 255)
+    zones = numpy.broadcast_to(numpy.asarray(zones, dtype=numpy.int16), (count,))
+    if count and (zones.min() < 0 or zones.max() > 4):
+      raise ValueError("Invalid zone (must be between 0 and 4)")
+    forcedZones = self.forcedZones[actions]
+    zones = numpy.where(forcedZones >= 0, forcedZones, zones)
+
+    frames = numpy.zeros((count, 22), dtype=numpy.uint8)
+    frames[:, 0] = 0x80
+    frames[:, 4] = 0x11
+    frames[:, 5] = numpy.asarray(sessionId1) & 0xFF
+    frames[:, 6] = numpy.asarray(sessionId2) & 0xFF
+    frames[:, 8] = numpy.asarray(sequenceNumbers) & 0xFF
+    frames[:, 10:19] = self.commands[actions, values]
+    frames[:, 19] = zones
+    frames[:, 21] = (self.commandSums[actions, values] + zones) & 0xFF
+    return frames
+
+  @staticmethod
+  def frameViews(frames):
+    """Give the frames of a matrix as writable views (see MilightWifiBridge.sendFrames(), no copy is done)
+
+    Keyword arguments:
+      frames -- (numpy.ndarray) Request frames given by encode()
+
+    return: (list of memoryview) Request frames (22 bytes each)
+    """
+    return [memoryview(frame) for frame in frames]
+
+
+def __help():
+  """Show help on how to use the batch encoder benchmark"""
+  print("Benchmark of the batch encoding of Milight frames against the single frame encoding\r\n"
+        +"\r\n"
+        +"Usage:\r\n"
+        +__file__+" [options]\r\n"
+        +"\r\n"
+        +"Options:\r\n"
+        +"  -n, --frames [count]: Number of frames to encode (default: 100000)\r\n"
+        +"  -l, --debug: Show debug logs\r\n")
+
+
+def main(parsed_args=sys.argv[1:]):
+  """Shell benchmark function"""
+  logging.getLogger().setLevel(logging.CRITICAL)
+
+  count = 100000
+  try:
+    opts, args = getopt.getopt(parsed_args, "n:lh", ["frames=", "debug", "help"])
+  except getopt.GetoptError as err:
+    print("[ERROR] "+str(err))
+    __help()
+    sys.exit(1)
+
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      __help()
+      sys.exit(0)
+    elif o in ("-n", "--frames"):
+      count = int(a)
+    elif o in ("-l", "--debug"):
+      logging.getLogger().setLevel(logging.DEBUG)
+
+  startTime = time.perf_counter()
+  encoder = MilightBatchEncoder()
+  tablesDuration = time.perf_counter() - startTime
+
+  # Same random-like mix of actions, values and zones for both encoders
+  indexes = numpy.arange(count)
+  actions = indexes % len(MilightBatchEncoder.ACTIONS)
+  values = (indexes * 7) % 256
+  zones = indexes % 5
+
+  startTime = time.perf_counter()
+  frames = encoder.encode(actions, values, zones, sessionId1=0x11, sessionId2=0x22, sequenceNumbers=indexes)
+  batchDuration = time.perf_counter() - startTime
+
+  startTime = time.perf_counter()
+  singleFrames = []
+  for index in range(count):
+    frame = MilightWifiBridge.buildCommandFrame(MilightBatchEncoder.ACTIONS[actions[index]], int(zones[index]),
+                                                int(values[index]))
+    frame[5] = 0x11
+    frame[6] = 0x22
+    frame[8] = index & 0xFF
+    singleFrames.append(frame)
+  singleDuration = time.perf_counter() - startTime
+
+  identical = all(bytes(frames[index]) == bytes(singleFrames[index]) for index in range(count))
+  print("Frames: {} ({})".format(count, "identical" if identical else "DIFFERENT"))
+  print("Tables: {:.1f}ms (once per encoder)".format(tablesDuration * 1000.0))
+  print("Batch encoding: {:.1f}ms ({:.0f} frames/s)".format(batchDuration * 1000.0, count / max(batchDuration, 1e-9)))
+  print("Single frame encoding: {:.1f}ms ({:.0f} frames/s)".format(singleDuration * 1000.0,
+                                                                  count / max(singleDuration, 1e-9)))
+  print("Speedup: {:.0f}x".format(singleDuration / max(batchDuration, 1e-9)))
+  sys.exit(0 if identical else 1)
+
+if __name__ == '__main__':
+  main()
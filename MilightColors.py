@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  RGB and HSV colors for Milight 3.0 (LimitlessLED Wifi Bridge v6.0) lights
+
+  Milight lights take a color byte (position on the Milight hue circle), a saturation and a brightness.
+  Conversions are done with lookup tables computed once, so that converting the colors of a program or of
+  an effect stream only costs a table lookup:
+
+    color = MilightColorConverter.rgbToMilight(255, 128, 0)
+    milight.sendFrames(MilightColorConverter.buildFrames(color, MilightWifiBridge.eZone.ONE))
+"""
+
+import collections
+import colorsys
+import threading
+
+from MilightWifiBridge import MilightWifiBridge
+
+# Color of a Milight light
+# Keyword arguments:
+#   color -- (int) Milight color (between 0x00 and 0xFF)
+#   saturation -- (int) Saturation percentage (between 0 and 100)
+#   brightness -- (int) Brightness percentage (between 0 and 100)
+MilightColor = collections.namedtuple("MilightColor", "color saturation brightness")
+
+
+class MilightColorConverter:
+  """Convert RGB and HSV colors to Milight colors with precomputed lookup tables"""
+
+  # Hue in degrees of the named Milight colors (MilightWifiBridge.eColor), the Milight hue circle is not linear
+  # Note: Red is 0xFF, it is unwrapped to -1 so that the table is increasing
+  HUE_ANCHORS = ((0, -1), (30, MilightWifiBridge.eColor.ORANGE), (60, MilightWifiBridge.eColor.YELLOW),
+                 (90, MilightWifiBridge.eColor.LIME), (120, MilightWifiBridge.eColor.GREEN),
+                 (180, MilightWifiBridge.eColor.AQUA), (240, MilightWifiBridge.eColor.BLUE),
+                 (270, MilightWifiBridge.eColor.LAVENDER), (360, MilightWifiBridge.eColor.RED))
+
+  # Bits kept per RGB channel in the RGB table (5 bits: 32768 entries per table)
+  RGB_BITS = 5
+
+  __lock = threading.RLock()
+  __hueTable = None
+  __rgbTables = None
+
+  @staticmethod
+  def __buildHueTable():
+    """Build the table giving the Milight color of each hue degree
+
+    return: (bytes) Milight color of each hue degree (360 entries)
+    """
+    table = bytearray(360)
+    anchors = MilightColorConverter.HUE_ANCHORS
+    for (startHue, startColor), (endHue, endColor) in zip(anchors, anchors[1:]):
+      for hue in range(startHue, endHue):
+        ratio = (hue - startHue) / float(endHue - startHue)
+        table[hue] = int(round(startColor + (endColor - startColor) * ratio)) & 0xFF
+    return bytes(table)
+
+  @staticmethod
+  def hueTable():
+    """Give the table giving the Milight color of each hue degree (built once)
+
+    return: (bytes) Milight color of each hue degree (360 entries)
+    """
+    if MilightColorConverter.__hueTable is None:
+      with MilightColorConverter.__lock:
+        if MilightColorConverter.__hueTable is None:
+          MilightColorConverter.__hueTable = MilightColorConverter.__buildHueTable()
+    return MilightColorConverter.__hueTable
+
+  @staticmethod
+  def __buildRgbTables():
+    """Build the tables giving the Milight color and saturation of each (quantized) RGB color
+
+    return: (tuple of bytes) Milight color and saturation tables (indexed by rgbIndex())
+    """
+    hueTable = MilightColorConverter.hueTable()
+    bits = MilightColorConverter.RGB_BITS
+    levels = 1 << bits
+    maxLevel = float(levels - 1)
+    colors = bytearray(levels ** 3)
+    saturations = bytearray(levels ** 3)
+    index = 0
+    for red in range(levels):
+      for green in range(levels):
+        for blue in range(levels):
+          hue, saturation, value = colorsys.rgb_to_hsv(red / maxLevel, green / maxLevel, blue / maxLevel)
+          colors[index] = hueTable[int(round(hue * 360)) % 360]
+          saturations[index] = int(round(saturation * 100))
+          index += 1
+    return bytes(colors), bytes(saturations)
+
+  @staticmethod
+  def rgbTables():
+    """Give the tables giving the Milight color and saturation of each (quantized) RGB color (built once)
+
+    return: (tuple of bytes) Milight color and saturation tables (indexed by rgbIndex())
+    """
+    if MilightColorConverter.__rgbTables is None:
+      with MilightColorConverter.__lock:
+        if MilightColorConverter.__rgbTables is None:
+          MilightColorConverter.__rgbTables = MilightColorConverter.__buildRgbTables()
+    return MilightColorConverter.__rgbTables
+
+  @staticmethod
+  def rgbIndex(red, green, blue):
+    """Give the index of a RGB color in the RGB tables
+
+    Keyword arguments:
+      red -- (int) Red (between 0 and 255)
+      green -- (int) Green (between 0 and 255)
+      blue -- (int) Blue (between 0 and 255)
+
+    return: (int) Index in the RGB tables
+    """
+    shift = 8 - MilightColorConverter.RGB_BITS
+    bits = MilightColorConverter.RGB_BITS
+    return ((red >> shift) << (2 * bits)) | ((green >> shift) << bits) | (blue >> shift)
+
+  @staticmethod
+  def hsvToMilight(hue, saturation, brightness):
+    """Convert a HSV color to a Milight color
+
+    Keyword arguments:
+      hue -- (int or float) Hue in degrees (between 0 and 360)
+      saturation -- (int) Saturation percentage (between 0 and 100)
+      brightness -- (int) Brightness (value) percentage (between 0 and 100)
+
+    return: (MilightColor) Milight color
+    """
+    return MilightColor(color=MilightColorConverter.hueTable()[int(hue) % 360],
+                        saturation=min(max(int(saturation), 0), 100),
+                        brightness=min(max(int(brightness), 0), 100))
+
+  @staticmethod
+  def rgbToMilight(red, green, blue):
+    """Convert a RGB color to a Milight color
+
+    Keyword arguments:
+      red -- (int) Red (between 0 and 255)
+      green -- (int) Green (between 0 and 255)
+      blue -- (int) Blue (between 0 and 255)
+
+    return: (MilightColor) Milight color
+    """
+    red = min(max(int(red), 0), 255)
+    green = min(max(int(green), 0), 255)
+    blue = min(max(int(blue), 0), 255)
+    colors, saturations = MilightColorConverter.rgbTables()
+    index = MilightColorConverter.rgbIndex(red, green, blue)
+    return MilightColor(color=colors[index], saturation=saturations[index],
+                        brightness=(max(red, green, blue) * 100 + 127) // 255)
+
+  @staticmethod
+  def buildFrames(milightColor, zoneId):
+    """Build the request frames setting a Milight color to a zone (see MilightWifiBridge.sendFrames())
+
+    Keyword arguments:
+      milightColor -- (MilightColor) Milight color
+      zoneId -- (int or MilightWifiBridge.eZone) Zone ID
+
+    return: (list of bytearray) Set color, set saturation and set brightness request frames
+    """
+    return [MilightWifiBridge.buildCommandFrame("setColor", zoneId, milightColor.color),
+            MilightWifiBridge.buildCommandFrame("setSaturation", zoneId, milightColor.saturation),
+            MilightWifiBridge.buildCommandFrame("setBrightness", zoneId, milightColor.brightness)]
+
+  @staticmethod
+  def buildBridgeLampFrames(milightColor):
+    """Build the request frames setting a Milight color to the wifi bridge lamp (saturation is not supported)
+
+    Keyword arguments:
+      milightColor -- (MilightColor) Milight color
+
+    return: (list of bytearray) Set color and set brightness request frames
+    """
+    return [MilightWifiBridge.buildCommandFrame("setColorBridgeLamp", value=milightColor.color),
+            MilightWifiBridge.buildCommandFrame("setBrightnessBridgeLamp", value=milightColor.brightness)]
+
+
+class MilightKelvinTable:
+  """Convert Kelvin color temperatures to Milight temperature percentages with a precomputed lookup table
+
+  The default calibration is the one of MilightWifiBridge.eTemperature, another one can be given for lights
+  of another model (a calibration is a list of (kelvin, percentage) points, interpolated linearly).
+  """
+
+  DEFAULT_CALIBRATION = ((2700, MilightWifiBridge.eTemperature.WARM), (3000, MilightWifiBridge.eTemperature.WARM_WHITE),
+                         (4000, MilightWifiBridge.eTemperature.COOL_WHITE), (5000, MilightWifiBridge.eTemperature.DAYLIGHT),
+                         (6500, MilightWifiBridge.eTemperature.COOL_DAYLIGHT))
+
+  def __init__(self, calibration=None):
+    """Build the lookup table of a calibration
+
+    Keyword arguments:
+      calibration -- (list of (int, int), optional) (kelvin, percentage) points, default calibration if not set
+    """
+    points = sorted((int(kelvin), min(max(int(percentage), 0), 100))
+                    for kelvin, percentage in (calibration or MilightKelvinTable.DEFAULT_CALIBRATION))
+    if len(points) < 2 or points[0][0] == points[-1][0]:
+      raise ValueError("A Kelvin calibration needs at least two different temperatures")
+
+    self.calibration = tuple(points)
+    self.minKelvin = points[0][0]
+    self.maxKelvin = points[-1][0]
+
+    # One entry per Kelvin between the minimum and maximum temperature of the calibration
+    table = bytearray(self.maxKelvin - self.minKelvin + 1)
+    for (startKelvin, startPercentage), (endKelvin, endPercentage) in zip(points, points[1:]):
+      for kelvin in range(startKelvin, endKelvin + 1):
+        ratio = 0.0 if endKelvin == startKelvin else (kelvin - startKelvin) / float(endKelvin - startKelvin)
+        table[kelvin - self.minKelvin] = int(round(startPercentage + (endPercentage - startPercentage) * ratio))
+    self.table = bytes(table)
+
+  @staticmethod
+  def parse(calibration):
+    """Create a table from a calibration string
+
+    Keyword arguments:
+      calibration -- (string) Comma separated kelvin:percentage points (example: "2700:0,4000:40,6500:100")
+
+    return: (MilightKelvinTable) Kelvin table
+    """
+    points = []
+    for point in calibration.split(","):
+      if point.strip() != "":
+        kelvin, percentage = point.split(":")
+        points.append((int(kelvin), int(percentage)))
+    return MilightKelvinTable(points)
+
+  def clamp(self, kelvin):
+    """Give the nearest temperature supported by the calibration
+
+    Keyword arguments:
+      kelvin -- (int) Temperature in Kelvin
+
+    return: (int) Temperature in Kelvin
+    """
+    return min(max(int(kelvin), self.minKelvin), self.maxKelvin)
+
+  def toTemperature(self, kelvin):
+    """Convert a Kelvin temperature (see MilightWifiBridge.setTemperature())
+
+    Keyword arguments:
+      kelvin -- (int) Temperature in Kelvin (clamped to the calibration)
+
+    return: (int) Temperature percentage (between 0 and 100)
+    """
+    return self.table[self.clamp(kelvin) - self.minKelvin]
+
+  def buildFrame(self, kelvin, zoneId):
+    """Build the request frame setting a Kelvin temperature to a zone (see MilightWifiBridge.sendFrames())
+
+    Keyword arguments:
+      kelvin -- (int) Temperature in Kelvin (clamped to the calibration)
+      zoneId -- (int or MilightWifiBridge.eZone) Zone ID
+
+    return: (bytearray) Set temperature request frame
+    """
+    return MilightWifiBridge.buildCommandFrame("setTemperature", zoneId, self.toTemperature(kelvin))
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  Custom effects for Milight 3.0 (LimitlessLED Wifi Bridge v6.0) lights
+
+  An effect is a list of keyframes (color, brightness and/or saturation of a zone at a given time).
+  It is compiled once into a stream of ready-to-send frames (one 22 bytes frame per changed attribute
+  and per step) which is then played by a paced player on one or more wifi bridges. The wifi bridges must
+  keep their session, otherwise each step pays a start session:
+
+    milight = MilightWifiBridge()
+    milight.setup(ip="192.168.1.23", port=5987, timeout_sec=1.0, keepSession=True)
+
+    effect = MilightEffect(loop=True)
+    effect.addKeyframe(0.0, MilightWifiBridge.eZone.ONE, color=MilightWifiBridge.eColor.RED, brightness=100)
+    effect.addKeyframe(2.0, MilightWifiBridge.eZone.ONE, color=MilightWifiBridge.eColor.BLUE, brightness=20)
+    effect.addKeyframe(4.0, MilightWifiBridge.eZone.ONE, color=MilightWifiBridge.eColor.RED, brightness=100)
+
+    player = MilightEffectPlayer(effect.compile(stepSec=0.2), [milight])
+    player.start()
+    ...
+    player.stop()
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from MilightWifiBridge import MilightWifiBridge
+
+# Keyframe of an effect
+# Keyword arguments:
+#   time -- (float) Time of the keyframe in sec (from the start of the effect)
+#   zoneId -- (int) Zone ID
+#   color -- (int or None) Milight color (between 0x00 and 0xFF), None if not changed by this keyframe
+#   brightness -- (int or None) Brightness percentage, None if not changed by this keyframe
+#   saturation -- (int or None) Saturation percentage, None if not changed by this keyframe
+MilightKeyframe = collections.namedtuple("MilightKeyframe", "time zoneId color brightness saturation")
+
+# Statistics of a played effect
+# Keyword arguments:
+#   steps -- (int) Number of played steps
+#   frames -- (int) Number of frames sent (all bridges)
+#   failures -- (int) Number of frames not acknowledged by a wifi bridge
+#   lateSteps -- (int) Number of steps started after their scheduled time (counted for each wifi bridge)
+#   maxJitter -- (float) Maximum delay in sec between the scheduled and the real start of a step
+MilightEffectStatistics = collections.namedtuple("MilightEffectStatistics", "steps frames failures lateSteps maxJitter")
+
+
+class MilightEffect:
+  """Custom effect defined with keyframes (compile() must be called to play it)"""
+
+  # Attribute name, action (see MilightWifiBridge.buildCommandFrame()) and maximum value of the attributes which
+  # can be animated
+  ATTRIBUTES = (("color", "setColor", 0xFF), ("saturation", "setSaturation", 100), ("brightness", "setBrightness", 100))
+
+  def __init__(self, loop=False):
+    """Create an empty effect
+
+    Keyword arguments:
+      loop -- (bool, optional) Effect must be played in loop (last keyframe should be equal to the first one)
+    """
+    self.loop = loop
+    self.__keyframes = []
+
+  def addKeyframe(self, timeSec, zoneId, color=None, brightness=None, saturation=None):
+    """Add a keyframe to the effect
+
+    Keyword arguments:
+      timeSec -- (float) Time of the keyframe in sec (from the start of the effect)
+      zoneId -- (int or MilightWifiBridge.eZone) Zone ID
+      color -- (int or MilightWifiBridge.eColor, optional) Milight color (between 0x00 and 0xFF)
+      brightness -- (int, optional) Brightness percentage (between 0 and 100)
+      saturation -- (int, optional) Saturation percentage (between 0 and 100)
+
+    return: (MilightEffect) The effect (so that keyframes can be chained)
+    """
+    if float(timeSec) < 0:
+      raise ValueError("Invalid keyframe time {} (must be positive)".format(str(timeSec)))
+    if int(zoneId) < 0 or int(zoneId) > 4:
+      raise ValueError("Invalid zone {} (must be between 0 and 4)".format(str(zoneId)))
+
+    self.__keyframes.append(MilightKeyframe(time=float(timeSec), zoneId=int(zoneId), color=color,
+                                            brightness=brightness, saturation=saturation))
+    return self
+
+  @staticmethod
+  def __interpolate(attribute, start, end, ratio):
+    """Interpolate an attribute value between two keyframes
+
+    Note: Milight colors are a hue circle so the shortest way around the circle is used
+
+    Keyword arguments:
+      attribute -- (string) Attribute name
+      start -- (int) Value of the previous keyframe
+      end -- (int) Value of the next keyframe
+      ratio -- (float) Position between both keyframes (between 0 and 1)
+
+    return: (int) Interpolated value
+    """
+    if attribute == "color":
+      delta = ((end - start + 0x80) & 0xFF) - 0x80
+      return int(round(start + delta * ratio)) & 0xFF
+    return int(round(start + (end - start) * ratio))
+
+  def compile(self, stepSec=0.1):
+    """Compile the effect into a stream of ready-to-send frames
+
+    Note: A frame is only generated when an attribute of a zone changed since the previous step
+
+    Keyword arguments:
+      stepSec -- (float, optional) Time between two steps in sec
+
+    return: (MilightCompiledEffect) Compiled effect
+    """
+    if stepSec <= 0:
+      raise ValueError("Invalid step {} (must be more than 0sec)".format(str(stepSec)))
+    if not self.__keyframes:
+      raise ValueError("An effect needs at least one keyframe")
+
+    # Timeline of each animated attribute of each zone: [(time, value), ...] sorted by time
+    timelines = {}
+    for keyframe in sorted(self.__keyframes, key=lambda k: k.time):
+      for attribute, action, maxValue in MilightEffect.ATTRIBUTES:
+        value = getattr(keyframe, attribute)
+        if value is not None:
+          value = min(max(int(value), 0), maxValue)
+          timelines.setdefault((keyframe.zoneId, attribute), []).append((keyframe.time, value))
+
+    duration = max(k.time for k in self.__keyframes)
+    stepCount = int(round(duration / stepSec)) + (0 if self.loop else 1)
+    stepCount = max(stepCount, 1)
+
+    # Pre-build every frame once for every possible value of each attribute/zone which is used
+    frameCache = {}
+    frames = bytearray()
+    stepOffsets = [0]
+    lastValues = {}
+
+    for step in range(stepCount):
+      t = step * stepSec
+      for (zoneId, attribute), timeline in sorted(timelines.items()):
+        # Find surrounding keyframes
+        value = timeline[-1][1]
+        if t <= timeline[0][0]:
+          value = timeline[0][1]
+        else:
+          for (startTime, startValue), (endTime, endValue) in zip(timeline, timeline[1:]):
+            if startTime <= t <= endTime:
+              ratio = 0.0 if endTime == startTime else (t - startTime) / (endTime - startTime)
+              value = MilightEffect.__interpolate(attribute, startValue, endValue, ratio)
+              break
+
+        if lastValues.get((zoneId, attribute)) == value:
+          continue
+        lastValues[(zoneId, attribute)] = value
+
+        frame = frameCache.get((zoneId, attribute, value))
+        if frame is None:
+          action = [a[1] for a in MilightEffect.ATTRIBUTES if a[0] == attribute][0]
+          frame = bytes(MilightWifiBridge.buildCommandFrame(action, zoneId, value))
+          frameCache[(zoneId, attribute, value)] = frame
+        frames += frame
+      stepOffsets.append(len(frames) // 22)
+
+    logging.debug("Effect compiled in {} steps and {} frames".format(str(stepCount), str(len(frames) // 22)))
+    return MilightCompiledEffect(frames, stepOffsets, stepSec, self.loop)
+
+
+class MilightCompiledEffect:
+  """Effect compiled into a contiguous stream of frames (see MilightEffect.compile())"""
+
+  def __init__(self, frames, stepOffsets, stepSec, loop):
+    """Create a compiled effect
+
+    Keyword arguments:
+      frames -- (bytearray) All frames of the effect (22 bytes per frame)
+      stepOffsets -- (list of int) Index of the first frame of each step (plus the total number of frames)
+      stepSec -- (float) Time between two steps in sec
+      loop -- (bool) Effect must be played in loop
+    """
+    self.frames = frames
+    self.stepOffsets = stepOffsets
+    self.stepSec = stepSec
+    self.loop = loop
+
+    # Views of the frames of each step (created once, frames are updated in place when sent)
+    view = memoryview(self.frames)
+    self.steps = tuple(tuple(view[index * 22:(index + 1) * 22] for index in range(start, end))
+                       for start, end in zip(stepOffsets, stepOffsets[1:]))
+
+  def copy(self):
+    """Copy the compiled effect (frames are updated in place when sent, each wifi bridge needs its own copy)
+
+    return: (MilightCompiledEffect) Copy of the effect
+    """
+    return MilightCompiledEffect(bytearray(self.frames), self.stepOffsets, self.stepSec, self.loop)
+
+  def __len__(self):
+    """return: (int) Number of steps"""
+    return len(self.steps)
+
+  def frameCount(self):
+    """return: (int) Number of frames"""
+    return len(self.frames) // 22
+
+  def duration(self):
+    """return: (float) Duration of one play of the effect in sec"""
+    return len(self.steps) * self.stepSec
+
+
+class MilightEffectPlayer:
+  """Play a compiled effect on one or more wifi bridges with a fixed pace
+
+  Each wifi bridge is streamed by its own thread on the same schedule, so that a slow or unreachable wifi
+  bridge does not delay the steps of the other ones.
+  """
+
+  def __init__(self, compiledEffect, bridges):
+    """Create an effect player
+
+    Keyword arguments:
+      compiledEffect -- (MilightCompiledEffect) Effect to play
+      bridges -- (list of MilightWifiBridge) Wifi bridges to stream the effect to, initialized with
+                                             keepSession=True (otherwise each step starts a new session)
+    """
+    self.effect = compiledEffect
+    self.bridges = list(bridges)
+    # Frames are updated in place when sent, so each wifi bridge streams its own copy of the effect
+    self.__effects = [compiledEffect] + [compiledEffect.copy() for bridge in self.bridges[1:]]
+    self.__stopEvent = threading.Event()
+    self.__thread = None
+    self.statistics = MilightEffectStatistics(steps=0, frames=0, failures=0, lateSteps=0, maxJitter=0.0)
+
+  def play(self, loops=1):
+    """Play the effect (blocking)
+
+    Note: Steps are scheduled from the start time of the effect so that late steps do not delay the next ones
+
+    Keyword arguments:
+      loops -- (int, optional) Number of plays for a looping effect (0 for infinite, until stop() is called)
+
+    return: (MilightEffectStatistics) Playing statistics
+    """
+    self.__stopEvent.clear()
+    if not self.effect.loop:
+      loops = 1
+
+    startTime = time.monotonic()
+    results = [None] * len(self.bridges)
+    threads = []
+    for index in range(1, len(self.bridges)):
+      thread = threading.Thread(target=self.__playOnBridge, args=(index, startTime, loops, results),
+                                name="milight-effect-" + str(index), daemon=True)
+      thread.start()
+      threads.append(thread)
+    if self.bridges:
+      self.__playOnBridge(0, startTime, loops, results)
+    for thread in threads:
+      thread.join()
+
+    results = [result for result in results if result is not None]
+    self.statistics = MilightEffectStatistics(steps=max([result.steps for result in results] + [0]),
+                                              frames=sum(result.frames for result in results),
+                                              failures=sum(result.failures for result in results),
+                                              lateSteps=sum(result.lateSteps for result in results),
+                                              maxJitter=max([result.maxJitter for result in results] + [0.0]))
+    logging.debug("Effect played: {}".format(str(self.statistics)))
+    return self.statistics
+
+  def __playOnBridge(self, index, startTime, loops, results):
+    """Stream the effect to a wifi bridge (the frames of a step are pipelined)
+
+    Keyword arguments:
+      index -- (int) Index of the wifi bridge
+      startTime -- (float) Start time of the effect (monotonic clock)
+      loops -- (int) Number of plays (0 for infinite, until stop() is called)
+      results -- (list of MilightEffectStatistics) Statistics of each wifi bridge to complete
+    """
+    bridge = self.bridges[index]
+    stepSec = self.__effects[index].stepSec
+    playedSteps = sentFrames = failures = lateSteps = 0
+    maxJitter = 0.0
+
+    play = 0
+    while (loops == 0 or play < loops) and not self.__stopEvent.is_set():
+      for stepFrames in self.__effects[index].steps:
+        # Wait for the scheduled time of the step
+        scheduledTime = startTime + playedSteps * stepSec
+        delay = scheduledTime - time.monotonic()
+        if delay > 0:
+          if self.__stopEvent.wait(delay):
+            break
+        elif delay < 0:
+          lateSteps += 1
+          maxJitter = max(maxJitter, -delay)
+
+        if stepFrames:
+          stepResults = bridge.sendFrames(list(stepFrames))
+          sentFrames += len(stepFrames)
+          failures += len(stepFrames) if stepResults == False else stepResults.count(None)
+        playedSteps += 1
+      play += 1
+
+    results[index] = MilightEffectStatistics(steps=playedSteps, frames=sentFrames, failures=failures,
+                                             lateSteps=lateSteps, maxJitter=maxJitter)
+
+  def start(self, loops=0):
+    """Play the effect in background
+
+    Keyword arguments:
+      loops -- (int, optional) Number of plays for a looping effect (0 for infinite, until stop() is called)
+    """
+    self.stop()
+    self.__thread = threading.Thread(target=self.play, args=(loops,), daemon=True)
+    self.__thread.start()
+
+  def stop(self):
+    """Stop the effect played in background"""
+    self.__stopEvent.set()
+    if self.__thread is not None:
+      self.__thread.join()
+      self.__thread = None
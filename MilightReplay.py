@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  Replay of Milight 3.0 (LimitlessLED Wifi Bridge v6.0) traffic captures
+
+  Captures are recorded with MilightWifiBridge.py '--capture' option or with MilightWifiBridge.setCapture().
+  The requests of a capture are sent again (with new session IDs and sequence numbers) to a local wifi bridge
+  stand-in or to a real wifi bridge, at the original pace or as fast as possible, so that timing problems can
+  be reproduced and benchmarked offline:
+
+    python MilightReplay.py --file /tmp/milight.cap --speed 1
+    python MilightReplay.py --file /tmp/milight.cap --speed 0 --ackDelay 20
+    python MilightReplay.py --file /tmp/milight.cap --ip 192.168.1.23
+"""
+
+import collections
+import getopt
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+
+from MilightWifiBridge import MilightWifiBridge, MilightTrafficCapture
+
+# Result of the replay of the requests sent to a wifi bridge
+# Keyword arguments:
+#   host -- (string) IP of the wifi bridge in the capture
+#   requests -- (int) Number of requests replayed
+#   acknowledged -- (int) Number of requests acknowledged
+#   averageRtt -- (float) Average time in sec between a request and its ACK, None if no request was acknowledged
+#   maxRtt -- (float) Maximum time in sec between a request and its ACK, None if no request was acknowledged
+#   lateRequests -- (int) Number of requests sent after their scheduled time
+#   maxLateness -- (float) Maximum delay in sec between the scheduled and the real sending of a request
+#   duration -- (float) Duration of the replay in sec
+MilightReplayResult = collections.namedtuple("MilightReplayResult", "host requests acknowledged averageRtt maxRtt "
+                                                                    "lateRequests maxLateness duration")
+
+
+class MilightBridgeStandIn:
+  """Local stand-in of a wifi bridge answering start sessions and keep alives and acknowledging requests
+
+  Faults of a lossy Wi-Fi link can be injected (lost requests, lost, duplicated or reordered answers), the
+  requests which reached the stand-in are applied to its zones so that they can be compared with the state
+  expected by the client.
+  """
+
+  def __init__(self, ip="127.0.0.1", port=0, ackDelay=0.0, mac=(0xF0, 0xFE, 0x6B, 0x00, 0x00, 0x01),
+               requestLoss=0.0, answerLoss=0.0, duplicate=0.0, reorder=0.0, seed=None):
+    """Create the stand-in (start() must be called)
+
+    Keyword arguments:
+      ip -- (string, optional) IP to listen on
+      port -- (int, optional) UDP port to listen on (0 for any free port)
+      ackDelay -- (float, optional) Delay in sec before answering
+      mac -- (tuple of int, optional) MAC address given in the start session responses
+      requestLoss -- (float, optional) Percentage of frames lost before reaching the stand-in (not applied)
+      answerLoss -- (float, optional) Percentage of answers lost (the request is applied)
+      duplicate -- (float, optional) Percentage of answers sent twice
+      reorder -- (float, optional) Percentage of answers delayed by up to 50ms (so that later answers arrive first)
+      seed -- (int, optional) Seed of the fault injection (for reproducible runs)
+    """
+    self.ackDelay = ackDelay
+    self.requests = 0
+    self.requestLoss = requestLoss
+    self.answerLoss = answerLoss
+    self.duplicate = duplicate
+    self.reorder = reorder
+    self.__random = random.Random(seed)
+
+    # Zone ID => {command type: value} of the requests applied (see applyFrame())
+    self.zones = dict((zoneId, {}) for zoneId in range(1, 5))
+    self.applied = 0
+    self.handshakes = 0
+    self.keepAlives = 0
+    self.__mac = bytearray(mac)
+    self.__sessionId = 0
+    self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.__sock.bind((ip, port))
+    self.__sock.settimeout(0.5)
+    self.address = self.__sock.getsockname()
+    self.__stopEvent = threading.Event()
+    self.__thread = None
+
+  def start(self):
+    """Start answering in background"""
+    self.__stopEvent.clear()
+    self.__thread = threading.Thread(target=self.__run, daemon=True)
+    self.__thread.start()
+
+  def stop(self):
+    """Stop answering and close the socket"""
+    self.__stopEvent.set()
+    if self.__thread is not None:
+      self.__thread.join()
+      self.__thread = None
+    self.__sock.close()
+
+  def dropSession(self):
+    """Forget the current session (like a wifi bridge after a reboot or a long idle time)"""
+    self.__sessionId = (self.__sessionId + 1) & 0xFF
+
+  @staticmethod
+  def applyFrame(zones, frame):
+    """Apply a request frame to the state of the zones
+
+    Note: Only the last value of each command type is kept ('Light on' and 'Light off' share a type)
+
+    Keyword arguments:
+      zones -- (dict) Zone ID => {command type: value}
+      frame -- (bytes) Request frame (22 bytes)
+    """
+    commandType = frame[14]
+    value = frame[15]
+    zoneIds = range(1, 5) if frame[19] == 0 else [frame[19]]
+    for zoneId in zoneIds:
+      if zoneId in zones:
+        zones[zoneId][commandType] = value
+
+  def __answer(self, response, address):
+    """Send a response (after the configured delay, unless it is lost)
+
+    Keyword arguments:
+      response -- (bytearray) Response frame
+      address -- (tuple) Address of the client
+    """
+    if self.__random.uniform(0, 100) < self.answerLoss:
+      return
+    delay = self.ackDelay
+    if self.__random.uniform(0, 100) < self.reorder:
+      delay += self.__random.uniform(0.0, 0.05)
+    copies = 2 if self.__random.uniform(0, 100) < self.duplicate else 1
+    for copy in range(copies):
+      if delay > 0:
+        threading.Timer(delay, self.__send, (response, address)).start()
+      else:
+        self.__send(response, address)
+
+  def __send(self, response, address):
+    """Send a response (the socket may be closed in the meantime)
+
+    Keyword arguments:
+      response -- (bytearray) Response frame
+      address -- (tuple) Address of the client
+    """
+    try:
+      self.__sock.sendto(response, address)
+    except socket.error:
+      pass
+
+  def __run(self):
+    """Answer the requests until stop() is called"""
+    buffer = bytearray(64)
+    while not self.__stopEvent.is_set():
+      try:
+        size, address = self.__sock.recvfrom_into(buffer)
+      except socket.timeout:
+        continue
+      except socket.error:
+        if self.__stopEvent.is_set():
+          return
+        continue
+
+      if self.__random.uniform(0, 100) < self.requestLoss:
+        continue
+
+      if size == 27 and buffer[0] == 0x20:
+        self.handshakes += 1
+        self.__sessionId = (self.__sessionId + 1) & 0xFF
+        response = bytearray(22)
+        response[0:5] = bytearray([0x28, 0x00, 0x00, 0x00, 0x11])
+        response[7:13] = self.__mac
+        response[19] = self.__sessionId
+        response[20] = 0x01
+        self.__answer(response, address)
+      elif size == 22 and buffer[0] == 0x80:
+        self.requests += 1
+        if self.__sessionId == buffer[5]:
+          self.applied += 1
+          MilightBridgeStandIn.applyFrame(self.zones, buffer[:22])
+        self.__answer(bytearray([0x88, 0x00, 0x00, 0x00, 0x03, 0x00, buffer[8], 0x00]), address)
+      elif size == 7 and buffer[0] == 0xD0:
+        # Keep alive of the current session only (a dropped session is not answered)
+        self.keepAlives += 1
+        if self.__sessionId == buffer[5]:
+          self.__answer(bytearray([0xD8, 0x00, 0x00, 0x00, 0x07]) + self.__mac + bytearray([0x01]), address)
+
+
+class MilightReplayer:
+  """Replay the requests of a capture"""
+
+  # Delay in sec after which a request is counted as late
+  LATENESS_TOLERANCE = 0.001
+
+  def __init__(self, records, speed=1.0, timeout=1.0):
+    """Prepare a replay
+
+    Keyword arguments:
+      records -- (list of MilightCaptureRecord) Recorded frames (see MilightTrafficCapture.read())
+      speed -- (float, optional) Replay speed (1 for the original pace, 0 for as fast as possible)
+      timeout -- (float, optional) Timeout in sec for a wifi bridge to answer a request
+    """
+    self.speed = speed
+    self.timeout = timeout
+
+    # Requests of each captured wifi bridge (start sessions are done again by the client)
+    self.requests = collections.OrderedDict()
+    for record in records:
+      if record.direction == MilightTrafficCapture.OUTGOING and len(record.frame) == 22 and record.frame[0] == 0x80:
+        self.requests.setdefault((record.host, record.port), []).append(record)
+
+  def replay(self, target=None):
+    """Replay the requests (wifi bridges in parallel, the requests of a wifi bridge in order)
+
+    Keyword arguments:
+      target -- (function, optional) Give the (ip, port) to replay the requests of a captured (ip, port) to
+                                     (captured wifi bridge if not set)
+
+    return: (list of MilightReplayResult) Result of each wifi bridge
+    """
+    results = {}
+    startTime = time.monotonic() + 0.1
+    threads = []
+    for bridge, requests in self.requests.items():
+      address = target(bridge) if target is not None else bridge
+      thread = threading.Thread(target=lambda b=bridge, a=address, r=requests:
+                                results.__setitem__(b, self.__replayBridge(b[0], a, r, startTime)))
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+    return [results[bridge] for bridge in self.requests]
+
+  def __replayBridge(self, host, address, requests, startTime):
+    """Replay the requests of a wifi bridge
+
+    Keyword arguments:
+      host -- (string) IP of the wifi bridge in the capture
+      address -- (tuple) IP and port to send the requests to
+      requests -- (list of MilightCaptureRecord) Requests to replay
+      startTime -- (float) Time (monotonic clock) of the start of the capture
+
+    return: (MilightReplayResult) Replay result
+    """
+    milight = MilightWifiBridge()
+    if not milight.setup(address[0], address[1], self.timeout, keepSession=True):
+      return MilightReplayResult(host=host, requests=len(requests), acknowledged=0, averageRtt=None, maxRtt=None,
+                                 lateRequests=0, maxLateness=0.0, duration=0.0)
+
+    rtts = []
+    lateRequests = 0
+    maxLateness = 0.0
+    firstTime = requests[0].time
+    delay = startTime - time.monotonic()
+    if delay > 0:
+      time.sleep(delay)
+
+    index = 0
+    while index < len(requests):
+      # Requests due at the same time are sent pipelined (as they were when captured)
+      batch = [requests[index]]
+      if self.speed > 0:
+        delay = startTime + (requests[index].time - firstTime) / self.speed - time.monotonic()
+        if delay > 0:
+          time.sleep(delay)
+        now = time.monotonic()
+        while index + len(batch) < len(requests) and \
+              startTime + (requests[index + len(batch)].time - firstTime) / self.speed <= now:
+          batch.append(requests[index + len(batch)])
+        for request in batch:
+          lateness = now - (startTime + (request.time - firstTime) / self.speed)
+          if lateness > MilightReplayer.LATENESS_TOLERANCE:
+            lateRequests += 1
+            maxLateness = max(maxLateness, lateness)
+      else:
+        batch = requests[index:]
+      index += len(batch)
+
+      for rtt in milight.sendFrames([bytearray(request.frame) for request in batch]):
+        if rtt is not None:
+          rtts.append(rtt)
+    duration = time.monotonic() - startTime
+    milight.close()
+
+    return MilightReplayResult(host=host, requests=len(requests), acknowledged=len(rtts),
+                               averageRtt=sum(rtts) / len(rtts) if rtts else None, maxRtt=max(rtts) if rtts else None,
+                               lateRequests=lateRequests, maxLateness=maxLateness, duration=duration)
+
+
+def __help():
+  """Show help on how to use the replay tool"""
+  print("Replay the requests of a Milight traffic capture\r\n"
+        +"\r\n"
+        +"Usage:\r\n"
+        +__file__+" -f [capture file] [options]\r\n"
+        +"\r\n"
+        +"Options:\r\n"
+        +"  -f, --file [file]: Capture file (recorded with MilightWifiBridge.py --capture)\r\n"
+        +"  -s, --speed [speed]: Replay speed (default: 1 for the original pace, 0 for as fast as possible)\r\n"
+        +"  -i, --ip [ip]: Replay to a real wifi bridge instead of a local stand-in\r\n"
+        +"  -p, --port [port]: UDP port of the wifi bridge (default: 5987)\r\n"
+        +"  -t, --timeout [timeout]: Timeout in sec for the wifi bridge to answer (default: 1)\r\n"
+        +"  -d, --ackDelay [ms]: Delay of the answers of the local stand-in (default: 0)\r\n"
+        +"  -x, --dump: Print the frames of the capture instead of replaying them\r\n"
+        +"  -l, --debug: Show debug logs\r\n"
+        +"\r\n"
+        +"Example:\r\n"
+        +__file__+" --file /tmp/milight.cap --speed 0 --ackDelay 20\r\n")
+
+
+def main(parsed_args=sys.argv[1:]):
+  """Shell replay function"""
+  logging.getLogger().setLevel(logging.CRITICAL)
+
+  path = ""
+  speed = 1.0
+  ip = ""
+  port = 5987
+  timeout = 1.0
+  ackDelay = 0.0
+  dump = False
+
+  try:
+    opts, args = getopt.getopt(parsed_args, "f:s:i:p:t:d:xlh",
+                               ["file=", "speed=", "ip=", "port=", "timeout=", "ackDelay=", "dump", "debug", "help"])
+  except getopt.GetoptError as err:
+    print("[ERROR] "+str(err))
+    __help()
+    sys.exit(1)
+
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      __help()
+      sys.exit(0)
+    elif o in ("-f", "--file"):
+      path = str(a)
+    elif o in ("-s", "--speed"):
+      speed = float(a)
+    elif o in ("-i", "--ip"):
+      ip = str(a)
+    elif o in ("-p", "--port"):
+      port = int(a)
+    elif o in ("-t", "--timeout"):
+      timeout = float(a)
+    elif o in ("-d", "--ackDelay"):
+      ackDelay = float(a) / 1000.0
+    elif o in ("-x", "--dump"):
+      dump = True
+    elif o in ("-l", "--debug"):
+      logging.getLogger().setLevel(logging.DEBUG)
+
+  if path == "":
+    print("[ERROR] You need to specify a capture file\r\n")
+    __help()
+    sys.exit(1)
+
+  try:
+    records = list(MilightTrafficCapture.read(path))
+  except (IOError, ValueError) as err:
+    print("[ERROR] Impossible to read capture {}: {}".format(path, str(err)))
+    sys.exit(1)
+
+  if dump:
+    for record in records:
+      print("{:10.6f} {} {}:{} seq {:3d} {}".format(record.time,
+                                                   "->" if record.direction == MilightTrafficCapture.OUTGOING else "<-",
+                                                   record.host, record.port, record.sequenceNumber, record.frame.hex()))
+    sys.exit(0)
+
+  replayer = MilightReplayer(records, speed, timeout)
+  if len(replayer.requests) == 0:
+    print("[ERROR] No request in capture {}".format(path))
+    sys.exit(1)
+
+  standIns = {}
+  if ip != "":
+    target = lambda bridge: (ip, port)
+  else:
+    # One local stand-in per captured wifi bridge
+    standIns = {bridge: MilightBridgeStandIn(ackDelay=ackDelay) for bridge in replayer.requests}
+    for standIn in standIns.values():
+      standIn.start()
+    target = lambda bridge: standIns[bridge].address
+
+  returnValue = True
+  for result in replayer.replay(target):
+    returnValue &= result.acknowledged == result.requests
+    print("{}: {}/{} acknowledged, rtt avg {} max {}, {} late (max {:.1f}ms), {:.3f}s"
+          .format(result.host, result.acknowledged, result.requests,
+                  "-" if result.averageRtt is None else "{:.1f}ms".format(result.averageRtt * 1000.0),
+                  "-" if result.maxRtt is None else "{:.1f}ms".format(result.maxRtt * 1000.0),
+                  result.lateRequests, result.maxLateness * 1000.0, result.duration))
+
+  for standIn in standIns.values():
+    standIn.stop()
+
+  sys.exit(0 if returnValue else 1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+  Soak test of the Milight 3.0 (LimitlessLED Wifi Bridge v6.0) clients on a lossy network
+
+  Random zone commands are sent for a given duration to a local wifi bridge stand-in injecting the faults of
+  a bad Wi-Fi link (lost, duplicated and reordered packets). A failed command is retried once after a new
+  setup and, if the retry fails too, kept until it is sent again before the next commands, unless a later
+  command of the same type supersedes it (like the node server does). The test reports the goodput, the retransmissions, the false negatives
+  (command applied by the wifi bridge but reported as failed) and the divergence between the state expected
+  by the client and the state of the wifi bridge:
+
+    python MilightSoak.py --duration 60 --loss 5
+    python MilightSoak.py --duration 600 --loss 10 --duplicate 2 --reorder 5 --shared
+"""
+
+import collections
+import getopt
+import logging
+import random
+import sys
+import time
+
+from MilightWifiBridge import MilightWifiBridge, MilightSharedWifiBridge, MilightBridgeStatistics
+from MilightReplay import MilightBridgeStandIn
+
+# Result of a soak test
+# Keyword arguments:
+#   duration -- (float) Duration of the test in sec
+#   commands -- (int) Number of commands
+#   succeeded -- (int) Number of commands reported as succeeded (first try or retry)
+#   retransmissions -- (int) Number of commands retried after a failure
+#   resent -- (int) Number of failed commands sent again later
+#   falseNegatives -- (int) Number of commands reported as failed but applied by the wifi bridge
+#   falsePositives -- (int) Number of commands reported as succeeded but not applied by the wifi bridge
+#   handshakes -- (int) Number of start sessions received by the wifi bridge
+#   goodput -- (float) Commands reported as succeeded per sec
+#   p50Latency -- (float) Median duration in sec of a command (retry included), None if no command
+#   p99Latency -- (float) 99th percentile duration in sec of a command (retry included), None if no command
+#   divergence -- (int) Number of zone attributes whose expected value differs from the wifi bridge one at the end
+MilightSoakResult = collections.namedtuple("MilightSoakResult", "duration commands succeeded retransmissions resent "
+                                                                "falseNegatives falsePositives handshakes goodput "
+                                                                "p50Latency p99Latency divergence")
+
+
+class MilightSoakTest:
+  """Soak test of a client against a fault injecting wifi bridge stand-in"""
+
+  # Commands sent by the test: action and value range
+  ACTIONS = (("turnOn", None), ("turnOff", None), ("setBrightness", (0, 100)), ("setColor", (0, 255)),
+             ("setSaturation", (0, 100)))
+
+  def __init__(self, standIn, shared=False, timeout=0.2, seed=None):
+    """Prepare a soak test
+
+    Keyword arguments:
+      standIn -- (MilightBridgeStandIn) Started wifi bridge stand-in
+      shared -- (bool, optional) Test MilightSharedWifiBridge instead of MilightWifiBridge
+      timeout -- (float, optional) Timeout in sec for the wifi bridge to answer
+      seed -- (int, optional) Seed of the random commands (for reproducible runs)
+    """
+    self.standIn = standIn
+    self.timeout = timeout
+    self.statistics = MilightBridgeStatistics()
+    self.milight = MilightSharedWifiBridge(self.statistics) if shared else MilightWifiBridge(self.statistics)
+    self.__random = random.Random(seed)
+
+    # Zone ID => {command type: value} of the commands reported as succeeded
+    self.expectedZones = dict((zoneId, {}) for zoneId in range(1, 5))
+
+    # (zone ID, command type) => frame of the failed commands not superseded yet
+    self.pendingFrames = collections.OrderedDict()
+
+  def __setup(self):
+    """Setup the client (as the node server does after a failure)"""
+    return self.milight.setup(self.standIn.address[0], self.standIn.address[1], self.timeout, keepSession=True)
+
+  def __randomFrame(self):
+    """Build the frame of a random command
+
+    return: (bytearray) Request frame
+    """
+    action, valueRange = self.__random.choice(MilightSoakTest.ACTIONS)
+    value = None if valueRange is None else self.__random.randint(valueRange[0], valueRange[1])
+    return MilightWifiBridge.buildCommandFrame(action, self.__random.randint(1, 4), value)
+
+  def __sendPending(self):
+    """Send again the failed commands (applied to the expected state once acknowledged)
+
+    return: (int) Number of commands sent
+    """
+    sent = 0
+    for key, frame in list(self.pendingFrames.items()):
+      if not self.milight.sendFrame(frame):
+        self.__setup()
+        break
+      sent += 1
+      MilightBridgeStandIn.applyFrame(self.expectedZones, frame)
+      del self.pendingFrames[key]
+    return sent
+
+  def run(self, duration, rate=0.0):
+    """Run the soak test
+
+    Keyword arguments:
+      duration -- (float) Duration of the test in sec
+      rate -- (float, optional) Commands per sec (0 for as fast as possible)
+
+    return: (MilightSoakResult) Result of the test
+    """
+    commands = succeeded = retransmissions = resent = falseNegatives = falsePositives = 0
+    latencies = []
+    handshakes = self.standIn.handshakes
+    self.__setup()
+
+    startTime = time.monotonic()
+    while time.monotonic() - startTime < duration:
+      if rate > 0:
+        delay = startTime + commands / float(rate) - time.monotonic()
+        if delay > 0:
+          time.sleep(delay)
+
+      resent += self.__sendPending()
+      frame = self.__randomFrame()
+      commandStart = time.monotonic()
+      applied = self.standIn.applied
+      success = self.milight.sendFrame(frame)
+      if not success:
+        retransmissions += 1
+        self.__setup()
+        success = self.milight.sendFrame(frame)
+      latencies.append(time.monotonic() - commandStart)
+      commands += 1
+
+      # Requests are applied by the stand-in as soon as they are received
+      wasApplied = self.standIn.applied > applied
+      key = (frame[19], frame[14])
+      if success:
+        succeeded += 1
+        MilightBridgeStandIn.applyFrame(self.expectedZones, frame)
+        self.pendingFrames.pop(key, None)
+        if not wasApplied:
+          falsePositives += 1
+      else:
+        self.pendingFrames.pop(key, None)
+        self.pendingFrames[key] = frame
+        if wasApplied:
+          falseNegatives += 1
+
+    elapsed = time.monotonic() - startTime
+    # Failed commands still kept are given a few more tries before comparing the states
+    for attempt in range(5):
+      if not self.pendingFrames:
+        break
+      resent += self.__sendPending()
+    self.milight.close()
+
+    divergence = 0
+    for zoneId, expected in self.expectedZones.items():
+      actual = self.standIn.zones[zoneId]
+      for commandType in set(expected) | set(actual):
+        if expected.get(commandType) != actual.get(commandType):
+          divergence += 1
+
+    latencies.sort()
+    return MilightSoakResult(duration=elapsed, commands=commands, succeeded=succeeded, retransmissions=retransmissions,
+                             resent=resent, falseNegatives=falseNegatives, falsePositives=falsePositives,
+                             handshakes=self.standIn.handshakes - handshakes,
+                             goodput=succeeded / elapsed if elapsed > 0 else 0.0,
+                             p50Latency=latencies[len(latencies) // 2] if latencies else None,
+                             p99Latency=latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else None,
+                             divergence=divergence)
+
+
+def __help():
+  """Show help on how to use the soak test"""
+  print("Soak test of the Milight client against a local wifi bridge stand-in injecting network faults\r\n"
+        +"\r\n"
+        +"Usage:\r\n"
+        +__file__+" [options]\r\n"
+        +"\r\n"
+        +"Options:\r\n"
+        +"  -d, --duration [sec]: Duration of the test (default: 60)\r\n"
+        +"  -r, --rate [commands/sec]: Commands per sec (default: 0 for as fast as possible)\r\n"
+        +"  -L, --loss [%]: Percentage of lost packets, in each direction (default: 5)\r\n"
+        +"  -u, --duplicate [%]: Percentage of duplicated answers (default: 0)\r\n"
+        +"  -o, --reorder [%]: Percentage of reordered answers (default: 0)\r\n"
+        +"  -t, --timeout [sec]: Timeout for the wifi bridge to answer (default: 0.2)\r\n"
+        +"  -s, --seed [seed]: Seed of the faults and commands (default: random)\r\n"
+        +"  -x, --shared: Test the thread safe shared client\r\n"
+        +"  -l, --debug: Show debug logs\r\n"
+        +"\r\n"
+        +"Example:\r\n"
+        +__file__+" --duration 600 --loss 10 --duplicate 2 --reorder 5\r\n")
+
+
+def main(parsed_args=sys.argv[1:]):
+  """Shell soak test function"""
+  logging.getLogger().setLevel(logging.CRITICAL)
+
+  duration = 60.0
+  rate = 0.0
+  loss = 5.0
+  duplicate = 0.0
+  reorder = 0.0
+  timeout = 0.2
+  seed = None
+  shared = False
+
+  try:
+    opts, args = getopt.getopt(parsed_args, "d:r:L:u:o:t:s:xlh",
+                               ["duration=", "rate=", "loss=", "duplicate=", "reorder=", "timeout=", "seed=",
+                                "shared", "debug", "help"])
+  except getopt.GetoptError as err:
+    print("[ERROR] "+str(err))
+    __help()
+    sys.exit(1)
+
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      __help()
+      sys.exit(0)
+    elif o in ("-d", "--duration"):
+      duration = float(a)
+    elif o in ("-r", "--rate"):
+      rate = float(a)
+    elif o in ("-L", "--loss"):
+      loss = float(a)
+    elif o in ("-u", "--duplicate"):
+      duplicate = float(a)
+    elif o in ("-o", "--reorder"):
+      reorder = float(a)
+    elif o in ("-t", "--timeout"):
+      timeout = float(a)
+    elif o in ("-s", "--seed"):
+      seed = int(a)
+    elif o in ("-x", "--shared"):
+      shared = True
+    elif o in ("-l", "--debug"):
+      logging.getLogger().setLevel(logging.DEBUG)
+
+  if duration <= 0 or timeout <= 0:
+    print("[ERROR] You need to specify a valid duration and timeout (more than 0sec)\r\n")
+    __help()
+    sys.exit(1)
+
+  standIn = MilightBridgeStandIn(requestLoss=loss, answerLoss=loss, duplicate=duplicate, reorder=reorder, seed=seed)
+  standIn.start()
+  soakTest = MilightSoakTest(standIn, shared, timeout, seed)
+  result = soakTest.run(duration, rate)
+  standIn.stop()
+
+  print("Client: {}".format("MilightSharedWifiBridge" if shared else "MilightWifiBridge"))
+  print("Faults: {}% loss, {}% duplicate, {}% reorder".format(loss, duplicate, reorder))
+  print("Commands: {} in {:.1f}s, {} succeeded, {} retransmissions, {} resent".format(result.commands, result.duration,
+                                                                                     result.succeeded, result.retransmissions,
+                                                                                     result.resent))
+  print("Goodput: {:.1f} commands/s".format(result.goodput))
+  print("Latency: p50 {} p99 {}".format("-" if result.p50Latency is None else "{:.1f}ms".format(result.p50Latency * 1000.0),
+                                        "-" if result.p99Latency is None else "{:.1f}ms".format(result.p99Latency * 1000.0)))
+  print("Handshakes: {} ({:.2f} per command)".format(result.handshakes,
+                                                     result.handshakes / float(max(result.commands, 1))))
+  print("False negatives: {}, false positives: {}".format(result.falseNegatives, result.falsePositives))
+  print("Zone state divergence: {} attribute(s)".format(result.divergence))
+
+  sys.exit(0 if result.divergence == 0 else 1)
+
+if __name__ == '__main__':
+  main()
@@ -38,6 +38,14 @@ import collections
 import sys, getopt
 import logging
 import binascii
+import time
+import shlex
+import threading
+import os
+import signal
+import socketserver
+import struct
+import json
 
 class MilightWifiBridge:
   """Milight 3.0 Wifi Bridge class
@@ -295,8 +303,22 @@ class MilightWifiBridge:
 
 
   ################################### INIT ####################################
-  def __init__(self):
-    """Class must be initialized with setup()"""
+  def __init__(self, statistics=None, identity=None):
+    """Class must be initialized with setup()
+
+    Keyword arguments:
+      statistics -- (MilightBridgeStatistics, optional) Statistics to update (can be shared by all instances
+                                                        communicating with the same wifi bridge)
+      identity -- (MilightBridgeIdentity, optional) Identity to update (can be shared by all instances
+                                                    communicating with the same wifi bridge)
+    """
+    self.__statistics = statistics if statistics is not None else MilightBridgeStatistics()
+    self.__identity = identity if identity is not None else MilightBridgeIdentity()
+    self.__capture = None
+
+    # Reception buffer reused by every exchange (responses are 22 bytes at most)
+    self.__recvBuffer = bytearray(64)
+    self.__recvView = memoryview(self.__recvBuffer)
     self.close()
 
 
@@ -305,6 +327,8 @@ class MilightWifiBridge:
     """Close connection with Milight wifi bridge"""
     self.__initialized = False
     self.__sequence_number = 0
+    self.__keepSession = False
+    self.__session = None
 
     try:
       self.__sock.shutdown(socket.SHUT_RDWR)
@@ -315,13 +339,17 @@ class MilightWifiBridge:
     except:
       pass
 
-  def setup(self, ip, port=5987, timeout_sec=5.0):
+  def setup(self, ip, port=5987, timeout_sec=5.0, connected=True, keepSession=False):
     """Initialize the class (can be launched multiple time if setup changed or module crashed)
 
     Keyword arguments:
       ip -- (string) IP to communication with the Milight wifi bridge
       port -- (int, optional) UDP port to communication with the Milight wifi bridge
       timeout_sec -- (int, optional) Timeout in sec for Milight wifi bridge to answer commands
+      connected -- (bool, optional) Connect the UDP socket to the wifi bridge so that the kernel
+                                    drops datagrams coming from any other source
+      keepSession -- (bool, optional) Reuse the session IDs of the previous start session for the next requests
+                                      (a new session is only started after a failed request)
 
     return: (bool) Milight wifi bridge initialized
     """
@@ -334,10 +362,16 @@ class MilightWifiBridge:
       self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
       self.__ip = ip
       self.__port = port
-      #self.__sock.connect((self.__ip, self.__port))
+      self.__address = (socket.gethostbyname(ip), int(port))
+      self.__connected = connected
+      self.__keepSession = keepSession
+      self.__timeout = timeout_sec
+      if connected:
+        self.__sock.connect(self.__address)
       self.__sock.settimeout(timeout_sec)
       self.__initialized = True
-      logging.debug("UDP connection initialized with ip {} and port {}".format(str(ip), str(port)))
+      logging.debug("UDP connection initialized with ip {} and port {} (connected: {})".format(str(ip), str(port),
+                                                                                              str(connected)))
     except (socket.error, socket.herror, socket.gaierror, socket.timeout) as err:
       logging.error("Impossible to initialize the UDP connection with ip {} and port {}: {}".format(str(ip), str(port), str(err)))
 
@@ -345,42 +379,144 @@ class MilightWifiBridge:
 
 
   ######################### INTERNAL UTILITY FUNCTIONS #########################
+  def __send(self, data):
+    """Send a frame to the wifi bridge
+
+    Keyword arguments:
+      data -- (bytearray) Frame to send
+    """
+    # Recorded before sending so that the ACK is always recorded after its request
+    if self.__capture is not None:
+      self.__capture.record(MilightTrafficCapture.OUTGOING, self.__address, data)
+    if self.__connected:
+      self.__sock.send(data)
+    else:
+      self.__sock.sendto(data, self.__address)
+
+  def __drain(self):
+    """Discard every datagram already waiting on the socket (late acks of previous timed out requests)
+
+    return: (int) Number of discarded datagrams
+    """
+    discarded = 0
+    # Note: A socket with a timeout is already non-blocking internally, switching to a null timeout is free
+    self.__sock.settimeout(0.0)
+    try:
+      while True:
+        self.__sock.recv_into(self.__recvBuffer)
+        discarded += 1
+    except (BlockingIOError, InterruptedError):
+      pass
+    except socket.error as err:
+      # Pending ICMP errors (bridge unreachable) are reported here, the next exchange will report it again if needed
+      logging.debug("Error while draining the socket: {}".format(str(err)))
+    finally:
+      self.__sock.settimeout(self.__timeout)
+
+    if discarded > 0:
+      logging.debug("Discarded {} stale datagram(s)".format(str(discarded)))
+    return discarded
+
+  def __receive(self, isExpected):
+    """Wait for a specific frame from the wifi bridge, unexpected frames are discarded until the timeout expires
+
+    Keyword arguments:
+      isExpected -- (function) Return True if the received frame (memoryview) is the expected one
+
+    return: (memoryview) Expected frame (only valid until next reception)
+
+    raise: socket.timeout if the expected frame was not received in time
+    """
+    deadline = time.monotonic() + self.__timeout
+    try:
+      while True:
+        if self.__connected:
+          size = self.__sock.recv_into(self.__recvBuffer)
+        else:
+          size, address = self.__sock.recvfrom_into(self.__recvBuffer)
+          if address != self.__address:
+            logging.debug("Ignoring frame from unexpected source {}".format(str(address)))
+            size = -1
+        if size >= 0:
+          data = self.__recvView[:size]
+          if self.__capture is not None:
+            self.__capture.record(MilightTrafficCapture.INCOMING, self.__address, data)
+          if isExpected(data):
+            return data
+          logging.debug("Discarding unexpected frame '{}'".format(str(binascii.hexlify(data))))
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          raise socket.timeout("timed out")
+        self.__sock.settimeout(remaining)
+    finally:
+      self.__sock.settimeout(self.__timeout)
+
   def __startSession(self):
     """Send start session request and return start session information
 
     return: (MilightWifiBridge.__START_SESSION_RESPONSE) Start session information containing response received,
                                                          mac address and session IDs
     """
-    # Send start session request
-    data_to_send = MilightWifiBridge.__START_SESSION_MSG
-    logging.debug("Sending frame '{}' to {}:{}".format(str(binascii.hexlify(data_to_send)),
-                                                     str(self.__ip), str(self.__port)))
-    self.__sock.sendto(data_to_send, (self.__ip, self.__port))
     response = MilightWifiBridge.__START_SESSION_RESPONSE(responseReceived=False, mac="", sessionId1=-1, sessionId2=-1)
 
+    span = MilightTracer.begin("startSession", host=self.__ip)
+    sendingTime = time.monotonic()
     try:
+      # Send start session request
+      data_to_send = MilightWifiBridge.__START_SESSION_MSG
+      logging.debug("Sending frame '{}' to {}:{}".format(str(binascii.hexlify(data_to_send)),
+                                                       str(self.__ip), str(self.__port)))
+      self.__drain()
+      self.__send(data_to_send)
+
       # Receive start session response
-      data = self.__sock.recvfrom(1024)[0]
+      data = self.__receive(lambda frame: len(frame) == 22)
       if len(data) == 22:
         # Parse valid start session response
-        response = MilightWifiBridge.__START_SESSION_RESPONSE(responseReceived=True,
-                                                              mac=str("{}:{}:{}:{}:{}:{}".format(format(data[7], 'x'),
-                                                                                                 format(data[8], 'x'),
-                                                                                                 format(data[9], 'x'),
-                                                                                                 format(data[10], 'x'),
-                                                                                                 format(data[11], 'x'),
-                                                                                                 format(data[12], 'x'))),
-                                                              sessionId1=int(data[19]),
-                                                              sessionId2=int(data[20]))
+        response = MilightWifiBridge.parseStartSessionResponse(data)
         logging.debug("Start session (mac address: {}, session ID 1: {}, session ID 2: {})"
                       .format(str(response.mac), str(response.sessionId1), str(response.sessionId2)))
       else:
         logging.warning("Invalid start session response size")
     except socket.timeout:
       logging.warning("Timed out for start session response")
+    except socket.error as err:
+      logging.warning("Start session failed: {}".format(str(err)))
+
+    self.__statistics.addHandshake(time.monotonic() - sendingTime if response.responseReceived else None)
+    if response.responseReceived:
+      self.__identity.update(response)
+    span.end(success=response.responseReceived)
+
+    # Any successful start session gives the session to reuse
+    if response.responseReceived and self.__keepSession:
+      self.__session = response
 
     return response
 
+  def __getSession(self):
+    """Give the session to use for the next request (start a new session if the current one can't be reused)
+
+    return: (MilightWifiBridge.__START_SESSION_RESPONSE) Start session information
+    """
+    if self.__keepSession and self.__session is not None:
+      return self.__session
+    return self.__startSession()
+
+  def __nextSequenceNumber(self):
+    """Give the sequence number of the next request
+
+    Note: For each request, increment the sequence number (even if the session ID is regenerated)
+          Sequence number must be between 0x01 and 0xFF
+
+    return: (int) Sequence number
+    """
+    self.__sequence_number = (self.__sequence_number + 1) & 0xFF
+    if self.__sequence_number == 0:
+      self.__sequence_number = 1
+    return self.__sequence_number
+
   def __sendRequest(self, command, zoneId):
     """Send command to a specific zone and get response (ACK from the wifi bridge)
 
@@ -395,42 +531,8 @@ class MilightWifiBridge:
     # Send request only if valid parameters
     if len(bytearray(command)) == 9:
       if int(zoneId) >= 0 and int(zoneId) <= 4:
-        startSessionResponse = self.__startSession()
-        if startSessionResponse.responseReceived:
-          # For each request, increment the sequence number (even if the session ID is regenerated)
-          # Sequence number must be between 0x01 and 0xFF
-          self.__sequence_number = (self.__sequence_number + 1) & 0xFF
-          if self.__sequence_number == 0:
-            self.__sequence_number = 1
-
-          # Prepare request frame to send
-          bytesToSend = bytearray([0x80, 0x00, 0x00, 0x00, 0x11, startSessionResponse.sessionId1,
-                                   startSessionResponse.sessionId2, 0x00, int(self.__sequence_number), 0x00])
-          bytesToSend += bytearray(command)
-          bytesToSend += bytearray([int(zoneId), 0x00])
-          bytesToSend += bytearray([int(MilightWifiBridge.__calculateCheckSum(bytearray(command), int(zoneId)))])
-
-          # Send request frame
-          logging.debug("Sending request with command '{}' with session ID 1 '{}', session ID 2 '{}' and sequence number '{}'"
-                        .format(str(binascii.hexlify(command)), str(startSessionResponse.sessionId1),
-                                str(startSessionResponse.sessionId2), str(self.__sequence_number)))
-          self.__sock.sendto(bytesToSend, (self.__ip, self.__port))
-          try:
-            # Receive response frame
-            data = self.__sock.recvfrom(64)[0]
-            if len(data) == 8:
-              if data[6] == self.__sequence_number:
-                returnValue = True
-                logging.debug("Received valid response for previously sent request")
-              else:
-                logging.warning("Invalid sequence number ack {} instead of {}".format(str(data[6]),
-                                                                                      self.__sequence_number))
-            else:
-              logging.warning("Invalid response size {} instead of 8".format(str(len(data))))
-          except socket.timeout:
-            logging.warning("Timed out for response")
-        else:
-          logging.warning("Start session failed")
+        logging.debug("Sending request with command '{}' to zone {}".format(str(binascii.hexlify(command)), str(zoneId)))
+        returnValue = self.sendFrame(MilightWifiBridge.buildFrame(command, zoneId))
       else:
         logging.error("Invalid zone {} (must be between 0 and 4)".format(str(zoneId)))
     else:
@@ -439,6 +541,221 @@ class MilightWifiBridge:
     return returnValue
 
 
+  ######################### FRAME FUNCTIONS #########################
+  @staticmethod
+  def getKeepAliveFrame(sessionId1, sessionId2):
+    """Give the keep alive request frame of a session (answered by the wifi bridge with its MAC address)
+
+    Keyword arguments:
+      sessionId1 -- (int) First part of the session ID
+      sessionId2 -- (int) Second part of the session ID
+
+    return: (bytes) Keep alive request frame
+    """
+    return bytes([0xD0, 0x00, 0x00, 0x00, 0x02, sessionId1 & 0xFF, sessionId2 & 0xFF])
+
+  @staticmethod
+  def getStartSessionFrame():
+    """Give the start session request frame
+
+    return: (bytes) Start session request frame
+    """
+    return bytes(MilightWifiBridge.__START_SESSION_MSG)
+
+  @staticmethod
+  def parseStartSessionResponse(data):
+    """Parse a start session response frame
+
+    Keyword arguments:
+      data -- (bytes, bytearray or memoryview) Start session response frame (22 bytes)
+
+    return: (MilightWifiBridge.__START_SESSION_RESPONSE) Start session information containing response received,
+                                                         mac address and session IDs
+    """
+    if len(data) != 22:
+      return MilightWifiBridge.__START_SESSION_RESPONSE(responseReceived=False, mac="", sessionId1=-1, sessionId2=-1)
+
+    return MilightWifiBridge.__START_SESSION_RESPONSE(responseReceived=True,
+                                                      mac=str("{}:{}:{}:{}:{}:{}".format(format(data[7], 'x'),
+                                                                                         format(data[8], 'x'),
+                                                                                         format(data[9], 'x'),
+                                                                                         format(data[10], 'x'),
+                                                                                         format(data[11], 'x'),
+                                                                                         format(data[12], 'x'))),
+                                                      sessionId1=int(data[19]),
+                                                      sessionId2=int(data[20]))
+
+  @staticmethod
+  def buildFrame(command, zoneId):
+    """Build a request frame which can be sent (multiple times) with sendFrame()
+
+    Note: Session IDs and sequence number are left empty, they are filled by sendFrame() before each sending
+          (the checksum only covers the command and the zone so it never needs to be recalculated)
+
+    Keyword arguments:
+      command -- (bytearray) Command (9 bytes)
+      zoneId -- (int) Zone ID
+
+    return: (bytearray) Request frame (22 bytes)
+    """
+    frame = bytearray([0x80, 0x00, 0x00, 0x00, 0x11, 0x00, 0x00, 0x00, 0x00, 0x00])
+    frame += bytearray(command)
+    frame += bytearray([int(zoneId), 0x00])
+    frame += bytearray([int(MilightWifiBridge.__calculateCheckSum(bytearray(command), int(zoneId)))])
+    return frame
+
+  @staticmethod
+  def buildCommandFrame(action, zoneId=0, value=None):
+    """Build the request frame of an action (see buildFrame())
+
+    Keyword arguments:
+      action -- (string) Action, name of the public function sending it (example: "turnOn", "setBrightness", ...)
+      zoneId -- (int or MilightWifiBridge.eZone, optional) Zone ID (ignored for wifi bridge lamp actions)
+      value -- (int, optional) Value of the action (color, brightness, saturation, temperature or disco mode)
+
+    return: (bytearray) Request frame (22 bytes), None if the action is unknown or the zone invalid
+    """
+    if action == "turnOn":
+      command = MilightWifiBridge.__ON_CMD
+    elif action == "turnOff":
+      command = MilightWifiBridge.__OFF_CMD
+    elif action == "setNightMode":
+      command = MilightWifiBridge.__NIGHT_MODE_CMD
+    elif action == "setWhiteMode":
+      command = MilightWifiBridge.__WHITE_MODE_CMD
+    elif action == "speedUpDiscoMode":
+      command = MilightWifiBridge.__DISCO_MODE_SPEED_UP_CMD
+    elif action == "slowDownDiscoMode":
+      command = MilightWifiBridge.__DISCO_MODE_SLOW_DOWN_CMD
+    elif action == "link":
+      command = MilightWifiBridge.__LINK_CMD
+    elif action == "unlink":
+      command = MilightWifiBridge.__UNLINK_CMD
+    elif action == "setColor":
+      command = MilightWifiBridge.__getSetColorCmd(value)
+    elif action == "setBrightness":
+      command = MilightWifiBridge.__getSetBrightnessCmd(value)
+    elif action == "setSaturation":
+      command = MilightWifiBridge.__getSetSaturationCmd(value)
+    elif action == "setTemperature":
+      command = MilightWifiBridge.__getSetTemperatureCmd(value)
+    elif action == "setDiscoMode":
+      command = MilightWifiBridge.__getSetDiscoModeCmd(value)
+    else:
+      # Wifi bridge lamp actions are always sent to zone 1
+      zoneId = 0x01
+      if action == "turnOnWifiBridgeLamp":
+        command = MilightWifiBridge.__WIFI_BRIDGE_LAMP_ON_CMD
+      elif action == "turnOffWifiBridgeLamp":
+        command = MilightWifiBridge.__WIFI_BRIDGE_LAMP_OFF_CMD
+      elif action == "setWhiteModeBridgeLamp":
+        command = MilightWifiBridge.__WIFI_BRIDGE_LAMP_WHITE_MODE_CMD
+      elif action == "speedUpDiscoModeBridgeLamp":
+        command = MilightWifiBridge.__WIFI_BRIDGE_LAMP_DISCO_MODE_SPEED_UP_CMD
+      elif action == "slowDownDiscoModeBridgeLamp":
+        command = MilightWifiBridge.__WIFI_BRIDGE_LAMP_DISCO_MODE_SLOW_DOWN_CMD
+      elif action == "setColorBridgeLamp":
+        command = MilightWifiBridge.__getSetBridgeLampColorCmd(value)
+      elif action == "setBrightnessBridgeLamp":
+        command = MilightWifiBridge.__getSetBrightnessForBridgeLampCmd(value)
+      elif action == "setDiscoModeBridgeLamp":
+        command = MilightWifiBridge.__getSetDiscoModeForBridgeLampCmd(value)
+      else:
+        logging.error("Unknown action '{}'".format(str(action)))
+        return None
+
+    if int(zoneId) < 0 or int(zoneId) > 4:
+      logging.error("Invalid zone {} (must be between 0 and 4)".format(str(zoneId)))
+      return None
+
+    return MilightWifiBridge.buildFrame(command, zoneId)
+
+  def sendFrame(self, frame):
+    """Send a request frame built with buildFrame() and get response (ACK from the wifi bridge)
+
+    Note: Session IDs and sequence number of the frame are updated in place (no copy of the frame is done)
+
+    Keyword arguments:
+      frame -- (bytearray or writable memoryview) Request frame (22 bytes)
+
+    return: (bool) Request received by the wifi bridge
+    """
+    return self.sendFrames([frame], 1)[0] is not None
+
+  def sendFrames(self, frames, window=8):
+    """Send request frames built with buildFrame() in a single session, without waiting for each
+       ACK before sending the next frame (pipelining)
+
+    Note: Session IDs and sequence number of the frames are updated in place (no copy of the frames is done)
+
+    Keyword arguments:
+      frames -- (list of bytearray or writable memoryview) Request frames (22 bytes each)
+      window -- (int, optional) Maximum number of frames sent and not acknowledged yet
+
+    return: (list of float) Time in sec between the sending of each frame and its ACK (None if not acknowledged)
+    """
+    results = [None] * len(frames)
+
+    for frame in frames:
+      if len(frame) != 22:
+        logging.error("Invalid frame size {} instead of 22".format(str(len(frame))))
+        return results
+    if len(frames) == 0:
+      return results
+
+    span = MilightTracer.begin("sendFrames", host=self.__ip, frames=len(frames))
+    startSessionResponse = self.__getSession()
+    if not startSessionResponse.responseReceived:
+      logging.warning("Start session failed")
+      span.end(acknowledged=0)
+      return results
+
+    # Sequence number of the frames sent and not acknowledged yet => (frame index, sending time)
+    pending = {}
+    nextIndex = 0
+    try:
+      while nextIndex < len(frames) or pending:
+        while nextIndex < len(frames) and len(pending) < max(int(window), 1):
+          # Complete request frame to send
+          sequenceNumber = self.__nextSequenceNumber()
+          frame = frames[nextIndex]
+          frame[5] = startSessionResponse.sessionId1
+          frame[6] = startSessionResponse.sessionId2
+          frame[8] = sequenceNumber
+
+          # Send request frame
+          logging.debug("Sending frame '{}' with session ID 1 '{}', session ID 2 '{}' and sequence number '{}'"
+                        .format(str(binascii.hexlify(frame)), str(startSessionResponse.sessionId1),
+                                str(startSessionResponse.sessionId2), str(sequenceNumber)))
+          self.__send(frame)
+          pending[sequenceNumber] = (nextIndex, time.monotonic())
+          nextIndex += 1
+
+        # Receive response frame (acks of previous requests are discarded)
+        data = self.__receive(lambda data: len(data) == 8 and data[6] in pending)
+        index, sendingTime = pending.pop(data[6])
+        results[index] = time.monotonic() - sendingTime
+        self.__statistics.addRequest(results[index])
+        MilightTracer.complete("ack", sendingTime, results[index], sequenceNumber=data[6])
+        logging.debug("Received valid response for previously sent request")
+    except socket.timeout:
+      logging.warning("Timed out for response")
+      self.__statistics.addTimeouts(len(pending))
+    except socket.error as err:
+      logging.warning("Request failed: {}".format(str(err)))
+
+    # Frames not acknowledged (or not sent because of an error)
+    for index in range(len(frames) - nextIndex + len(pending)):
+      self.__statistics.addRequest(None)
+
+    # The session may have expired, start a new one for the next request
+    if nextIndex < len(frames) or pending:
+      self.__session = None
+
+    span.end(acknowledged=len(frames) - results.count(None))
+    return results
+
+
   ######################### PUBLIC FUNCTIONS #########################
   def turnOn(self, zoneId):
     """Request 'Light on' to a zone
@@ -690,12 +1007,899 @@ class MilightWifiBridge:
                   .format(str(temperature), str(int(2700 + 38*temperature)), str(zoneId), str(returnValue)))
     return returnValue
 
-  def getMacAddress(self):
-    """Request the MAC address of the milight wifi bridge
+  def setCapture(self, capture):
+    """Record the traffic with the wifi bridge
+
+    Keyword arguments:
+      capture -- (MilightTrafficCapture) Capture to record the frames in (can be shared by all instances),
+                                         None to stop recording
+    """
+    self.__capture = capture
+
+  def getStatistics(self):
+    """Give the statistics of the exchanges with the wifi bridge
+
+    return: (MilightStatistics) Statistics
+    """
+    return self.__statistics.snapshot()
+
+  def getIdentity(self):
+    """Give the identity of the wifi bridge learnt from the start sessions (no request is sent)
+
+    return: (MilightIdentity) Identity
+    """
+    return self.__identity.snapshot()
+
+  def getMacAddress(self, cached=True):
+    """Give the MAC address of the milight wifi bridge
+
+    Keyword arguments:
+      cached -- (bool, optional) Give the MAC address of the last start session if any instead of starting a new session
+
+    return: (string) MAC address of the wifi bridge (empty if an error occured)
+    """
+    returnValue = self.__identity.snapshot().mac if cached else ""
+    if returnValue == "":
+      returnValue = self.__startSession().mac
+    logging.debug("Get MAC address: {}".format(str(returnValue)))
+    return returnValue
+
+
+############################## STATISTICS CLASS ###############################
+# Statistics of the exchanges with a wifi bridge
+# Keyword arguments:
+#   requests -- (int) Number of requests sent (start session requests excluded)
+#   averageRtt -- (float) Average time in sec between a request and its ACK (recent requests), None if unknown
+#   lossPercent -- (float) Percentage of recent exchanges (start session included) without response
+#   timeouts -- (int) Number of requests without ACK in time
+#   handshakeFailures -- (int) Number of failed start sessions
+MilightStatistics = collections.namedtuple("MilightStatistics", "requests averageRtt lossPercent timeouts handshakeFailures")
+
+class MilightBridgeStatistics:
+  """Rolling statistics of the exchanges with a wifi bridge (thread safe)"""
+
+  def __init__(self, window=100):
+    """Create empty statistics
+
+    Keyword arguments:
+      window -- (int, optional) Number of recent exchanges used for the average ACK time and the loss percentage
+    """
+    self.__lock = threading.Lock()
+    self.__rtts = collections.deque(maxlen=window)
+    self.__exchanges = collections.deque(maxlen=window)
+    self.__requests = 0
+    self.__timeouts = 0
+    self.__handshakeFailures = 0
+
+  def addHandshake(self, rtt):
+    """Record a start session exchange
+
+    Keyword arguments:
+      rtt -- (float) Time in sec between the request and its response (None if failed)
+    """
+    with self.__lock:
+      self.__exchanges.append(rtt is not None)
+      if rtt is None:
+        self.__handshakeFailures += 1
+
+  def addRequest(self, rtt):
+    """Record a request
+
+    Keyword arguments:
+      rtt -- (float) Time in sec between the request and its ACK (None if not acknowledged)
+    """
+    with self.__lock:
+      self.__requests += 1
+      self.__exchanges.append(rtt is not None)
+      if rtt is not None:
+        self.__rtts.append(rtt)
+
+  def addTimeouts(self, count=1):
+    """Record requests not acknowledged in time
+
+    Keyword arguments:
+      count -- (int, optional) Number of requests
+    """
+    with self.__lock:
+      self.__timeouts += count
+
+  def snapshot(self):
+    """Give the current statistics
+
+    return: (MilightStatistics) Statistics
+    """
+    with self.__lock:
+      averageRtt = sum(self.__rtts) / len(self.__rtts) if self.__rtts else None
+      lossPercent = 100.0 * self.__exchanges.count(False) / len(self.__exchanges) if self.__exchanges else 0.0
+      return MilightStatistics(requests=self.__requests, averageRtt=averageRtt, lossPercent=lossPercent,
+                               timeouts=self.__timeouts, handshakeFailures=self.__handshakeFailures)
+
+
+############################### IDENTITY CLASS ################################
+# Identity of a wifi bridge learnt from its start session responses
+# Keyword arguments:
+#   mac -- (string) MAC address of the wifi bridge (empty if no start session succeeded yet)
+#   sessionId1 -- (int) First part of the last session ID (-1 if unknown)
+#   sessionId2 -- (int) Second part of the last session ID (-1 if unknown)
+#   handshakes -- (int) Number of successful start sessions
+#   lastHandshake -- (float) Time (time.time()) of the last successful start session, None if unknown
+#   previousMac -- (string) MAC address before the last change of MAC address (empty if it never changed)
+MilightIdentity = collections.namedtuple("MilightIdentity", "mac sessionId1 sessionId2 handshakes lastHandshake previousMac")
+
+class MilightBridgeIdentity:
+  """Identity of a wifi bridge filled from every start session response (thread safe)"""
+
+  def __init__(self):
+    """Create an unknown identity"""
+    self.__lock = threading.Lock()
+    self.__identity = MilightIdentity(mac="", sessionId1=-1, sessionId2=-1, handshakes=0, lastHandshake=None,
+                                      previousMac="")
+
+  def update(self, response):
+    """Record a successful start session
+
+    Keyword arguments:
+      response -- (MilightWifiBridge.__START_SESSION_RESPONSE) Start session information
+
+    return: (bool) MAC address changed (another wifi bridge answers at the same address)
+    """
+    with self.__lock:
+      identity = self.__identity
+      changed = identity.mac != "" and response.mac != identity.mac
+      self.__identity = MilightIdentity(mac=response.mac, sessionId1=response.sessionId1, sessionId2=response.sessionId2,
+                                        handshakes=identity.handshakes + 1, lastHandshake=time.time(),
+                                        previousMac=identity.mac if changed else identity.previousMac)
+    if changed:
+      logging.warning("MAC address of the wifi bridge changed from {} to {} (wifi bridge replaced?)"
+                      .format(str(identity.mac), str(response.mac)))
+    return changed
+
+  def snapshot(self):
+    """Give the current identity
+
+    return: (MilightIdentity) Identity
+    """
+    return self.__identity
+
+
+############################### CAPTURE CLASS #################################
+# Frame recorded in a traffic capture
+# Keyword arguments:
+#   time -- (float) Time in sec since the start of the capture
+#   direction -- (int) MilightTrafficCapture.OUTGOING or MilightTrafficCapture.INCOMING
+#   host -- (string) IP of the wifi bridge
+#   port -- (int) UDP port of the wifi bridge
+#   sequenceNumber -- (int) Sequence number of the request or ACK (0 for other frames)
+#   frame -- (bytes) Frame
+MilightCaptureRecord = collections.namedtuple("MilightCaptureRecord", "time direction host port sequenceNumber frame")
+
+class MilightTrafficCapture:
+  """Binary capture of the frames exchanged with wifi bridges (thread safe)
+
+  File format: "MLCAP" magic, version byte and start time (epoch, little endian double), then one record
+  per frame: time since start (double), direction, IPv4 address, port, sequence number and size of the frame
+  followed by the frame itself.
+  """
+  OUTGOING = 0
+  INCOMING = 1
+
+  MAGIC = b"MLCAP"
+  VERSION = 1
+  __HEADER = struct.Struct("<5sBd")
+  __RECORD = struct.Struct("<dB4sHBB")
+
+  def __init__(self, path):
+    """Create a capture file (overwritten if it exists)
+
+    Keyword arguments:
+      path -- (string) Path of the capture file
+    """
+    self.__lock = threading.Lock()
+    self.__start = time.monotonic()
+    self.__file = open(path, "wb")
+    self.__file.write(MilightTrafficCapture.__HEADER.pack(MilightTrafficCapture.MAGIC, MilightTrafficCapture.VERSION,
+                                                          time.time()))
+
+  def record(self, direction, address, frame):
+    """Record a frame
+
+    Keyword arguments:
+      direction -- (int) MilightTrafficCapture.OUTGOING or MilightTrafficCapture.INCOMING
+      address -- (tuple) IP and UDP port of the wifi bridge
+      frame -- (bytes, bytearray or memoryview) Frame
+    """
+    size = len(frame)
+    if direction == MilightTrafficCapture.OUTGOING and size == 22:
+      sequenceNumber = frame[8]
+    elif direction == MilightTrafficCapture.INCOMING and size == 8:
+      sequenceNumber = frame[6]
+    else:
+      sequenceNumber = 0
+    header = MilightTrafficCapture.__RECORD.pack(time.monotonic() - self.__start, direction,
+                                                 socket.inet_aton(address[0]), address[1], sequenceNumber, min(size, 0xFF))
+    with self.__lock:
+      if self.__file is not None:
+        self.__file.write(header)
+        self.__file.write(frame[:0xFF])
+
+  def close(self):
+    """Close the capture file"""
+    with self.__lock:
+      if self.__file is not None:
+        self.__file.close()
+        self.__file = None
+
+  @staticmethod
+  def read(path):
+    """Read a capture file
+
+    Keyword arguments:
+      path -- (string) Path of the capture file
+
+    return: (generator of MilightCaptureRecord) Recorded frames
+
+    raise: ValueError if the file is not a capture
+    """
+    with open(path, "rb") as captureFile:
+      header = captureFile.read(MilightTrafficCapture.__HEADER.size)
+      if len(header) != MilightTrafficCapture.__HEADER.size:
+        raise ValueError("{} is not a Milight capture".format(str(path)))
+      magic, version, startTime = MilightTrafficCapture.__HEADER.unpack(header)
+      if magic != MilightTrafficCapture.MAGIC or version != MilightTrafficCapture.VERSION:
+        raise ValueError("{} is not a Milight capture (version {})".format(str(path), str(MilightTrafficCapture.VERSION)))
+
+      while True:
+        data = captureFile.read(MilightTrafficCapture.__RECORD.size)
+        if len(data) < MilightTrafficCapture.__RECORD.size:
+          return
+        timeSec, direction, ip, port, sequenceNumber, size = MilightTrafficCapture.__RECORD.unpack(data)
+        frame = captureFile.read(size)
+        if len(frame) < size:
+          return
+        yield MilightCaptureRecord(time=timeSec, direction=direction, host=socket.inet_ntoa(ip), port=port,
+                                   sequenceNumber=sequenceNumber, frame=frame)
+
+
+############################### TRACING CLASSES ################################
+class MilightTraceSpan:
+  """Span of a traced operation (see MilightTracer.begin()), can be used as a context manager"""
+  __slots__ = ("tracer", "name", "startTime", "args")
+
+  def __init__(self, tracer, name, args):
+    self.tracer = tracer
+    self.name = name
+    self.startTime = time.monotonic() if tracer is not None else 0.0
+    self.args = args
+
+  def end(self, **args):
+    """End the span
+
+    Keyword arguments:
+      args -- (dict, optional) Arguments to add to the span
+    """
+    if self.tracer is None:
+      return
+    if args:
+      self.args.update(args)
+    self.tracer.record(self.name, self.startTime, time.monotonic() - self.startTime, self.args)
+    self.tracer = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exceptionType, exceptionValue, traceback):
+    if exceptionType is not None:
+      self.end(error=str(exceptionValue))
+    else:
+      self.end()
+    return False
+
+class MilightTracer:
+  """Span based tracing of the exchanges with the wifi bridges, exported as Chrome trace (Perfetto) JSON
+
+  Tracing is disabled until start() is called, a disabled span costs a function call:
+
+    MilightTracer.start()
+    with MilightTracer.begin("scene", zones=4):
+      milight.turnOn(MilightWifiBridge.eZone.ALL)
+    MilightTracer.stop().save("/tmp/milight.json")
+  """
+  __active = None
+  __NULL_SPAN = MilightTraceSpan(None, "", None)
+
+  def __init__(self, maxEvents=100000):
+    """Create a tracer (start() creates and activates one)
+
+    Keyword arguments:
+      maxEvents -- (int, optional) Maximum number of events kept (oldest events are dropped)
+    """
+    self.__lock = threading.Lock()
+    self.__events = collections.deque(maxlen=maxEvents)
+    self.__threadNames = {}
+    self.__origin = time.monotonic()
+
+  @staticmethod
+  def start(maxEvents=100000):
+    """Start tracing
+
+    Keyword arguments:
+      maxEvents -- (int, optional) Maximum number of events kept (oldest events are dropped)
+
+    return: (MilightTracer) Active tracer
+    """
+    MilightTracer.__active = MilightTracer(maxEvents)
+    return MilightTracer.__active
+
+  @staticmethod
+  def stop():
+    """Stop tracing
+
+    return: (MilightTracer) Tracer which was active (None if tracing was disabled)
+    """
+    tracer = MilightTracer.__active
+    MilightTracer.__active = None
+    return tracer
+
+  @staticmethod
+  def active():
+    """return: (MilightTracer) Active tracer (None if tracing is disabled)"""
+    return MilightTracer.__active
+
+  @staticmethod
+  def begin(name, **args):
+    """Begin a span (end() must be called on the span)
+
+    Keyword arguments:
+      name -- (string) Name of the span
+      args -- (dict, optional) Arguments of the span
+
+    return: (MilightTraceSpan) Span
+    """
+    tracer = MilightTracer.__active
+    if tracer is None:
+      return MilightTracer.__NULL_SPAN
+    return MilightTraceSpan(tracer, name, args)
+
+  @staticmethod
+  def complete(name, startTime, duration, **args):
+    """Record a span already completed
+
+    Keyword arguments:
+      name -- (string) Name of the span
+      startTime -- (float) Start of the span (monotonic clock)
+      duration -- (float) Duration of the span in sec
+      args -- (dict, optional) Arguments of the span
+    """
+    tracer = MilightTracer.__active
+    if tracer is not None:
+      tracer.record(name, startTime, duration, args)
+
+  def record(self, name, startTime, duration, args):
+    """Record a span of the current thread
+
+    Keyword arguments:
+      name -- (string) Name of the span
+      startTime -- (float) Start of the span (monotonic clock)
+      duration -- (float) Duration of the span in sec
+      args -- (dict) Arguments of the span
+    """
+    thread = threading.current_thread()
+    with self.__lock:
+      if thread.ident not in self.__threadNames:
+        self.__threadNames[thread.ident] = thread.name
+      self.__events.append((name, startTime, duration, thread.ident, args))
+
+  def __len__(self):
+    """return: (int) Number of recorded spans"""
+    return len(self.__events)
+
+  def toChromeTrace(self):
+    """Give the recorded spans in Chrome trace format
+
+    return: (dict) Chrome trace (can be saved as JSON and opened with Perfetto or chrome://tracing)
+    """
+    pid = os.getpid()
+    with self.__lock:
+      events = list(self.__events)
+      threadNames = dict(self.__threadNames)
+
+    traceEvents = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": threadName}}
+                   for tid, threadName in threadNames.items()]
+    for name, startTime, duration, tid, args in events:
+      traceEvents.append({"name": name, "cat": "milight", "ph": "X", "pid": pid, "tid": tid,
+                          "ts": round((startTime - self.__origin) * 1000000.0, 1),
+                          "dur": round(duration * 1000000.0, 1),
+                          "args": dict((key, value if isinstance(value, (int, float, bool)) or value is None else str(value))
+                                       for key, value in args.items())})
+    return {"traceEvents": traceEvents, "displayTimeUnit": "ms"}
+
+  def save(self, path):
+    """Save the recorded spans as a Chrome trace JSON file
+
+    Keyword arguments:
+      path -- (string) Path of the file
+    """
+    with open(path, "w") as traceFile:
+      json.dump(self.toChromeTrace(), traceFile)
+
+
+########################### THREAD SAFE CLIENT CLASS ##########################
+class MilightSharedWifiBridge(MilightWifiBridge):
+  """Thread safe Milight 3.0 Wifi Bridge class (one instance can be shared by all threads controlling a wifi bridge)
+
+  A receiver thread dispatches the ACKs to the waiting requests by sequence number, so that requests of several
+  threads can be in flight at the same time in a single (kept) session. An optional keep alive (see setKeepAlive())
+  keeps the session warm while the wifi bridge is idle. Frames can also be sent without waiting for their ACKs
+  (see sendFramesAsync()), the ACKs being checked by another thread.
+
+  Calling setup() function is necessary in order to make this class work properly.
+  """
+  def __init__(self, statistics=None, identity=None):
+    """Class must be initialized with setup()
+
+    Keyword arguments:
+      statistics -- (MilightBridgeStatistics, optional) Statistics to update
+      identity -- (MilightBridgeIdentity, optional) Identity to update
+    """
+    self.__stateLock = threading.RLock()
+    self.__sendLock = threading.Lock()
+    self.__sessionLock = threading.Lock()
+    self.__sock = None
+    self.__stopEvent = None
+    self.__setupParameters = None
+    self.__waiters = {}
+    self.__sessionWaiter = None
+    self.__keepAliveWaiter = None
+    self.__keepAliveStopEvent = None
+    self.__lastActivity = time.monotonic()
+    self.__ackQueue = collections.deque()
+    self.__ackCondition = threading.Condition()
+    self.__ackThread = None
+    self.__session = None
+    self.__capture = None
+    self.__statistics = statistics if statistics is not None else MilightBridgeStatistics()
+    self.__identity = identity if identity is not None else MilightBridgeIdentity()
+    MilightWifiBridge.__init__(self, self.__statistics, self.__identity)
+
+  def close(self):
+    """Close connection with Milight wifi bridge (requests in flight fail)"""
+    with self.__stateLock:
+      with self.__sendLock:
+        if self.__stopEvent is not None:
+          self.__stopEvent.set()
+          self.__stopEvent = None
+        if self.__sock is not None:
+          try:
+            self.__sock.close()
+            logging.debug("Socket closed")
+          except socket.error:
+            pass
+          self.__sock = None
+        self.__setupParameters = None
+        self.__session = None
+        self.__failWaiters()
+
+  def setup(self, ip, port=5987, timeout_sec=5.0, connected=True, keepSession=True):
+    """Initialize the class (can be launched multiple time if setup changed or module crashed)
+
+    Note: The session is always kept, calling setup() again with the same parameters does nothing (a session
+          which timed out is already replaced by the next request)
+
+    Keyword arguments:
+      ip -- (string) IP to communication with the Milight wifi bridge
+      port -- (int, optional) UDP port to communication with the Milight wifi bridge
+      timeout_sec -- (int, optional) Timeout in sec for Milight wifi bridge to answer commands
+      connected -- (bool, optional) Connect the UDP socket to the wifi bridge
+      keepSession -- (bool, optional) Ignored (the session is always shared by all requests)
+
+    return: (bool) Milight wifi bridge initialized
+    """
+    with self.__stateLock:
+      if self.__setupParameters == (ip, port, timeout_sec, connected) and self.__sock is not None:
+        return True
+
+      self.close()
+      try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
+        address = (socket.gethostbyname(ip), int(port))
+        if connected:
+          sock.connect(address)
+        # The receiver checks regularly if it must stop
+        sock.settimeout(0.5)
+      except (socket.error, socket.herror, socket.gaierror, socket.timeout) as err:
+        logging.error("Impossible to initialize the UDP connection with ip {} and port {}: {}".format(str(ip), str(port), str(err)))
+        return False
+
+      with self.__sendLock:
+        self.__sock = sock
+        self.__address = address
+        self.__connected = connected
+        self.__timeout = timeout_sec
+        self.__session = None
+        self.__sequence_number = 0
+        self.__setupParameters = (ip, port, timeout_sec, connected)
+        self.__stopEvent = threading.Event()
+        threading.Thread(target=self.__receiveLoop, args=(sock, self.__stopEvent),
+                         name="milight-receiver-" + str(ip), daemon=True).start()
+      logging.debug("UDP connection initialized with ip {} and port {} (shared)".format(str(ip), str(port)))
+      return True
+
+  def __failWaiters(self):
+    """Wake up every request waiting for a response (they fail)"""
+    waiters, self.__waiters = list(self.__waiters.values()), {}
+    if self.__sessionWaiter is not None:
+      waiters.append(self.__sessionWaiter)
+      self.__sessionWaiter = None
+    if self.__keepAliveWaiter is not None:
+      waiters.append(self.__keepAliveWaiter)
+      self.__keepAliveWaiter = None
+    for waiter in waiters:
+      waiter[0].set()
+
+  def __receiveLoop(self, sock, stopEvent):
+    """Receive the responses of the wifi bridge and give them to the waiting requests
+
+    Keyword arguments:
+      sock -- (socket) Socket to read
+      stopEvent -- (threading.Event) Set when the socket is closed
+    """
+    buffer = bytearray(64)
+    while not stopEvent.is_set():
+      try:
+        if self.__connected:
+          size = sock.recv_into(buffer)
+        else:
+          size, address = sock.recvfrom_into(buffer)
+          if address != self.__address:
+            continue
+      except socket.timeout:
+        continue
+      except socket.error as err:
+        if not stopEvent.is_set():
+          logging.debug("Reception error: {}".format(str(err)))
+          stopEvent.wait(0.1)
+        continue
+
+      receptionTime = time.monotonic()
+      self.__lastActivity = receptionTime
+      if self.__capture is not None:
+        self.__capture.record(MilightTrafficCapture.INCOMING, self.__address, buffer[:size])
+      with self.__sendLock:
+        if size == 8:
+          waiter = self.__waiters.pop(buffer[6], None)
+        elif size == 22:
+          waiter, self.__sessionWaiter = self.__sessionWaiter, None
+        elif size == 12 and buffer[0] == 0xD8:
+          waiter, self.__keepAliveWaiter = self.__keepAliveWaiter, None
+        else:
+          waiter = None
+        if waiter is None:
+          logging.debug("Discarding unexpected frame '{}'".format(str(binascii.hexlify(buffer[:size]))))
+          continue
+        waiter[2] = receptionTime - waiter[1]
+        if size == 22:
+          waiter[3] = MilightWifiBridge.parseStartSessionResponse(buffer[:size])
+        waiter[0].set()
+
+  def __startSharedSession(self):
+    """Start a new session
+
+    return: (MilightWifiBridge.__START_SESSION_RESPONSE) Start session information (or None if failed)
+    """
+    span = MilightTracer.begin("startSession", host=self.__address[0] if self.__sock is not None else None)
+    with self.__sendLock:
+      if self.__sock is None:
+        span.end(success=False)
+        return None
+      waiter = [threading.Event(), time.monotonic(), None, None]
+      self.__sessionWaiter = waiter
+      try:
+        self.__sendShared(MilightWifiBridge.getStartSessionFrame())
+      except socket.error as err:
+        logging.warning("Start session failed: {}".format(str(err)))
+        self.__sessionWaiter = None
+        self.__statistics.addHandshake(None)
+        span.end(success=False)
+        return None
+
+    waiter[0].wait(self.__timeout)
+    response = waiter[3]
+    self.__statistics.addHandshake(waiter[2] if response is not None else None)
+    span.end(success=response is not None)
+    if response is None:
+      logging.warning("Timed out for start session response")
+      return None
+
+    logging.debug("Start session (mac address: {}, session ID 1: {}, session ID 2: {})"
+                  .format(str(response.mac), str(response.sessionId1), str(response.sessionId2)))
+    self.__identity.update(response)
+    self.__session = response
+    return response
+
+  def __getSharedSession(self):
+    """Give the session shared by all requests (only one thread starts a new session when needed)
+
+    return: (MilightWifiBridge.__START_SESSION_RESPONSE) Start session information (or None if failed)
+    """
+    session = self.__session
+    if session is not None:
+      return session
+    with self.__sessionLock:
+      if self.__session is not None:
+        return self.__session
+      return self.__startSharedSession()
+
+  def sendFrames(self, frames, window=8):
+    """Send request frames built with buildFrame() in the shared session (thread safe, see MilightWifiBridge.sendFrames())
+
+    Keyword arguments:
+      frames -- (list of bytearray or writable memoryview) Request frames (22 bytes each)
+      window -- (int, optional) Maximum number of frames of this call sent and not acknowledged yet
+
+    return: (list of float) Time in sec between the sending of each frame and its ACK (None if not acknowledged)
+    """
+    results = [None] * len(frames)
+    for frame in frames:
+      if len(frame) != 22:
+        logging.error("Invalid frame size {} instead of 22".format(str(len(frame))))
+        return results
+    if len(frames) == 0:
+      return results
+
+    span = MilightTracer.begin("sendFrames", frames=len(frames))
+    session = self.__getSharedSession()
+    if session is None:
+      logging.warning("Start session failed")
+      span.end(acknowledged=0)
+      return results
+
+    inFlight = collections.deque()
+    for index, frame in enumerate(frames):
+      if len(inFlight) >= max(int(window), 1):
+        self.__waitResponse(inFlight.popleft(), results)
+
+      with self.__sendLock:
+        if self.__sock is None:
+          break
+        # Allocate a sequence number which is not waiting for a response
+        for attempt in range(255):
+          self.__sequence_number = (self.__sequence_number % 0xFF) + 1
+          if self.__sequence_number not in self.__waiters:
+            break
+        sequenceNumber = self.__sequence_number
+        waiter = [threading.Event(), time.monotonic(), None, None]
+        self.__waiters[sequenceNumber] = waiter
+
+        # Frame is completed and sent atomically so that a frame shared by several threads can't be mixed up
+        frame[5] = session.sessionId1
+        frame[6] = session.sessionId2
+        frame[8] = sequenceNumber
+        try:
+          self.__sendShared(frame)
+        except socket.error as err:
+          logging.warning("Request failed: {}".format(str(err)))
+          self.__waiters.pop(sequenceNumber, None)
+          waiter[0].set()
+      inFlight.append((index, sequenceNumber, waiter))
+
+    while inFlight:
+      self.__waitResponse(inFlight.popleft(), results)
+
+    span.end(acknowledged=len(frames) - results.count(None))
+    return results
+
+  def sendFramesAsync(self, frames, callback):
+    """Send request frames built with buildFrame() in the shared session without waiting for their ACKs
+       (optimistic mode, thread safe)
+
+    Note: The call only blocks when a new session must be started. The ACKs are checked by an ACK thread which
+          calls the callback once every frame is acknowledged or timed out (callbacks are called one at a time,
+          in the order of the calls, a slow callback delays the next ones).
+
+    Keyword arguments:
+      frames -- (list of bytearray or writable memoryview) Request frames (22 bytes each)
+      callback -- (function) Called with the list of the time in sec between the sending of each frame and
+                             its ACK (None if not acknowledged)
+
+    return: (bool) Frames sent (the callback is not called if they were not)
+    """
+    for frame in frames:
+      if len(frame) != 22:
+        logging.error("Invalid frame size {} instead of 22".format(str(len(frame))))
+        return False
+
+    span = MilightTracer.begin("sendFramesAsync", frames=len(frames))
+    session = self.__getSharedSession()
+    if session is None:
+      logging.warning("Start session failed")
+      span.end(sent=False)
+      return False
+
+    inFlight = []
+    with self.__sendLock:
+      if self.__sock is None:
+        span.end(sent=False)
+        return False
+      for index, frame in enumerate(frames):
+        # Allocate a sequence number which is not waiting for a response
+        for attempt in range(255):
+          self.__sequence_number = (self.__sequence_number % 0xFF) + 1
+          if self.__sequence_number not in self.__waiters:
+            break
+        sequenceNumber = self.__sequence_number
+        waiter = [threading.Event(), time.monotonic(), None, None]
+        self.__waiters[sequenceNumber] = waiter
+
+        frame[5] = session.sessionId1
+        frame[6] = session.sessionId2
+        frame[8] = sequenceNumber
+        try:
+          self.__sendShared(frame)
+        except socket.error as err:
+          logging.warning("Request failed: {}".format(str(err)))
+          self.__waiters.pop(sequenceNumber, None)
+          waiter[0].set()
+        inFlight.append((index, sequenceNumber, waiter))
+    span.end(sent=True)
+
+    with self.__ackCondition:
+      self.__ackQueue.append((inFlight, callback))
+      if self.__ackThread is None:
+        self.__ackThread = threading.Thread(target=self.__ackLoop, name="milight-ack", daemon=True)
+        self.__ackThread.start()
+      self.__ackCondition.notify()
+    return True
+
+  def __ackLoop(self):
+    """Check the ACKs of the frames sent by sendFramesAsync() and call their callbacks (stops when idle)"""
+    while True:
+      with self.__ackCondition:
+        if not self.__ackQueue:
+          self.__ackCondition.wait(5.0)
+        if not self.__ackQueue:
+          self.__ackThread = None
+          return
+        inFlight, callback = self.__ackQueue.popleft()
+
+      results = [None] * len(inFlight)
+      for item in inFlight:
+        self.__waitResponse(item, results)
+      try:
+        callback(results)
+      except Exception as err:
+        logging.error("ACK callback failed: {}".format(str(err)))
+
+  def __sendShared(self, data):
+    """Send a frame to the wifi bridge (send lock must be taken)
+
+    Keyword arguments:
+      data -- (bytearray) Frame to send
+    """
+    # Recorded before sending so that the ACK is always recorded after its request
+    if self.__capture is not None:
+      self.__capture.record(MilightTrafficCapture.OUTGOING, self.__address, data)
+    self.__lastActivity = time.monotonic()
+    if self.__connected:
+      self.__sock.send(data)
+    else:
+      self.__sock.sendto(data, self.__address)
+
+  def setKeepAlive(self, interval):
+    """Keep the session warm while the wifi bridge is idle, so that the first request after a long idle time
+       does not pay a new start session (or a timeout if the wifi bridge dropped the session)
+
+    Note: A keep alive frame (7 bytes, answered with 12 bytes) is only sent after interval sec without any
+          exchange with the wifi bridge, a busy wifi bridge never receives one. A new session is started
+          right away when a keep alive is not answered.
+
+    Keyword arguments:
+      interval -- (float) Idle time in sec before sending a keep alive, 0 or None to stop the keep alive
+    """
+    with self.__stateLock:
+      if self.__keepAliveStopEvent is not None:
+        self.__keepAliveStopEvent.set()
+        self.__keepAliveStopEvent = None
+      if interval:
+        self.__keepAliveStopEvent = threading.Event()
+        threading.Thread(target=self.__keepAliveLoop, args=(float(interval), self.__keepAliveStopEvent),
+                         name="milight-keepalive", daemon=True).start()
+
+  def __keepAliveLoop(self, interval, stopEvent):
+    """Send a keep alive each time the wifi bridge has been idle for interval sec
+
+    Keyword arguments:
+      interval -- (float) Idle time in sec before sending a keep alive
+      stopEvent -- (threading.Event) Set when the keep alive must stop
+    """
+    while not stopEvent.wait(max(self.__lastActivity + interval - time.monotonic(), 0.0)):
+      if time.monotonic() - self.__lastActivity >= interval:
+        if not self.__keepAlive():
+          # Not setup (or unreachable wifi bridge), try again after another interval
+          self.__lastActivity = time.monotonic()
+
+  def __keepAlive(self):
+    """Send a keep alive in the current session (or start a new session if there is none)
+
+    return: (bool) Session alive
+    """
+    if self.__sock is None:
+      return False
+    session = self.__session
+    if session is None:
+      return self.__getSharedSession() is not None
+
+    span = MilightTracer.begin("keepAlive", sessionId1=session.sessionId1, sessionId2=session.sessionId2)
+    with self.__sendLock:
+      if self.__sock is None:
+        span.end(success=False)
+        return False
+      waiter = [threading.Event(), time.monotonic(), None, None]
+      self.__keepAliveWaiter = waiter
+      try:
+        self.__sendShared(MilightWifiBridge.getKeepAliveFrame(session.sessionId1, session.sessionId2))
+      except socket.error as err:
+        logging.debug("Keep alive failed: {}".format(str(err)))
+        self.__keepAliveWaiter = None
+
+    waiter[0].wait(self.__timeout)
+    span.end(success=waiter[2] is not None)
+    if waiter[2] is not None:
+      logging.debug("Keep alive answered in {:.1f}ms".format(waiter[2] * 1000.0))
+      return True
+
+    # The wifi bridge dropped the session: start the next one now rather than with the next request
+    logging.debug("Keep alive not answered, starting a new session")
+    if self.__session is session:
+      self.__session = None
+    return self.__getSharedSession() is not None
+
+  def setCapture(self, capture):
+    """Record the traffic with the wifi bridge
+
+    Keyword arguments:
+      capture -- (MilightTrafficCapture) Capture to record the frames in (can be shared by all instances),
+                                         None to stop recording
+    """
+    self.__capture = capture
+
+  def __waitResponse(self, inFlight, results):
+    """Wait for the ACK of a sent frame
+
+    Keyword arguments:
+      inFlight -- (tuple) Frame index, sequence number and waiter of the sent frame
+      results -- (list of float) Results to complete
+    """
+    index, sequenceNumber, waiter = inFlight
+    # The timeout runs from the sending of the frame (its ACK may have been checked late)
+    waiter[0].wait(max(waiter[1] + self.__timeout - time.monotonic(), 0.0))
+    results[index] = waiter[2]
+    self.__statistics.addRequest(waiter[2])
+    if waiter[2] is None:
+      logging.warning("Timed out for response")
+      self.__statistics.addTimeouts()
+      with self.__sendLock:
+        if self.__waiters.get(sequenceNumber) is waiter:
+          del self.__waiters[sequenceNumber]
+      # The session may have expired, start a new one for the next request
+      self.__session = None
+    else:
+      MilightTracer.complete("ack", waiter[1], waiter[2], sequenceNumber=sequenceNumber)
+      logging.debug("Received valid response for previously sent request")
+
+  def getMacAddress(self, cached=True):
+    """Give the MAC address of the milight wifi bridge
+
+    Keyword arguments:
+      cached -- (bool, optional) Give the MAC address of the last start session if any instead of starting
+                                 a new shared session
 
     return: (string) MAC address of the wifi bridge (empty if an error occured)
     """
-    returnValue = self.__startSession().mac
+    returnValue = self.__identity.snapshot().mac if cached else ""
+    if returnValue == "":
+      with self.__sessionLock:
+        response = self.__startSharedSession()
+      returnValue = response.mac if response is not None else ""
     logging.debug("Get MAC address: {}".format(str(returnValue)))
     return returnValue
 
@@ -729,6 +1933,8 @@ def __help(func="", filename=__file__):
   # Ip
   if func in ("i", "ip"):
     print("Specify milight wifi bridge IP (mandatory to use any command)\r\n"
+          +"\r\n"
+          +"Several wifi bridges can be controlled at once with a comma separated list\r\n"
           +"\r\n"
           +"Usage:\r\n"
           +filename+" -i [ip]\r\n"
@@ -736,7 +1942,7 @@ def __help(func="", filename=__file__):
           +"\r\n"
           +"Example:\r\n"
           +filename+" -i 192.168.1.23\r\n"
-          +filename+" --ip 192.168.1.23\r\n")
+          +filename+" --ip 192.168.1.23,192.168.1.24\r\n")
     return
   elif func == "":
     print("IP (-i, --ip): Specify milight wifi bridge IP (mandatory to use any command)")
@@ -781,7 +1987,7 @@ def __help(func="", filename=__file__):
           +"\r\n"
           +"Default value (if not called): 0\r\n"
           +"\r\n"
-          +"Possible values: 0 for all zone or zone 1 to 4\r\n"
+          +"Possible values: 0 for all zone or zone 1 to 4 (comma separated list for several zones)\r\n"
           +"\r\n"
           +"Usage:\r\n"
           +filename+" -z [zone]\r\n"
@@ -789,11 +1995,72 @@ def __help(func="", filename=__file__):
           +"\r\n"
           +"Example:\r\n"
           +filename+" -z 1\r\n"
-          +filename+" --zone 1\r\n")
+          +filename+" --zone 1,3\r\n")
     return
   elif func == "":
     print("ZONE (-z, --zone): Specify milight light zone to control (default value: All zone)")
 
+  # Script
+  if func == "script":
+    print("Run the operations of a script file ('-' for standard input) after the command line ones\r\n"
+          +"\r\n"
+          +"Each line contains the same options as the command line ('#' starts a comment), '--ip' and '--zone'\r\n"
+          +"only apply to their line. Operations of a wifi bridge share a single session and are pipelined,\r\n"
+          +"wifi bridges are controlled in parallel.\r\n"
+          +"\r\n"
+          +"Usage:\r\n"
+          +filename+" --ip 192.168.1.23 -S [file]\r\n"
+          +filename+" --ip 192.168.1.23 --script [file]\r\n"
+          +"\r\n"
+          +"Example of script:\r\n"
+          +"--zone 1,2 --turnOn --setBrightness 80\r\n"
+          +"--ip 192.168.1.24 --zone 3 --turnOff\r\n")
+    return
+  elif func == "":
+    print("SCRIPT (-S, --script): Run the operations of a script file ('-' for standard input)")
+
+  # Daemon
+  if func == "daemon":
+    print("Run as a daemon keeping warm sessions with the wifi bridges, requests are received on a UNIX socket\r\n"
+          +"\r\n"
+          +"Usage:\r\n"
+          +filename+" --ip 192.168.1.23,192.168.1.24 -D [socket path]\r\n"
+          +filename+" --ip 192.168.1.23,192.168.1.24 --daemon [socket path]\r\n"
+          +"\r\n"
+          +"Example:\r\n"
+          +filename+" --ip 192.168.1.23 --daemon /tmp/milight.sock\r\n")
+    return
+  elif func == "":
+    print("DAEMON (-D, --daemon): Run as a daemon keeping warm sessions, requests are received on a UNIX socket")
+
+  # Client
+  if func == "client":
+    print("Send the requested operations to a daemon (the daemon ip is used if none is specified, the port of\r\n"
+          +"the daemon can't be changed)\r\n"
+          +"\r\n"
+          +"Usage:\r\n"
+          +filename+" -C [socket path] --zone 1 --turnOn\r\n"
+          +filename+" --client [socket path] --zone 1 --turnOn\r\n"
+          +"\r\n"
+          +"Example:\r\n"
+          +filename+" --client /tmp/milight.sock --zone 1,2 --setBrightness 50\r\n")
+    return
+  elif func == "":
+    print("CLIENT (-C, --client): Send the requested operations to a daemon")
+
+  # Capture
+  if func == "capture":
+    print("Record every frame exchanged with the wifi bridges in a binary capture file (see MilightReplay.py)\r\n"
+          +"\r\n"
+          +"Usage:\r\n"
+          +filename+" --ip 192.168.1.23 --capture [file] --turnOn\r\n"
+          +"\r\n"
+          +"Example:\r\n"
+          +filename+" --ip 192.168.1.23 --capture /tmp/milight.cap --script scene.txt\r\n")
+    return
+  elif func == "":
+    print("CAPTURE (--capture): Record every frame exchanged with the wifi bridges in a capture file")
+
   # Get MAC address
   if func in ("m", "getmacaddress"):
     print("Get the milight wifi bridge mac address\r\n"
@@ -1055,6 +2322,372 @@ def __help(func="", filename=__file__):
 
 
 ################################# MAIN FUNCTION ###############################
+# Shell options (the script lines use the same options)
+__SHORT_OPTIONS = "i:p:t:z:hmluofx23ynwagc:b:s:e:d:jkqr:v:1:S:D:C:"
+__LONG_OPTIONS = ["ip=", "port=", "timeout=", "zone=", "help", "debug", "nodebug", "script=", "daemon=", "client=", "capture=",
+                  "getMacAddress", "link", "unlink", "turnOn", "turnOff", "turnOnWifiBridgeLamp",
+                  "turnOffWifiBridgeLamp", "setNightMode", "setWhiteMode", "speedUpDiscoMode", "slowDownDiscoMode",
+                  "setColor=", "setBrightness=", "setSaturation=", "setTemperature=", "setDiscoMode=",
+                  "setWhiteModeBridgeLamp", "speedUpDiscoModeBridgeLamp", "slowDownDiscoModeBridgeLamp",
+                  "setColorBridgeLamp=", "setBrightnessBridgeLamp=", "setDiscoModeBridgeLamp="]
+
+# Shell actions
+# Keyword arguments:
+#   options -- (tuple) Short and long option requesting the action
+#   action -- (string) Action name (see MilightWifiBridge.buildCommandFrame())
+#   valueRange -- (tuple) Minimum and maximum value of the action, None if the action has no value
+#   valueName -- (string) Name of the value in error messages
+#   zoneAction -- (bool) Action sent to each requested zone (False for wifi bridge lamp actions)
+__SHELL_ACTION = collections.namedtuple("ShellAction", "options action valueRange valueName zoneAction")
+__SHELL_ACTIONS = [
+  __SHELL_ACTION(("-m", "--getMacAddress"), "getMacAddress", None, "", False),
+  __SHELL_ACTION(("-l", "--link"), "link", None, "", True),
+  __SHELL_ACTION(("-u", "--unlink"), "unlink", None, "", True),
+  __SHELL_ACTION(("-o", "--turnOn"), "turnOn", None, "", True),
+  __SHELL_ACTION(("-f", "--turnOff"), "turnOff", None, "", True),
+  __SHELL_ACTION(("-x", "--turnOnWifiBridgeLamp"), "turnOnWifiBridgeLamp", None, "", False),
+  __SHELL_ACTION(("-y", "--turnOffWifiBridgeLamp"), "turnOffWifiBridgeLamp", None, "", False),
+  __SHELL_ACTION(("-j", "--setWhiteModeBridgeLamp"), "setWhiteModeBridgeLamp", None, "", False),
+  __SHELL_ACTION(("-k", "--speedUpDiscoModeBridgeLamp"), "speedUpDiscoModeBridgeLamp", None, "", False),
+  __SHELL_ACTION(("-q", "--slowDownDiscoModeBridgeLamp"), "slowDownDiscoModeBridgeLamp", None, "", False),
+  __SHELL_ACTION(("-r", "--setColorBridgeLamp"), "setColorBridgeLamp", (0, 255), "Color", False),
+  __SHELL_ACTION(("-v", "--setBrightnessBridgeLamp"), "setBrightnessBridgeLamp", (0, 100), "Brightness", False),
+  __SHELL_ACTION(("-1", "--setDiscoModeBridgeLamp"), "setDiscoModeBridgeLamp", (1, 9), "Disco mode", False),
+  __SHELL_ACTION(("-n", "--setNightMode"), "setNightMode", None, "", True),
+  __SHELL_ACTION(("-w", "--setWhiteMode"), "setWhiteMode", None, "", True),
+  __SHELL_ACTION(("-a", "--speedUpDiscoMode"), "speedUpDiscoMode", None, "", True),
+  __SHELL_ACTION(("-g", "--slowDownDiscoMode"), "slowDownDiscoMode", None, "", True),
+  __SHELL_ACTION(("-d", "--setDiscoMode"), "setDiscoMode", (1, 9), "Disco mode", True),
+  __SHELL_ACTION(("-c", "--setColor"), "setColor", (0, 255), "Color", True),
+  __SHELL_ACTION(("-b", "--setBrightness"), "setBrightness", (0, 100), "Brightness", True),
+  __SHELL_ACTION(("-s", "--setSaturation"), "setSaturation", (0, 100), "Saturation", True),
+  __SHELL_ACTION(("-e", "--setTemperature"), "setTemperature", (0, 100), "Temperature", True),
+]
+
+# Operation requested from the shell
+# Keyword arguments:
+#   host -- (string) IP of the wifi bridge
+#   zoneId -- (int) Zone ID (None for actions not related to a zone)
+#   action -- (string) Action name
+#   value -- (int) Value of the action (None if the action has no value)
+__OPERATION = collections.namedtuple("Operation", "host zoneId action value")
+
+def __parseList(value, cast):
+  """Parse a comma separated list (example: "1,2,4")
+
+  Keyword arguments:
+    value -- (string) Comma separated list
+    cast -- (function) Conversion of each element
+
+  return: (list) Parsed elements
+  """
+  return [cast(element.strip()) for element in str(value).split(",") if element.strip() != ""]
+
+def __parseOperations(opts, hosts, zones):
+  """Convert shell options into operations (in the requested order)
+
+  Keyword arguments:
+    opts -- (list) Options returned by getopt
+    hosts -- (list of string) Default wifi bridge IPs (overridden by '--ip' options)
+    zones -- (list of int) Default zones (overridden by '--zone' options)
+
+  return: (list of __OPERATION) Operations
+
+  raise: ValueError if an option is invalid (args: error message and help topic, if any)
+  """
+  operations = []
+  for o, a in opts:
+    if o in ("-i", "--ip"):
+      hosts = __parseList(a, str)
+      continue
+    if o in ("-z", "--zone"):
+      zones = __parseList(a, int)
+      continue
+
+    for shellAction in __SHELL_ACTIONS:
+      if o in shellAction.options:
+        value = None
+        if shellAction.valueRange is not None:
+          value = int(a)
+          if value < shellAction.valueRange[0] or value > shellAction.valueRange[1]:
+            raise ValueError("{} must be between {} and {}".format(shellAction.valueName, shellAction.valueRange[0],
+                                                                   shellAction.valueRange[1]))
+        for host in hosts:
+          for zoneId in (zones if shellAction.zoneAction else [None]):
+            operations.append(__OPERATION(host=host, zoneId=zoneId, action=shellAction.action, value=value))
+        break
+
+  if len(hosts) == 0:
+    raise ValueError("You need to specify the ip...", "ip")
+
+  for zoneId in zones:
+    if zoneId < 0 or zoneId > 4:
+      raise ValueError("You need to specify a valid zone ID (between 0 and 4)", "zone")
+
+  return operations
+
+def __readScript(script, hosts, zones):
+  """Read operations from a script (one line of shell options per line, '#' for comments)
+
+  Keyword arguments:
+    script -- (string) Script file path ('-' for standard input)
+    hosts -- (list of string) Default wifi bridge IPs
+    zones -- (list of int) Default zones
+
+  return: (list of __OPERATION) Operations, None if the script is invalid (error already shown)
+  """
+  try:
+    if script == "-":
+      lines = sys.stdin.read().splitlines()
+    else:
+      with open(script) as scriptFile:
+        lines = scriptFile.read().splitlines()
+  except IOError as err:
+    print("[ERROR] Impossible to read script {}: {}".format(script, str(err)))
+    return None
+
+  operations = []
+  for lineNumber, line in enumerate(lines, 1):
+    line = line.split("#", 1)[0].strip()
+    if line == "":
+      continue
+    try:
+      opts, args = getopt.getopt(shlex.split(line), __SHORT_OPTIONS, __LONG_OPTIONS)
+      lineOperations = __parseOperations(opts, hosts, zones)
+    except (getopt.GetoptError, ValueError) as err:
+      print("[ERROR] Script line {}: {}".format(str(lineNumber), str(err.args[0])))
+      return None
+    operations += lineOperations
+
+  return operations
+
+def __runOperations(milight, operations):
+  """Run operations of a wifi bridge, frames are pipelined when possible
+
+  Keyword arguments:
+    milight -- (MilightWifiBridge) Initialized wifi bridge (setup with keepSession to use a single session)
+    operations -- (list of __OPERATION) Operations of the wifi bridge
+
+  return: (list of tuple) (operation, success, duration in sec, output) of each operation
+  """
+  results = []
+  frames = []
+  def sendPendingFrames():
+    for (operation, frame), duration in zip(frames, milight.sendFrames([frame for operation, frame in frames])):
+      results.append((operation, duration is not None, duration or 0.0, ""))
+    del frames[:]
+
+  for operation in operations:
+    if operation.action == "getMacAddress":
+      sendPendingFrames()
+      startTime = time.monotonic()
+      macAddress = milight.getMacAddress()
+      results.append((operation, macAddress != "", time.monotonic() - startTime, macAddress))
+    else:
+      zoneId = operation.zoneId if operation.zoneId is not None else 0
+      frames.append((operation, MilightWifiBridge.buildCommandFrame(operation.action, zoneId, operation.value)))
+  sendPendingFrames()
+
+  return results
+
+def __runHostOperations(host, port, timeout, operations, capture=None):
+  """Run all operations of a wifi bridge in a single session
+
+  Keyword arguments:
+    host -- (string) IP of the wifi bridge
+    port -- (int) UDP port of the wifi bridge
+    timeout -- (float) Timeout in sec
+    operations -- (list of __OPERATION) Operations of the wifi bridge
+    capture -- (MilightTrafficCapture, optional) Capture to record the traffic in
+
+  return: (list of tuple) (operation, success, duration in sec, output) of each operation
+  """
+  milight = MilightWifiBridge()
+  milight.setCapture(capture)
+  if not milight.setup(host, port, timeout, keepSession=True):
+    return [(operation, False, 0.0, "initialization failed") for operation in operations]
+
+  results = __runOperations(milight, operations)
+  milight.close()
+  return results
+
+def __formatResult(operation, success, duration, output):
+  """Format the result of an operation
+
+  return: (string) Result line
+  """
+  return "{} {}{}{}: {}{} ({:.1f}ms)".format(operation.host,
+                                             "" if operation.zoneId is None else "zone {} ".format(operation.zoneId),
+                                             operation.action,
+                                             "" if operation.value is None else " {}".format(operation.value),
+                                             "OK" if success else "FAILED",
+                                             "" if output == "" else " " + output,
+                                             duration * 1000.0)
+
+def __runPerHost(operations, runHostOperations):
+  """Run operations grouped by wifi bridge, wifi bridges in parallel
+
+  Keyword arguments:
+    operations -- (list of __OPERATION) Operations
+    runHostOperations -- (function) Run the operations of a wifi bridge (host, operations) and return their results
+
+  return: (list of tuple) (operation, success, duration in sec, output) of each operation (grouped by wifi bridge)
+  """
+  operationsPerHost = collections.OrderedDict()
+  for operation in operations:
+    operationsPerHost.setdefault(operation.host, []).append(operation)
+
+  resultsPerHost = {}
+  threads = []
+  for host, hostOperations in operationsPerHost.items():
+    thread = threading.Thread(target=lambda h=host, o=hostOperations: resultsPerHost.__setitem__(h, runHostOperations(h, o)))
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+
+  results = []
+  for host in operationsPerHost:
+    results += resultsPerHost[host]
+  return results
+
+################################# DAEMON FUNCTIONS ###############################
+def __runDaemon(socketPath, hosts, port, timeout, capture=None):
+  """Keep warm sessions with the wifi bridges and run the requests received on a local UNIX socket
+
+  Note: A request is one or more lines of shell options (like a script), the response contains the result
+        of each operation followed by 'END [exit code]'
+
+  Keyword arguments:
+    socketPath -- (string) Path of the UNIX socket
+    hosts -- (list of string) Wifi bridges to keep a session with (default wifi bridges of the requests)
+    port -- (int) UDP port of the wifi bridges
+    timeout -- (float) Timeout in sec
+    capture -- (MilightTrafficCapture, optional) Capture to record the traffic in
+
+  return: (int) Exit code
+  """
+  # Wifi bridge IP => (MilightWifiBridge, lock), one client per wifi bridge shared by all requests
+  bridges = {}
+  bridgesLock = threading.Lock()
+
+  def getBridge(host):
+    with bridgesLock:
+      if host not in bridges:
+        milight = MilightWifiBridge()
+        milight.setCapture(capture)
+        milight.setup(host, port, timeout, keepSession=True)
+        bridges[host] = (milight, threading.Lock())
+      return bridges[host]
+
+  def runHostOperations(host, operations):
+    milight, lock = getBridge(host)
+    with lock:
+      return __runOperations(milight, operations)
+
+  def handleRequest(rfile, wfile):
+    returnValue = True
+    actions = 0
+    for rawLine in rfile:
+      line = rawLine.decode("utf-8").split("#", 1)[0].strip()
+      if line == "":
+        continue
+      try:
+        opts, args = getopt.getopt(shlex.split(line), __SHORT_OPTIONS, __LONG_OPTIONS)
+        # The sessions of the daemon are bound to its port
+        for o, a in opts:
+          if o in ("-p", "--port") and int(a) != port:
+            raise ValueError("The port is set by the daemon ({}), it can't be changed by a request".format(str(port)))
+        operations = __parseOperations(opts, hosts, [0])
+      except (getopt.GetoptError, ValueError) as err:
+        logging.warning("Invalid request '{}': {}".format(line, str(err.args[0])))
+        wfile.write("[ERROR] Invalid request '{}': {}\n".format(line, str(err.args[0])).encode("utf-8"))
+        returnValue = False
+        continue
+
+      actions += len(operations)
+      for operation, success, duration, output in __runPerHost(operations, runHostOperations):
+        returnValue &= success
+        wfile.write((__formatResult(operation, success, duration, output) + "\n").encode("utf-8"))
+    if actions == 0 and returnValue:
+      wfile.write("[ERROR] You must call one action, use '-h' to get more information.\n".encode("utf-8"))
+      returnValue = False
+    wfile.write("END {}\n".format(0 if returnValue else 1).encode("utf-8"))
+
+  class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+      handleRequest(self.rfile, self.wfile)
+
+  if not hasattr(socket, "AF_UNIX"):
+    print("[ERROR] UNIX sockets are not available on this platform")
+    return 1
+
+  # Remove the socket of a previous daemon (only if it is not running anymore)
+  if os.path.exists(socketPath):
+    try:
+      probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      probe.connect(socketPath)
+      probe.close()
+      print("[ERROR] A daemon is already running on "+socketPath)
+      return 1
+    except socket.error:
+      os.unlink(socketPath)
+
+  # Start the sessions before the first request
+  for host in hosts:
+    milight, lock = getBridge(host)
+    with lock:
+      logging.info("Session started with {} (MAC address: {})".format(host, milight.getMacAddress(cached=False)))
+
+  server = socketserver.ThreadingUnixStreamServer(socketPath, DaemonRequestHandler)
+  server.daemon_threads = True
+  # serve_forever() must be stopped from another thread
+  signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+  os.chmod(socketPath, 0o660)
+  print("Daemon listening on "+socketPath)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    os.unlink(socketPath)
+    for milight, lock in bridges.values():
+      milight.close()
+
+  return 0
+
+def __runClient(socketPath, lines):
+  """Send a request to a daemon and show the results
+
+  Keyword arguments:
+    socketPath -- (string) Path of the UNIX socket of the daemon
+    lines -- (list of string) Request lines (shell options)
+
+  return: (int) Exit code
+  """
+  try:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socketPath)
+    sock.sendall(("\n".join(lines) + "\n").encode("utf-8"))
+    sock.shutdown(socket.SHUT_WR)
+
+    returnValue = 1
+    for rawLine in sock.makefile("rb"):
+      line = rawLine.decode("utf-8").rstrip("\n")
+      if line.startswith("END "):
+        returnValue = int(line[4:])
+      else:
+        print(line)
+    sock.close()
+  except (socket.error, AttributeError) as err:
+    print("[ERROR] Impossible to reach the daemon on {}: {}".format(socketPath, str(err)))
+    return 2
+
+  if returnValue != 0:
+    print("[ERROR] Request failed")
+  return returnValue
+
 def main(parsed_args = sys.argv[1:]):
   """Shell Milight utility function"""
 
@@ -1062,20 +2695,18 @@ def main(parsed_args = sys.argv[1:]):
   logger = logging.getLogger()
   logger.setLevel(logging.CRITICAL) #Other parameters: logging.DEBUG, logging.WARNING, logging.ERROR
 
-  ip = "" # No default IP, must be specified by the user
+  hosts = [] # No default IP, must be specified by the user
   port = 5987 # Default milight 3.0 port
-  zone = 0 # By default, all zone are controlled
+  zones = [0] # By default, all zone are controlled
   timeout = 5.0 # By default, Wait maximum 5sec
+  script = "" # No script by default
+  daemonSocket = "" # Not a daemon by default
+  clientSocket = "" # Not a daemon client by default
+  capturePath = "" # No traffic capture by default
 
   # Get options
   try:
-    opts, args = getopt.getopt(parsed_args, "i:p:t:z:hmluofx23ynwagc:b:s:e:d:jkqr:v:1:",
-                               ["ip=", "port=", "timeout=", "zone=", "help", "debug", "nodebug",
-                                "getMacAddress", "link", "unlink", "turnOn", "turnOff", "turnOnWifiBridgeLamp",
-                                "turnOffWifiBridgeLamp", "setNightMode", "setWhiteMode", "speedUpDiscoMode", "slowDownDiscoMode",
-                                "setColor=", "setBrightness=", "setSaturation=", "setTemperature=", "setDiscoMode=",
-                                "setWhiteModeBridgeLamp", "speedUpDiscoModeBridgeLamp", "slowDownDiscoModeBridgeLamp",
-                                "setColorBridgeLamp=", "setBrightnessBridgeLamp=", "setDiscoModeBridgeLamp="])
+    opts, args = getopt.getopt(parsed_args, __SHORT_OPTIONS, __LONG_OPTIONS)
   except getopt.GetoptError as err:
     print("[ERROR] "+str(err))
     __help()
@@ -1101,29 +2732,46 @@ def main(parsed_args = sys.argv[1:]):
   # Get base parameters
   for o, a in opts:
     if o in ("-i", "--ip"):
-      ip = str(a)
+      hosts = __parseList(a, str)
       continue
     if o in ("-p", "--port"):
       port = int(a)
       continue
     if o in ("-t", "--timeout"):
-      timeout = int(a)
+      timeout = float(a)
       continue
     if o in ("-z", "--zone"):
-      zone = int(a)
+      zones = __parseList(a, int)
+      continue
+    if o in ("-S", "--script"):
+      script = str(a)
+      continue
+    if o in ("-D", "--daemon"):
+      daemonSocket = str(a)
+      continue
+    if o in ("-C", "--client"):
+      clientSocket = str(a)
+      continue
+    if o == "--capture":
+      capturePath = str(a)
       continue
 
-  # Check base parameters
-  if ip == "":
-    print("[ERROR] You need to specify the ip...\r\n")
-    __help("ip")
-    sys.exit(1)
-
-  if zone < 0 or zone > 4:
-    print("[ERROR] You need to specify a valid zone ID (between 0 and 4)\r\n")
-    __help("zone")
-    sys.exit(1)
+  # Thin client: forward the options (and the script lines) to the daemon
+  if clientSocket != "":
+    forwardedOpts = [(o, a) for o, a in opts if o not in ("-C", "--client", "-S", "--script")]
+    defaultOpts = [(o, a) for o, a in opts if o in ("-i", "--ip", "-z", "--zone")]
+    toLine = lambda optList: " ".join(shlex.quote(o) + ("" if a == "" else " " + shlex.quote(a)) for o, a in optList)
+    lines = [toLine(forwardedOpts)]
+    if script != "":
+      try:
+        scriptLines = sys.stdin.read().splitlines() if script == "-" else open(script).read().splitlines()
+      except IOError as err:
+        print("[ERROR] Impossible to read script {}: {}".format(script, str(err)))
+        sys.exit(1)
+      lines += [toLine(defaultOpts) + " " + line for line in scriptLines if line.split("#", 1)[0].strip() != ""]
+    sys.exit(__runClient(clientSocket, lines))
 
+  # Check base parameters
   if timeout <= 0:
     print("[ERROR] You need to specify a valid timeout (more than 0sec)\r\n")
     __help("timeout")
@@ -1134,141 +2782,58 @@ def main(parsed_args = sys.argv[1:]):
     __help("port")
     sys.exit(1)
 
+  # Get requested operations (command line first, then script)
+  try:
+    operations = __parseOperations(opts, hosts, zones)
+  except ValueError as err:
+    print("[ERROR] "+str(err.args[0])+"\r\n")
+    if len(err.args) > 1:
+      __help(err.args[1])
+    sys.exit(1)
+  if script != "":
+    scriptOperations = __readScript(script, hosts, zones)
+    operations = None if scriptOperations is None else operations + scriptOperations
+  if operations is None:
+    sys.exit(1)
+
+  capture = None
+  if capturePath != "":
+    try:
+      capture = MilightTrafficCapture(capturePath)
+    except IOError as err:
+      print("[ERROR] Impossible to create capture {}: {}".format(capturePath, str(err)))
+      sys.exit(1)
+
+  if daemonSocket != "":
+    returnValue = __runDaemon(daemonSocket, hosts, port, timeout, capture)
+    if capture is not None:
+      capture.close()
+    sys.exit(returnValue)
+
   # Show base parameters
-  print("Ip: "+str(ip))
-  print("Zone: "+str(zone))
+  print("Ip: "+", ".join(hosts))
+  print("Zone: "+", ".join(str(zoneId) for zoneId in zones))
   print("Timeout: "+str(timeout))
   print("Port: "+str(port))
 
-  # Initialize Milight bridge
-  milight = MilightWifiBridge()
-  milight.close()
-  is_init = milight.setup(ip, port, timeout)
-  logging.debug("Milight bridge connection initialized with ip {}:{} : {}".format(ip, port, is_init))
-  if (not is_init):
-    print("[ERROR] Initialization failed, re-check the ip (and the port), use '-h' to get more information.")
-    sys.exit(2)
+  if len(operations) == 0:
+    print("[ERROR] You must call one action, use '-h' to get more information.")
+    sys.exit(1)
 
-  # Execute requested commands in the requested order
+  # Execute requested operations in the requested order (wifi bridges in parallel)
   returnValue = True
-  atLeastOneRequestDone = False
+  runHostOperations = lambda host, hostOperations: __runHostOperations(host, port, timeout, hostOperations, capture)
+  for operation, success, duration, output in __runPerHost(operations, runHostOperations):
+    returnValue &= success
+    print(__formatResult(operation, success, duration, output))
+  if capture is not None:
+    capture.close()
 
-  for o, a in opts:
-    if o in ("-m", "--getMacAddress"):
-      atLeastOneRequestDone = True
-      macAddress = milight.getMacAddress()
-      returnValue &= (macAddress != "")
-      if macAddress != "":
-        print(str(macAddress))
-    elif o in ("-l", "--link"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.link(zoneId=zone)
-    elif o in ("-u", "--unlink"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.unlink(zoneId=zone)
-    elif o in ("-o", "--turnOn"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.turnOn(zoneId=zone)
-    elif o in ("-f", "--turnOff"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.turnOff(zoneId=zone)
-    elif o in ("-x", "--turnOnWifiBridgeLamp"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.turnOnWifiBridgeLamp()
-    elif o in ("-y", "--turnOffWifiBridgeLamp"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.turnOffWifiBridgeLamp()
-    elif o in ("-j", "--setWhiteModeBridgeLamp"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.setWhiteModeBridgeLamp()
-    elif o in ("-k", "--speedUpDiscoModeBridgeLamp"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.speedUpDiscoModeBridgeLamp()
-    elif o in ("-q", "--slowDownDiscoModeBridgeLamp"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.slowDownDiscoModeBridgeLamp()
-    elif o in ("-r", "--setColorBridgeLamp"):
-      userColor = int(a)
-      if userColor < 0 or userColor > 255:
-        print("[ERROR] Color must be between 0 and 255")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setColorBridgeLamp(color=userColor)
-    elif o in ("-v", "--setBrightnessBridgeLamp"):
-      userBrightness = int(a)
-      if userBrightness < 0 or userBrightness > 100:
-        print("[ERROR] Brightness must be between 0 and 100 (in %)")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setBrightnessBridgeLamp(brightness=userBrightness)
-    elif o in ("-1", "--setDiscoModeBridgeLamp"):
-      mode = int(a)
-      if mode < 1 or mode > 9:
-        print("[ERROR] Disco mode must be between 1 and 9")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setDiscoModeBridgeLamp(discoMode=mode)
-    elif o in ("-n", "--setNightMode"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.setNightMode(zoneId=zone)
-    elif o in ("-w", "--setWhiteMode"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.setWhiteMode(zoneId=zone)
-    elif o in ("-a", "--speedUpDiscoMode"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.speedUpDiscoMode(zoneId=zone)
-    elif o in ("-g", "--slowDownDiscoMode"):
-      atLeastOneRequestDone = True
-      returnValue &= milight.slowDownDiscoMode(zoneId=zone)
-    elif o in ("-d", "--setDiscoMode"):
-      mode = int(a)
-      if mode < 1 or mode > 9:
-        print("[ERROR] Disco mode must be between 1 and 9")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setDiscoMode(discoMode=mode, zoneId=zone)
-    elif o in ("-c", "--setColor"):
-      userColor = int(a)
-      if userColor < 0 or userColor > 255:
-        print("[ERROR] Color must be between 0 and 255")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setColor(color=userColor, zoneId=zone)
-    elif o in ("-b", "--setBrightness"):
-      userBrightness = int(a)
-      if userBrightness < 0 or userBrightness > 100:
-        print("[ERROR] Brightness must be between 0 and 100 (in %)")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setBrightness(brightness=userBrightness, zoneId=zone)
-    elif o in ("-s", "--setSaturation"):
-      userSaturation = int(a)
-      if userSaturation < 0 or userSaturation > 100:
-        print("[ERROR] Saturation must be between 0 and 100 (in %)")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setSaturation(saturation=userSaturation, zoneId=zone)
-    elif o in ("-e", "--setTemperature"):
-      userTemperature = int(a)
-      if userTemperature < 0 or userTemperature > 100:
-        print("[ERROR] Temperature must be between 0 and 100 (in %)")
-        sys.exit(2)
-      atLeastOneRequestDone = True
-      returnValue &= milight.setTemperature(temperature=userTemperature, zoneId=zone)
-
-    # In case an error occured in any of the request, stop the program
-    if not returnValue:
-      break
-
-  if not atLeastOneRequestDone:
-    print("[ERROR] You must call one action, use '-h' to get more information.")
-    sys.exit(1)
   if not returnValue:
     print("[ERROR] Request failed")
     sys.exit(1)
 
-  if atLeastOneRequestDone and returnValue:
-    sys.exit(0)
+  sys.exit(0)
 
 if __name__ == '__main__':
   main()
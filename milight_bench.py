@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmark of the MiLight NodeServer without PG3 and ISY.
+
+The Controller, MiLightBridge and MiLightLight nodes of milight_poly.py run against a local stand-in of
+udi_interface (which only counts the driver reports sent to the ISY) and local UDP bridge stand-ins (see
+MilightReplay.MilightBridgeStandIn, one per bridge on 127.0.0.x). Command mixes are dispatched to the nodes
+like PG3 does (node.runCmd()) and the handler latency, the frames sent per command, the driver reports per
+command and the CPU time per command are reported:
+
+    python3 milight_bench.py --bridges 4 --repeat 5
+    python3 milight_bench.py --mix slider --ackDelay 5 --optimistic
+"""
+
+import getopt
+import logging
+import os
+import sys
+import time
+import types
+from copy import deepcopy
+
+from MilightReplay import MilightBridgeStandIn
+
+MIXES = ('slider', 'scene', 'houseoff', 'groupoff')
+
+
+class _StubCustom(dict):
+    """ udi_interface.Custom stand-in (custom data kept in memory) """
+
+    def __init__(self, poly, name):
+        super(_StubCustom, self).__init__()
+        self.poly = poly
+        self.name = name
+
+    def load(self, data, save=False):
+        self.clear()
+        if data is not None:
+            self.update(data)
+
+
+class _StubNode(object):
+    """ udi_interface.Node stand-in (drivers are only reported to the ISY when they change or are forced) """
+
+    def __init__(self, poly, primary, address, name):
+        self.poly = poly
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.drivers = deepcopy(self.drivers)
+
+    def getDriver(self, driver):
+        for item in self.drivers:
+            if item['driver'] == driver:
+                return item['value']
+        return None
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None, text=None):
+        for item in self.drivers:
+            if item['driver'] == driver:
+                changed = item['value'] != value
+                item['value'] = value
+                if report and (changed or force):
+                    self.poly.send({'set': [{'address': self.address, 'driver': driver, 'value': str(value)}]}, 'status')
+                return changed
+        return False
+
+    def reportDrivers(self):
+        self.poly.send({'set': [dict(item, address=self.address) for item in self.drivers]}, 'status')
+
+    def reportCmd(self, command, value=None, uom=None):
+        self.poly.send({'command': [{'address': self.address, 'cmd': command}]}, 'command')
+
+    def runCmd(self, command):
+        if command['cmd'] in self.commands:
+            self.commands[command['cmd']](self, command)
+
+
+class _StubInterface(object):
+    """ udi_interface.Interface stand-in (events are dispatched synchronously, messages to PG3 are counted) """
+
+    START = 'start'
+    STOP = 'stop'
+    POLL = 'poll'
+    CUSTOMPARAMS = 'customparams'
+    CUSTOMDATA = 'customdata'
+    CONFIGDONE = 'configdone'
+
+    def __init__(self, *args):
+        self.subscribers = {}
+        self.nodesByAddress = {}
+        self.Notices = {}
+        self.reports = 0
+
+    def subscribe(self, event, callback, address=None):
+        self.subscribers.setdefault(event, []).append((callback, address))
+
+    def publish(self, event, *args):
+        for callback, address in list(self.subscribers.get(event, [])):
+            callback(*args)
+
+    def ready(self):
+        pass
+
+    def addNode(self, node, conn_status=None, rename=False):
+        self.nodesByAddress[node.address] = node
+        for callback, address in list(self.subscribers.get(self.START, [])):
+            if address == node.address:
+                callback()
+        return node
+
+    def getNode(self, address):
+        return self.nodesByAddress.get(address)
+
+    def delNode(self, address):
+        self.nodesByAddress.pop(address, None)
+
+    def nodes(self):
+        return list(self.nodesByAddress.values())
+
+    def send(self, message, topic):
+        if topic == 'status':
+            self.reports += len(message['set'])
+
+    def updateProfile(self):
+        pass
+
+    def setCustomParamsDoc(self, html=None):
+        pass
+
+
+def stubInterface():
+    """ Give a module standing in for udi_interface """
+    module = types.ModuleType('udi_interface')
+    module.LOGGER = logging.getLogger('udi_interface')
+    module.Custom = _StubCustom
+    module.Node = _StubNode
+    module.Interface = _StubInterface
+    return module
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))] if values else 0.0
+
+
+class NodeServerBench(object):
+    """ NodeServer running against the udi_interface stand-in and local bridge stand-ins """
+
+    def __init__(self, bridges=2, ackDelay=0.0, optimistic=False):
+        # milight_poly reads server.json and the profile from its directory, udi_interface must be replaced first
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        sys.modules['udi_interface'] = stubInterface()
+        import milight_poly
+        self.milight_poly = milight_poly
+
+        self.standIns = []
+        port = 0
+        for index in range(bridges):
+            standIn = MilightBridgeStandIn(ip='127.0.0.' + str(index + 1), port=port, ackDelay=ackDelay)
+            port = standIn.address[1]
+            standIn.start()
+            self.standIns.append(standIn)
+        hosts = [standIn.address[0] for standIn in self.standIns]
+
+        self.poly = _StubInterface()
+        self.controller = milight_poly.Controller(self.poly, 'controller', 'controller', 'MiLightNodeServer')
+        self.poly.publish(self.poly.CUSTOMPARAMS, {'host': ','.join(hosts), 'port': str(port),
+                                                   'group_house': ','.join(hosts),
+                                                   'optimistic': 'true' if optimistic else 'false'})
+        self.poly.publish(self.poly.CUSTOMDATA, {})
+        self.poly.publish(self.poly.CONFIGDONE)
+
+    def stop(self):
+        self.poly.publish(self.poly.STOP)
+        for standIn in self.standIns:
+            standIn.stop()
+
+    def mix(self, name):
+        """ Give the (node address, command) list of a command mix """
+        bridges = [self.controller.bridges[standIn.address[0]] for standIn in self.standIns]
+        lights = [bridge + '_zone' + str(zone) for bridge in bridges for zone in range(1, 5)]
+        if name == 'slider':
+            # Brightness slider dragged from 100% to 1% and back on one light
+            return [(lights[0], {'cmd': 'SET_BRI', 'value': str(value)})
+                    for value in list(range(100, 0, -3)) + list(range(1, 101, 3))]
+        if name == 'scene':
+            # Every light turned on with a color and a brightness
+            commands = []
+            for index, light in enumerate(lights):
+                commands.append((light, {'cmd': 'DON'}))
+                commands.append((light, {'cmd': 'SET_HSV', 'query': {'H.uom14': str(index * 45 % 360), 'S.uom51': '80',
+                                                                     'V.uom51': '60'}}))
+            return commands
+        if name == 'houseoff':
+            # Every light and bridge lamp turned off one node at a time
+            return [(address, {'cmd': 'DOF'}) for address in lights + bridges]
+        if name == 'groupoff':
+            # Every light turned off with one group command
+            return [(self.controller.groupAddresses['house'], {'cmd': 'DOF'})]
+        raise ValueError('Unknown mix ' + name)
+
+    def run(self, name, repeat=1):
+        """ Dispatch a command mix and give its figures """
+        commands = self.mix(name) * repeat
+        frames = sum(standIn.requests for standIn in self.standIns)
+        handshakes = sum(standIn.handshakes for standIn in self.standIns)
+        reports = self.poly.reports
+        latencies = []
+        cpuStart = time.process_time()
+        wallStart = time.perf_counter()
+        for address, command in commands:
+            node = self.poly.getNode(address)
+            startTime = time.perf_counter()
+            node.runCmd(command)
+            latencies.append(time.perf_counter() - startTime)
+        wall = time.perf_counter() - wallStart
+        # ACKs checked in background (optimistic mode) are waited for before counting the frames and CPU time
+        time.sleep(0.2 + self.standIns[0].ackDelay)
+        cpu = time.process_time() - cpuStart
+        count = float(len(commands))
+        return {'mix': name, 'commands': len(commands), 'wall': wall,
+                'p50': percentile(latencies, 0.5), 'p99': percentile(latencies, 0.99),
+                'frames': (sum(standIn.requests for standIn in self.standIns) - frames) / count,
+                'handshakes': (sum(standIn.handshakes for standIn in self.standIns) - handshakes) / count,
+                'reports': (self.poly.reports - reports) / count,
+                'cpu': cpu / count}
+
+
+def __help():
+    print('End-to-end benchmark of the MiLight NodeServer against local bridge stand-ins\r\n'
+          + '\r\n'
+          + 'Usage:\r\n'
+          + __file__ + ' [options]\r\n'
+          + '\r\n'
+          + 'Options:\r\n'
+          + '  -b, --bridges [count]: Number of bridge stand-ins (default: 2)\r\n'
+          + '  -r, --repeat [count]: Number of times each mix is dispatched (default: 3)\r\n'
+          + '  -m, --mix [name]: Mix to run (' + ', '.join(MIXES) + ', default: all)\r\n'
+          + '  -d, --ackDelay [ms]: Delay of the stand-ins before answering (default: 0)\r\n'
+          + '  -o, --optimistic: Update the drivers without waiting for the ACKs\r\n'
+          + '  -l, --debug: Show debug logs\r\n')
+
+
+def main(parsed_args=sys.argv[1:]):
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    bridges = 2
+    repeat = 3
+    mixes = MIXES
+    ackDelay = 0.0
+    optimistic = False
+    try:
+        opts, args = getopt.getopt(parsed_args, 'b:r:m:d:olh', ['bridges=', 'repeat=', 'mix=', 'ackDelay=', 'optimistic', 'debug', 'help'])
+    except getopt.GetoptError as err:
+        print('[ERROR] ' + str(err))
+        __help()
+        sys.exit(1)
+
+    for o, a in opts:
+        if o in ('-h', '--help'):
+            __help()
+            sys.exit(0)
+        elif o in ('-b', '--bridges'):
+            bridges = int(a)
+        elif o in ('-r', '--repeat'):
+            repeat = int(a)
+        elif o in ('-m', '--mix'):
+            mixes = [mix.strip() for mix in a.split(',')]
+        elif o in ('-d', '--ackDelay'):
+            ackDelay = float(a) / 1000.0
+        elif o in ('-o', '--optimistic'):
+            optimistic = True
+        elif o in ('-l', '--debug'):
+            logging.getLogger().setLevel(logging.DEBUG)
+
+    unknown = [mix for mix in mixes if mix not in MIXES]
+    if bridges < 1 or bridges > 254 or repeat < 1 or unknown:
+        print('[ERROR] You need to specify between 1 and 254 bridges, a repeat of at least 1 and known mixes\r\n')
+        __help()
+        sys.exit(1)
+
+    bench = NodeServerBench(bridges, ackDelay, optimistic)
+    try:
+        print('{:<10} {:>8} {:>9} {:>9} {:>9} {:>8} {:>10} {:>8} {:>9}'.format(
+            'Mix', 'Commands', 'Wall', 'p50', 'p99', 'Frames', 'Handshakes', 'Reports', 'CPU'))
+        for mix in mixes:
+            result = bench.run(mix, repeat)
+            print('{mix:<10} {commands:>8} {wallMs:>7.1f}ms {p50Ms:>7.2f}ms {p99Ms:>7.2f}ms {frames:>8.2f} {handshakes:>10.2f} '
+                  '{reports:>8.2f} {cpuMs:>7.3f}ms'.format(wallMs=result['wall'] * 1000.0, p50Ms=result['p50'] * 1000.0,
+                                                          p99Ms=result['p99'] * 1000.0, cpuMs=result['cpu'] * 1000.0,
+                                                          **result))
+        print('(Frames, Handshakes and Reports are per command, Reports are the driver updates sent to the ISY)')
+    finally:
+        bench.stop()
+
+
+if __name__ == '__main__':
+    main()
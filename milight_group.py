@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Groups of MiLight zones spanning several bridges for the MiLight NodeServer.
+
+A group is a list of (bridge host, zone) members. A group command is compiled once into a fan-out plan
+giving the zones to address on each bridge: a bridge whose 4 zones are all members is addressed with the
+zone 0 (all zones) of the protocol, so that each command costs one frame per bridge instead of one frame
+per zone. The state of a group is derived from the last confirmed state of its members.
+"""
+
+from collections import Counter
+
+from MilightWifiBridge import MilightWifiBridge
+
+ZONES = (1, 2, 3, 4)
+
+
+def parseMembers(value):
+    """ Parse the members of a group: comma separated 'host:zone' ('host' alone for its 4 zones) """
+    members = []
+    for member in value.split(','):
+        member = member.strip()
+        if member == '':
+            continue
+        host, separator, zone = member.rpartition(':')
+        if not separator:
+            host, zones = zone, ZONES
+        else:
+            try:
+                zones = (int(zone),)
+            except ValueError:
+                raise ValueError('invalid zone "{0}" of member "{1}"'.format(zone, member))
+        if host.strip() == '' or zones[0] not in ZONES:
+            raise ValueError('invalid member "{0}" (expected host:zone with zone 1 to 4)'.format(member))
+        for zone in zones:
+            if (host.strip(), zone) not in members:
+                members.append((host.strip(), zone))
+    if not members:
+        raise ValueError('a group needs at least one member')
+    return members
+
+
+class GroupPlan(object):
+    """ Zones to address on each bridge to send a command to all the members of a group """
+
+    def __init__(self, members):
+        self.members = tuple(members)
+        self.zones = {}
+        for host, zone in self.members:
+            self.zones.setdefault(host, set()).add(zone)
+        # Zone 0 addresses the 4 zones of a bridge with a single frame
+        self.targets = dict((host, (MilightWifiBridge.eZone.ALL,) if zones == set(ZONES) else tuple(sorted(zones)))
+                            for host, zones in self.zones.items())
+
+    def hosts(self):
+        return list(self.targets)
+
+    def frames(self, host, actions):
+        """ Build the frames of a list of (action, value) for the members of a bridge """
+        return [MilightWifiBridge.buildCommandFrame(action, zone, value)
+                for zone in self.targets[host] for action, value in actions]
+
+    def frameCount(self, actions):
+        return sum(len(targets) for targets in self.targets.values()) * len(actions)
+
+
+def deriveState(rows):
+    """ Give the state of a group from the states of its members ({driver: value} each)
+
+    The group is on when any member is on, its saturation and brightness are the average of the members and
+    its other drivers are the value shared by most members.
+    """
+    if not rows:
+        return {}
+    state = {'ST': 100 if any(row.get('ST', 0) != 0 for row in rows) else 0}
+    for driver in ('GV2', 'GV3'):
+        values = [row[driver] for row in rows if driver in row]
+        if values:
+            state[driver] = int(round(sum(values) / float(len(values))))
+    for driver in ('GV1', 'GV4', 'GV5', 'CLITEMP'):
+        values = [row[driver] for row in rows if driver in row]
+        if values:
+            state[driver] = Counter(values).most_common(1)[0][0]
+    return state
@@ -10,13 +10,24 @@ import udi_interface
 import time
 import json
 import sys
+import os
+import hashlib
+import threading
 from copy import deepcopy
-from MilightWifiBridge import MilightWifiBridge
+from MilightWifiBridge import MilightWifiBridge, MilightSharedWifiBridge, MilightBridgeStatistics, MilightBridgeIdentity, MilightTrafficCapture, MilightTracer
+from MilightColors import MilightColorConverter, MilightKelvinTable
+from milight_shard import BridgeWorkerPool
+from milight_state import ZoneStateTable, DesiredStateJournal
+from milight_group import GroupPlan, parseMembers, deriveState
 
 LOGGER = udi_interface.LOGGER
 SERVERDATA = json.load(open('server.json'))
 VERSION = SERVERDATA['credits'][0]['version']
 
+# Time in sec a bridge has to answer a request, kept short as an unreachable bridge is handled by the retry, the
+# circuit breaker and the journal (a command blocks the Polyglot event thread for about 3 times this timeout)
+BRIDGE_TIMEOUT = 2.0
+
 def get_profile_info(logger):
     pvf = 'profile/version.txt'
     try:
@@ -25,13 +36,77 @@ def get_profile_info(logger):
     except Exception as err:
         logger.error('get_profile_info: failed to read  file {0}: {1}'.format(pvf,err), exc_info=True)
         pv = 0
-    f.close()
-    return { 'version': pv }
+
+    # Hash of the profile files and of the configuration help, sent to Polyglot with the profile
+    digest = hashlib.sha256()
+    files = [os.path.join(root, name) for root, dirs, names in os.walk('profile') for name in names] + ['POLYGLOT_CONFIG.md']
+    for path in sorted(files):
+        try:
+            with open(path, 'rb') as f:
+                digest.update(path.encode('utf-8') + b'\0' + f.read() + b'\0')
+        except Exception as err:
+            logger.error('get_profile_info: failed to read  file {0}: {1}'.format(path,err))
+    return { 'version': pv, 'hash': digest.hexdigest() }
+
+class BridgeCircuitBreaker(object):
+    """ Fail the commands of an unreachable bridge immediately until a background probe reaches it again """
+
+    def __init__(self, host, port, threshold=3, minBackoff=5.0, maxBackoff=300.0, onRecover=None):
+        self.host = host
+        self.port = port
+        self.onRecover = onRecover
+        self.threshold = threshold
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.failures = 0
+        self.opened = False
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+
+    def allow(self):
+        return not self.opened
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures = self.failures + 1
+            if self.failures < self.threshold or self.opened:
+                return
+            self.opened = True
+        LOGGER.error('MiLight bridge %s is unreachable, commands are rejected until it answers again', self.host)
+        threading.Thread(target=self.probe, name='milight-probe-' + self.host, daemon=True).start()
+
+    def probe(self):
+        backoff = self.minBackoff
+        myMilight = MilightWifiBridge()
+        while not self.stopEvent.wait(backoff):
+            # A successful start session is enough to know the bridge is back
+            if myMilight.setup(self.host, self.port, 2.0) and myMilight.getMacAddress() != '':
+                LOGGER.info('MiLight bridge %s is reachable again', self.host)
+                with self.lock:
+                    self.failures = 0
+                    self.opened = False
+                # Commands rejected during the outage are sent now
+                if self.onRecover is not None:
+                    self.onRecover(self.host)
+                break
+            backoff = min(backoff * 2, self.maxBackoff)
+        myMilight.close()
+
+    def stop(self):
+        self.stopEvent.set()
+
+COLOR_VALUE = [0x85,0xBA,0x7A,0xD9,0x54,0x1E,0xFF,0x3B]
+WHITE_TEMP = [0,8,35,61,100]
+WHITE_KELVIN = [2700,3000,4000,5000,6500]
 
 class Controller(udi_interface.Node):
 
-    COLOR_VALUE = [0x85,0xBA,0x7A,0xD9,0x54,0x1E,0xFF,0x3B]
-    WHITE_TEMP = [0,8,35,61,100]
+    COLOR_VALUE = COLOR_VALUE
+    WHITE_TEMP = WHITE_TEMP
 
     def __init__(self, polyglot, primary, address, name):
         super(Controller, self).__init__(polyglot, primary, address, name)
@@ -41,12 +116,36 @@ class Controller(udi_interface.Node):
         self.queryON = False
         self.milight_host = ""
         self.milight_port = 5987
+        self.bridges = {}
+        self.bridgeStatistics = {}
+        self.bridgeIdentities = {}
+        self.bridgeClients = {}
+        self.groups = {}
+        self.groupAddresses = {}
+        self.breakers = {}
+        self.kelvinTables = {}
+        self.capture = None
+        self.keepAlive = 0.0
+        self.optimistic = False
+        self.driverGenerations = {}
+        self.generationLock = threading.Lock()
+        self.brightnessStep = 10
+        self.tracePath = None
+        self.zoneState = ZoneStateTable()
+        self.journal = DesiredStateJournal()
+        self.stateChanged = False
+        self.configDone = False
+        self.Data = udi_interface.Custom(polyglot, 'customdata')
+        self.workerPool = None
         self.tries = 0
         self.hb = 0
         
         polyglot.subscribe(polyglot.START, self.start, address)
         polyglot.subscribe(polyglot.CUSTOMPARAMS, self.parameterHandler)
+        polyglot.subscribe(polyglot.CUSTOMDATA, self.dataHandler)
+        polyglot.subscribe(polyglot.CONFIGDONE, self.configDoneHandler)
         polyglot.subscribe(polyglot.POLL, self.poll)
+        polyglot.subscribe(polyglot.STOP, self.stop)
 
         polyglot.ready()
         polyglot.addNode(self)
@@ -63,24 +162,263 @@ class Controller(udi_interface.Node):
                 self.milight_port = int(params['port'])
             else:
                 self.milight_port = 5987
+
+            # Kelvin calibration of all the bridges ('kelvin') or of the lights of one bridge ('kelvin_<host>')
+            self.kelvinTables = {}
+            for key in params:
+                if key == 'kelvin' or key.startswith('kelvin_'):
+                    try:
+                        self.kelvinTables[key[len('kelvin_'):]] = MilightKelvinTable.parse(params[key])
+                    except ValueError as ex:
+                        self.poly.Notices[key] = 'Invalid Kelvin calibration "{0}": {1}'.format(key, ex)
+                        LOGGER.error('Invalid Kelvin calibration %s: %s', key, str(ex))
+
+            # Groups of zones of any bridges ('group_<name>' = comma separated host:zone members)
+            self.groups = {}
+            for key in params:
+                if key.startswith('group_') and key[len('group_'):] != '':
+                    try:
+                        self.groups[key[len('group_'):]] = parseMembers(params[key])
+                    except ValueError as ex:
+                        self.poly.Notices[key] = 'Invalid group "{0}": {1}'.format(key, ex)
+                        LOGGER.error('Invalid group %s: %s', key, str(ex))
+
+            # Brightness step of the BRT and DIM commands
+            self.brightnessStep = max(int(params['step']), 1) if 'step' in params and params['step'] != '' else 10
+
+            # Keep alive of the idle bridge sessions (in the NodeServer process only)
+            keepAlive = float(params['keepalive']) if 'keepalive' in params and params['keepalive'] != '' else 0.0
+            if keepAlive != self.keepAlive:
+                self.keepAlive = keepAlive
+                for client in self.bridgeClients.values():
+                    client.setKeepAlive(self.keepAlive)
+
+            # Drivers updated without waiting for the ACKs of the bridges (in the NodeServer process only)
+            self.optimistic = 'optimistic' in params and params['optimistic'].strip().lower() in ('1', 'true', 'yes')
+
+            # Traffic capture of the bridges (in the NodeServer process only)
+            if 'capture' in params and params['capture'] != '' and self.capture is None:
+                LOGGER.info('Recording MiLight traffic in %s', params['capture'])
+                self.capture = MilightTrafficCapture(params['capture'])
+                for client in self.bridgeClients.values():
+                    client.setCapture(self.capture)
+
+            # Tracing of the commands, saved as Chrome trace JSON at each short poll
+            if 'trace' in params and params['trace'] != '':
+                if MilightTracer.active() is None:
+                    LOGGER.info('Tracing MiLight commands in %s', params['trace'])
+                    MilightTracer.start()
+                self.tracePath = params['trace']
+            elif self.tracePath is not None:
+                self.saveTrace()
+                MilightTracer.stop()
+                self.tracePath = None
+
+            # Worker processes can only be enabled at startup (before the nodes are created), bridges are bound to
+            # them with their nodes
+            if 'workers' in params and params['workers'] != '' and self.workerPool is None and not self.configDone:
+                try:
+                    workers = int(params['workers'])
+                except ValueError:
+                    workers = 0
+                    self.poly.Notices['workers'] = 'Invalid number of workers "{0}", bridges are not sharded'.format(params['workers'])
+                    LOGGER.error('Invalid number of MiLight workers: %s', params['workers'])
+                if workers > 0:
+                    LOGGER.info('Sharding MiLight bridges over %d worker processes', workers)
+                    self.workerPool = BridgeWorkerPool(workers)
                          
             if self.milight_host == "" :
                 self.poly.Notices['cfg'] = 'MiLight requires the "host" parameter to be specified.'
                 LOGGER.error('MiLight requires \'host\' parameters to be specified in custom configuration.')
                 return False
-            else:
+            elif self.configDone:
                 self.discover()
                            
         except Exception as ex:
             LOGGER.error('Error starting MiLight NodeServer: %s', str(ex))                     
+
+    def dataHandler(self, data):
+        self.Data.load(data)
+        if 'state' in self.Data:
+            self.zoneState.loadData(self.Data['state'])
+        if 'journal' in self.Data:
+            self.journal.loadData(self.Data['journal'])
+
+    def configDoneHandler(self):
+        # Nodes are only created once the saved data is loaded, so that they start from their last state
+        self.configDone = True
+        self.checkProfile()
+        if self.milight_host != "":
+            self.discover()
+
+    def checkProfile(self):
+        # The ISY reloads the node definitions at each upload, only send the profile when it changed since the last one
+        profile = get_profile_info(LOGGER)
+        if self.Data.get('profile') == profile:
+            LOGGER.info('Profile version %s unchanged, not sent', profile['version'])
+        else:
+            self.installProfile()
+
+    def installProfile(self, *args, **kwargs):
+        profile = get_profile_info(LOGGER)
+        LOGGER.info('Sending profile version %s', profile['version'])
+        self.poly.updateProfile()
+        self.poly.setCustomParamsDoc()
+        self.Data['profile'] = profile
+
+    def savedState(self, address):
+        bridge, zone = ZoneStateTable.key(address)
+        return self.zoneState.row(bridge, zone, True)
+
+    def saveState(self, address, driver, value):
+        bridge, zone = ZoneStateTable.key(address)
+        if self.zoneState.set(bridge, zone, driver, value):
+            self.stateChanged = True
+
+    def saveData(self):
+        if self.stateChanged:
+            self.stateChanged = False
+            self.Data['state'] = self.zoneState.toData()
+        if self.journal.changed:
+            self.journal.changed = False
+            self.Data['journal'] = self.journal.toData()
+
+    def journalIntents(self, host, address, zone, intents):
+        for action, value, drivers in intents:
+            self.journal.record(host, address, zone, action, value, drivers)
+
+    def reconcile(self, host, addresses=(), intents=()):
+        # Intents superseded by the command about to be sent are dropped, the others are sent in one batch
+        node = self.poly.getNode(self.bridges.get(host, ''))
+        with self.journal.hostLock(host):
+            for address in addresses:
+                for action, value, drivers in intents:
+                    self.journal.discard(host, address, action)
+            if node is None:
+                return self.journal.pending(host) == 0
+            pending = self.journal.take(host)
+        if not pending:
+            return True
+
+        # Sent without the lock: the intents are no longer in the journal, a slow bridge only delays this command
+        LOGGER.info('Reconciling MiLight bridge %s with %d commands', host, len(pending))
+        frames = [MilightWifiBridge.buildCommandFrame(intent.action, intent.zone, intent.value) for intent in pending]
+        with MilightTracer.begin('reconcile', host=host, frames=len(frames)):
+            results = node.myMilight.sendFrames(frames)
+        if results == False:
+            results = [None] * len(frames)
+
+        failed = []
+        for intent, result in zip(pending, results):
+            if result is None:
+                failed.append(intent)
+                continue
+            target = self.poly.getNode(intent.address)
+            if target is not None:
+                for driver, value in intent.drivers.items():
+                    target.setDriver(driver, value, True)
+        if failed:
+            LOGGER.warning('Unable to reconcile MiLight bridge %s, %d commands kept', host, len(failed))
+            self.journal.restore(host, failed)
+            self.getBreaker(host).failure()
+        return not failed
+
+    def driverGeneration(self, address, driver):
+        with self.generationLock:
+            return self.driverGenerations.get((address, driver), 0)
+
+    def nextGeneration(self, address, driver, expected=None):
+        # Bumped on every update of a driver (see MiLightCommandNode.setDriver()), a rollback only restores the
+        # drivers nothing updated since: it bumps the generation it expects, None if another update came first
+        with self.generationLock:
+            generation = self.driverGenerations.get((address, driver), 0)
+            if expected is not None and generation != expected:
+                return None
+            self.driverGenerations[(address, driver)] = generation + 1
+            return generation + 1
+
+    def sendOptimistic(self, node, zone, intents):
+        # Drivers are updated right away, the ACKs are checked by the ACK thread of the client
+        if not self.optimistic or not isinstance(node.myMilight, MilightSharedWifiBridge):
+            return False
+        frames = [MilightWifiBridge.buildCommandFrame(action, zone, value) for action, value, drivers in intents]
+        previous = dict((driver, node.getDriver(driver)) for action, value, drivers in intents for driver in drivers)
+        generations = {}
+        updated = threading.Event()
+        if not node.myMilight.sendFramesAsync(frames, lambda results: self.checkOptimistic(node, zone, intents, previous, generations, updated, results)):
+            return False
+        for action, value, drivers in intents:
+            for driver, driverValue in drivers.items():
+                node.setDriver(driver, driverValue, True)
+                generations[driver] = self.driverGeneration(node.address, driver)
+        updated.set()
+        return True
+
+    def checkOptimistic(self, node, zone, intents, previous, generations, updated, results):
+        # Called on the ACK thread of the client: the retry is left to a worker thread not to delay the next ACKs
+        failed = [intent for intent, result in zip(intents, results) if result is None]
+        if not failed:
+            self.getBreaker(node.milight_host).success()
+            return
+        threading.Thread(target=self.retryOptimistic, args=(node, zone, failed, previous, generations, updated),
+                         name='milight-retry-' + node.address, daemon=True).start()
+
+    def retryOptimistic(self, node, zone, failed, previous, generations, updated):
+        # Commands not acknowledged are retried once in a new session, the command counts as one breaker failure
+        breaker = self.getBreaker(node.milight_host)
+        updated.wait()
+        LOGGER.info('MiLight %s did not acknowledge %d commands, retrying', node.name, len(failed))
+        node.myMilight.setup(node.milight_host, node.milight_port, node.milight_timeout)
+        with MilightTracer.begin('retry', node=node.address, frames=len(failed)):
+            results = node.myMilight.sendFrames([MilightWifiBridge.buildCommandFrame(action, zone, value) for action, value, drivers in failed])
+        if results != False and None not in results:
+            breaker.success()
+            return
+        breaker.failure()
+
+        # Drivers are rolled back unless a later command updated them, the commands are sent when the bridge answers again
+        LOGGER.warning('Unable to update ' + node.name + ', rolling back (sent when the bridge answers again)')
+        for action, value, drivers in failed:
+            superseded = False
+            for driver in drivers:
+                if self.nextGeneration(node.address, driver, generations[driver]) is not None:
+                    node.setDriver(driver, previous[driver], True)
+                else:
+                    superseded = True
+            if not superseded:
+                self.journalIntents(node.milight_host, node.address, zone, [(action, value, drivers)])
+
+    def saveTrace(self):
+        tracer = MilightTracer.active()
+        if tracer is not None and self.tracePath is not None:
+            try:
+                tracer.save(self.tracePath)
+            except IOError as ex:
+                LOGGER.error('Unable to save MiLight trace %s: %s', self.tracePath, str(ex))
                          
     def start(self):
         LOGGER.info('Started MiLight for v3 NodeServer version %s', str(VERSION))
         self.setDriver('ST', 0)
+
+    def stop(self):
+        self.saveData()
+        self.saveTrace()
+        for breaker in self.breakers.values():
+            breaker.stop()
+        for client in self.bridgeClients.values():
+            client.setKeepAlive(0)
+            client.close()
+        if self.capture is not None:
+            self.capture.close()
+        if self.workerPool is not None:
+            self.workerPool.stop()
+            self.workerPool = None
     
     def poll(self, polltype):
         if 'shortPoll' in polltype:
             self.setDriver('ST', 1)
+            self.saveData()
+            self.saveTrace()
             for node in self.poly.nodes():
                 if  node.queryON == True :
                     node.query()
@@ -100,15 +438,160 @@ class Controller(udi_interface.Node):
             self.reportCmd("DOF",2)
             self.hb = 0
 
+    def getKelvinTable(self, host):
+        if host in self.kelvinTables:
+            return self.kelvinTables[host]
+        if '' not in self.kelvinTables:
+            self.kelvinTables[''] = MilightKelvinTable()
+        return self.kelvinTables['']
+
+    def checkIdentity(self, host, identity):
+        # MAC addresses are learnt from the handshakes of the commands, a new one means the bridge was replaced
+        if identity.mac == "":
+            return
+        macs = dict(self.Data.get('macs', {}))
+        if macs.get(host) == identity.mac:
+            return
+        if host in macs:
+            self.poly.Notices['mac_' + host] = 'MiLight bridge {0} was replaced (MAC address {1} instead of {2}), its lights may need to be linked again'.format(host, identity.mac, macs[host])
+            LOGGER.warning('MiLight bridge %s was replaced (MAC address %s instead of %s)', host, identity.mac, macs[host])
+        else:
+            LOGGER.info('MiLight bridge %s has MAC address %s', host, identity.mac)
+        macs[host] = identity.mac
+        self.Data['macs'] = macs
+
+    def steppedBrightness(self, address, direction):
+        # Relative commands are resolved against the last confirmed brightness, the ISY does not have to read it
+        bridge, zone = ZoneStateTable.key(address)
+        brightness = self.zoneState.get(bridge, zone, 'GV3', 100)
+        return min(max(brightness + direction * self.brightnessStep, 1), 100)
+
+    def getBreaker(self, host):
+        if host not in self.breakers:
+            self.breakers[host] = BridgeCircuitBreaker(host, self.milight_port, onRecover=self.reconcile)
+        return self.breakers[host]
+
+    def newClient(self, host):
+        if self.workerPool is not None:
+            return self.workerPool.client()
+        # The bridge node and its zones share one thread safe client (one socket and session per bridge)
+        if host not in self.bridgeClients:
+            self.bridgeStatistics[host] = MilightBridgeStatistics()
+            self.bridgeIdentities[host] = MilightBridgeIdentity()
+            self.bridgeClients[host] = MilightSharedWifiBridge(self.bridgeStatistics[host], self.bridgeIdentities[host])
+            self.bridgeClients[host].setCapture(self.capture)
+            self.bridgeClients[host].setKeepAlive(self.keepAlive)
+        return self.bridgeClients[host]
+
     def discover(self, *args, **kwargs):
-        count = 1
-        for myHost in self.milight_host.split(','):
-            self.poly.addNode(MiLightBridge(self.poly, 'bridge' + str(count), 'bridge' + str(count), 'Bridge' + str(count), myHost, self.milight_port))
-            self.poly.addNode(MiLightLight(self.poly, 'bridge' + str(count), 'bridge' + str(count) + '_zone1', 'Zone1', myHost, self.milight_port))
-            self.poly.addNode(MiLightLight(self.poly, 'bridge' + str(count), 'bridge' + str(count) + '_zone2', 'Zone2', myHost, self.milight_port))
-            self.poly.addNode(MiLightLight(self.poly, 'bridge' + str(count), 'bridge' + str(count) + '_zone3', 'Zone3', myHost, self.milight_port))
-            self.poly.addNode(MiLightLight(self.poly, 'bridge' + str(count), 'bridge' + str(count) + '_zone4', 'Zone4', myHost, self.milight_port))
-            count = count + 1
+        hosts = [myHost.strip() for myHost in self.milight_host.split(',') if myHost.strip() != '']
+        knownBridges = dict(self.bridges)
+        if not self.bridges and 'bridges' in self.Data:
+            # Node addresses of the bridges before the restart
+            knownBridges = dict(self.Data['bridges'])
+
+        # Bridges removed from the configuration
+        for myHost in [myHost for myHost in self.bridges if myHost not in hosts]:
+            address = self.bridges.pop(myHost)
+            self.bridgeStatistics.pop(myHost, None)
+            self.bridgeIdentities.pop(myHost, None)
+            if myHost in self.bridgeClients:
+                self.bridgeClients.pop(myHost).setKeepAlive(0)
+            if myHost in self.breakers:
+                self.breakers.pop(myHost).stop()
+            LOGGER.info('Removing MiLight bridge %s (%s)', myHost, address)
+            for nodeAddress in [address + '_zone' + str(zone) for zone in range(1, 5)] + [address]:
+                node = self.poly.getNode(nodeAddress)
+                if node is not None:
+                    node.myMilight.close()
+                self.poly.delNode(nodeAddress)
+            self.zoneState.removeBridge(address)
+            self.journal.removeBridge(myHost)
+            self.stateChanged = True
+
+        # Bridges already running only need to follow a port change, their sessions are kept otherwise
+        for myHost, address in self.bridges.items():
+            self.getBreaker(myHost).port = self.milight_port
+            for nodeAddress in [address] + [address + '_zone' + str(zone) for zone in range(1, 5)]:
+                node = self.poly.getNode(nodeAddress)
+                if node is not None and node.milight_port != self.milight_port:
+                    node.setBridgePort(self.milight_port)
+
+        # Bridges added to the configuration (keep their previous address, or the address of their list position when it is free)
+        reserved = set(knownBridges[myHost] for myHost in hosts if myHost in knownBridges and myHost not in self.bridges)
+        for count, myHost in enumerate(hosts, 1):
+            if myHost in self.bridges:
+                continue
+            used = set(self.bridges.values())
+            if myHost in knownBridges and knownBridges[myHost] not in used:
+                count = int(knownBridges[myHost][len('bridge'):])
+            elif 'bridge' + str(count) in used | reserved:
+                count = 1
+                while 'bridge' + str(count) in used | reserved:
+                    count = count + 1
+            address = 'bridge' + str(count)
+            self.bridges[myHost] = address
+            self.zoneState.addBridge(address)
+            LOGGER.info('Adding MiLight bridge %s (%s)', myHost, address)
+            self.poly.addNode(MiLightBridge(self.poly, address, address, 'Bridge' + str(count), myHost, self.milight_port, self.newClient(myHost)))
+            self.poly.addNode(MiLightLight(self.poly, address, address + '_zone1', 'Zone1', myHost, self.milight_port, self.newClient(myHost)))
+            self.poly.addNode(MiLightLight(self.poly, address, address + '_zone2', 'Zone2', myHost, self.milight_port, self.newClient(myHost)))
+            self.poly.addNode(MiLightLight(self.poly, address, address + '_zone3', 'Zone3', myHost, self.milight_port, self.newClient(myHost)))
+            self.poly.addNode(MiLightLight(self.poly, address, address + '_zone4', 'Zone4', myHost, self.milight_port, self.newClient(myHost)))
+
+        if self.Data.get('bridges') != self.bridges:
+            self.Data['bridges'] = dict(self.bridges)
+
+        self.discoverGroups()
+
+    def discoverGroups(self):
+        knownGroups = dict(self.groupAddresses)
+        if not self.groupAddresses and 'groups' in self.Data:
+            # Node addresses of the groups before the restart
+            knownGroups = dict(self.Data['groups'])
+
+        # Members on bridges which are not configured are ignored
+        groups = {}
+        for name, members in self.groups.items():
+            unknownHosts = sorted(set(host for host, zone in members if host not in self.bridges))
+            if unknownHosts:
+                self.poly.Notices['group_' + name] = 'Group "{0}" has members on unknown bridges: {1}'.format(name, ', '.join(unknownHosts))
+                LOGGER.error('Group %s has members on unknown bridges: %s', name, ', '.join(unknownHosts))
+            members = [(host, zone) for host, zone in members if host in self.bridges]
+            if members:
+                groups[name] = members
+
+        # Groups removed from the configuration
+        for name in [name for name in self.groupAddresses if name not in groups]:
+            address = self.groupAddresses.pop(name)
+            LOGGER.info('Removing MiLight group %s (%s)', name, address)
+            self.poly.delNode(address)
+
+        # Groups already running only need to follow a change of their members or of the port
+        for name, address in self.groupAddresses.items():
+            node = self.poly.getNode(address)
+            if node is not None:
+                node.setMembers(groups[name], self.milight_port)
+
+        # Groups added to the configuration (keep their previous address when it is free)
+        reserved = set(knownGroups[name] for name in groups if name in knownGroups and name not in self.groupAddresses)
+        for name in sorted(groups):
+            if name in self.groupAddresses:
+                continue
+            used = set(self.groupAddresses.values())
+            if name in knownGroups and knownGroups[name] not in used:
+                address = knownGroups[name]
+            else:
+                count = 1
+                while 'group' + str(count) in used | reserved:
+                    count = count + 1
+                address = 'group' + str(count)
+            self.groupAddresses[name] = address
+            LOGGER.info('Adding MiLight group %s (%s) with %d zones', name, address, len(groups[name]))
+            self.poly.addNode(MiLightGroup(self.poly, address, address, name, groups[name], self.milight_port))
+
+        if self.Data.get('groups') != self.groupAddresses:
+            self.Data['groups'] = dict(self.groupAddresses)
 
     def delete(self):
         LOGGER.info('Deleting MiLight')
@@ -116,23 +599,102 @@ class Controller(udi_interface.Node):
     id = 'controller'
     commands = {
         'QUERY': query,
-        'DISCOVER': discover
+        'DISCOVER': discover,
+        'INSTALL_PROFILE': installProfile
     }
     drivers = [{'driver': 'ST', 'value': 1, 'uom': 2}]
 
-class MiLightLight(udi_interface.Node):
+class MiLightCommandNode(object):
+    """ Command handling shared by the light, bridge and group nodes: tracing, circuit breaker, retry and journal """
+
+    # Drivers saved in the zone state of the controller
+    STATE_DRIVERS = ()
+
+    def runCmd(self, command):
+        # The whole command (requests, reconnection and drivers update) is one span of the trace
+        with MilightTracer.begin(str(command.get('cmd')), node=self.address, value=command.get('value')):
+            super(MiLightCommandNode, self).runCmd(command)
 
-    COLOR_VALUE = [0x85,0xBA,0x7A,0xD9,0x54,0x1E,0xFF,0x3B]
-    WHITE_TEMP = [0,8,35,61,100]
+    def setDriver(self, driver, value, *args, **kwargs):
+        with MilightTracer.begin('setDriver', driver=driver, value=value):
+            changed = super(MiLightCommandNode, self).setDriver(driver, value, *args, **kwargs)
+            controller = self.poly.getNode('controller')
+            controller.nextGeneration(self.address, driver)
+            if driver in self.STATE_DRIVERS:
+                controller.saveState(self.address, driver, value)
+        return changed
+
+    def sendFrames(self, client, frames):
+        results = client.sendFrames(frames)
+        return results != False and None not in results
+
+    def prepareBridge(self, description, host, addresses, intents, journal):
+        # Intents are (action, value, drivers): given to journal() when they can't reach the bridge
+        controller = self.poly.getNode('controller')
+        if not controller.getBreaker(host).allow():
+            LOGGER.warning('Unable to ' + description + ' ' + self.name + ', bridge ' + host + ' is unreachable (sent when it is back)')
+            journal(intents)
+            return False
+        controller.reconcile(host, addresses, intents)
+        return True
+
+    def requestBridge(self, description, host, intents, request, reconnect, journal):
+        # A command counts as one failure of the breaker, whatever the number of tries
+        breaker = self.poly.getNode('controller').getBreaker(host)
+        span = MilightTracer.begin('request', request=description, host=host)
+        if request() == False:
+            span.end(success=False)
+            reconnect()
+            span = MilightTracer.begin('retry', request=description, host=host)
+            if request() == False:
+                span.end(success=False)
+                breaker.failure()
+                LOGGER.warning('Unable to ' + description + ' ' + self.name + ' on bridge ' + host + ' (sent when it answers again)')
+                journal(intents)
+                return False
+        span.end(success=True)
+        breaker.success()
+        return True
+
+    # Bridge of the zone and bridge nodes (the group nodes have one client per bridge)
+    def setBridgePort(self, bridge_port):
+        self.milight_port = bridge_port
+        self.connectBridge()
+
+    def connectBridge(self):
+        with MilightTracer.begin('setup', host=self.milight_host):
+            if ( self.myMilight.setup(self.milight_host,self.milight_port,self.milight_timeout) == False ):
+                LOGGER.error('Unable to setup MiLight')
+
+    def sendCommand(self, description, intents, request, *args):
+        # Command of the zone (grpNum) of one bridge, the drivers are updated once the bridge acknowledged it
+        controller = self.poly.getNode('controller')
+        journal = lambda intents: controller.journalIntents(self.milight_host, self.address, self.grpNum, intents)
+        if not self.prepareBridge(description, self.milight_host, [self.address], intents, journal):
+            return False
+        if controller.sendOptimistic(self, self.grpNum, intents):
+            return True
+        if not self.requestBridge(description, self.milight_host, intents, lambda: request(*args), self.connectBridge, journal):
+            return False
+        for action, value, drivers in intents:
+            for driver, driverValue in drivers.items():
+                self.setDriver(driver, driverValue, True)
+        return True
+
+class MiLightLight(MiLightCommandNode, udi_interface.Node):
+
+    COLOR_VALUE = COLOR_VALUE
+    WHITE_TEMP = WHITE_TEMP
+    STATE_DRIVERS = ['ST', 'GV1', 'GV2', 'GV3', 'GV4', 'GV5', 'CLITEMP']
     
-    def __init__(self, controller, primary, address, name, bridge_host, bridge_port):
+    def __init__(self, controller, primary, address, name, bridge_host, bridge_port, client=None):
 
         super(MiLightLight, self).__init__(controller, primary, address, name)
         self.queryON = True
-        self.milight_timeout = 30.0
+        self.milight_timeout = BRIDGE_TIMEOUT
         self.milight_host = bridge_host
         self.milight_port = bridge_port
-        self.myMilight = MilightWifiBridge()
+        self.myMilight = client if client is not None else MilightWifiBridge()
         self.parent = controller.getNode(primary)
 
         # Set Zone
@@ -144,129 +706,99 @@ class MiLightLight(udi_interface.Node):
             self.grpNum = 3
         elif name == 'Zone4':
             self.grpNum = 4
-            
+
+        # Last confirmed state (no request is sent to the bridge), given to PG3 with the node instead of reported
+        # driver by driver, and not saved again
+        state = self.poly.getNode('controller').savedState(self.address)
+        for item in self.drivers:
+            item['value'] = state.get(item['driver'], item['value'])
+        
         controller.subscribe(controller.START, self.start, address)
 
     def start(self):
-        self.__ConnectWifiBridge()
-        self.setDriver('ST', 0, True)
-        self.setDriver('GV1', 0, True)
-        self.setDriver('GV2', 0, True)
-        self.setDriver('GV3', 100, True)
-        self.setDriver('GV4', 1, True)
-        self.setDriver('GV5', 0, True)
+        self.connectBridge()
 
     def setOn(self, command):
-        if ( self.myMilight.turnOn(self.grpNum) == False ):
-            self.__ConnectWifiBridge()
-            if ( self.myMilight.turnOn(self.grpNum) == False ):
-                LOGGER.warning('Unable to Turn ON ' + self.name )
-            else:
-                self.setDriver('ST', 100,True)
-        else:
-            self.setDriver('ST', 100,True)
+        self.sendCommand('Turn ON', [('turnOn', None, {'ST': 100})], self.myMilight.turnOn, self.grpNum)
 
     def setOff(self, command):
-        if (self.myMilight.turnOff(self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.turnOff(self.grpNum) == False):
-                LOGGER.warning('Unable to Turn OFF ' + self.name )
-            else:
-                self.setDriver('ST', 0,True)
-        else:
-            self.setDriver('ST', 0,True)
+        self.sendCommand('Turn OFF', [('turnOff', None, {'ST': 0})], self.myMilight.turnOff, self.grpNum)
 
     def setColorID(self, command):
         intColor = int(command.get('value'))
-        if (self.myMilight.setColor(intColor,self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setColor(intColor,self.grpNum) == False):
-                LOGGER.warning('Unable to SetColor ' + self.name )
-            else:
-                self.setDriver('GV1', intColor,True)
-        else:
-            self.setDriver('GV1', intColor,True)
+        self.sendCommand('SetColor', [('setColor', intColor, {'GV1': intColor})], self.myMilight.setColor, intColor, self.grpNum)
 
     def setColor(self, command):
         intColor = self.COLOR_VALUE[int(command.get('value'))-1]
-        if (self.myMilight.setColor(intColor,self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setColor(intColor,self.grpNum) == False):
-                LOGGER.warning('Unable to SetColor ' + self.name )
-            else:
-                self.setDriver('GV1', intColor,True)
-        else:
-            self.setDriver('GV1', intColor,True)
+        self.sendCommand('SetColor', [('setColor', intColor, {'GV1': intColor})], self.myMilight.setColor, intColor, self.grpNum)
+
+    def setRGB(self, command):
+        query = command.get('query')
+        color = MilightColorConverter.rgbToMilight(int(query.get('R.uom100')), int(query.get('G.uom100')), int(query.get('B.uom100')))
+        self.__setMilightColor('setRGB', color)
+
+    def setHSV(self, command):
+        query = command.get('query')
+        color = MilightColorConverter.hsvToMilight(int(query.get('H.uom14')), int(query.get('S.uom51')), int(query.get('V.uom51')))
+        self.__setMilightColor('setHSV', color)
+
+    def __setMilightColor(self, description, color):
+        self.sendCommand(description, [('setColor', color.color, {'GV1': color.color}),
+                                       ('setSaturation', color.saturation, {'GV2': color.saturation}),
+                                       ('setBrightness', color.brightness, {'GV3': color.brightness})],
+                         self.sendFrames, self.myMilight, MilightColorConverter.buildFrames(color, self.grpNum))
 
     def setSaturation(self, command):
         intSat = int(command.get('value'))
-        if (self.myMilight.setSaturation(intSat,self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setSaturation(intSat,self.grpNum) == False):
-                LOGGER.warning('Unable to setSaturation ' + self.name )
-            else:
-                self.setDriver('GV2', intSat,True)
-        else:
-            self.setDriver('GV2', intSat,True)
+        self.sendCommand('setSaturation', [('setSaturation', intSat, {'GV2': intSat})], self.myMilight.setSaturation, intSat, self.grpNum)
 
     def setBrightness(self, command):
         intBri = int(command.get('value'))
-        if (self.myMilight.setBrightness(intBri,self.grpNum)  == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setBrightness(intBri,self.grpNum)  == False):
-                LOGGER.warning('Unable to setBrightness ' + self.name )
-            else:
-                self.setDriver('GV3', intBri,True)
-        else:
-            self.setDriver('GV3', intBri,True)
+        self.sendCommand('setBrightness', [('setBrightness', intBri, {'GV3': intBri})], self.myMilight.setBrightness, intBri, self.grpNum)
+
+    def brighten(self, command):
+        intBri = self.poly.getNode('controller').steppedBrightness(self.address, 1)
+        self.sendCommand('brighten', [('setBrightness', intBri, {'GV3': intBri})], self.myMilight.setBrightness, intBri, self.grpNum)
+
+    def dim(self, command):
+        intBri = self.poly.getNode('controller').steppedBrightness(self.address, -1)
+        self.sendCommand('dim', [('setBrightness', intBri, {'GV3': intBri})], self.myMilight.setBrightness, intBri, self.grpNum)
 
     def setTempColor(self, command):
         intTemp = self.WHITE_TEMP[int(command.get('value'))-1]
-        if (self.myMilight.setTemperature(intTemp,self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setTemperature(intTemp,self.grpNum) == False):
-                LOGGER.warning('Unable to setTemperature ' + self.name )
-            else:
-                self.setDriver('GV5', intTemp,True)
-        else:
-            self.setDriver('GV5', intTemp,True)
+        intKelvin = WHITE_KELVIN[int(command.get('value'))-1]
+        self.sendCommand('setTemperature', [('setTemperature', intTemp, {'GV5': intTemp, 'CLITEMP': intKelvin})],
+                         self.myMilight.setTemperature, intTemp, self.grpNum)
+
+    def setKelvin(self, command):
+        kelvinTable = self.poly.getNode('controller').getKelvinTable(self.milight_host)
+        intKelvin = kelvinTable.clamp(int(command.get('value')))
+        intTemp = kelvinTable.toTemperature(intKelvin)
+        self.sendCommand('setTemperature', [('setTemperature', intTemp, {'GV5': intTemp, 'CLITEMP': intKelvin})],
+                         self.myMilight.setTemperature, intTemp, self.grpNum)
 
     def setEffect(self, command):
         intEffect = int(command.get('value'))
-        if (self.myMilight.setDiscoMode(intEffect,self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setDiscoMode(intEffect,self.grpNum) == False):
-                LOGGER.warning('Unable to setDiscoMode ' + self.name )
-            else:
-                self.setDriver('GV4', intEffect,True)
-        else:
-            self.setDriver('GV4', intEffect,True)
+        self.sendCommand('setDiscoMode', [('setDiscoMode', intEffect, {'GV4': intEffect})], self.myMilight.setDiscoMode, intEffect, self.grpNum)
 
     def setWhiteMode(self, command):
-        if (self.myMilight.setWhiteMode(self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setWhiteMode(self.grpNum) == False):
-                LOGGER.warning('Unable to setWhiteMode ' + self.name )
+        self.sendCommand('setWhiteMode', [('setWhiteMode', None, {})], self.myMilight.setWhiteMode, self.grpNum)
 
     def setNightMode(self, command):
-        if (self.myMilight.setNightMode(self.grpNum) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setNightMode(self.grpNum) == False):
-                LOGGER.warning('Unable to setNightMode ' + self.name )
-
-    def __ConnectWifiBridge(self):
-        if ( self.myMilight.setup(self.milight_host,self.milight_port,self.milight_timeout) == False ):
-            LOGGER.error('Unable to setup MiLight')
-        
+        self.sendCommand('setNightMode', [('setNightMode', None, {})], self.myMilight.setNightMode, self.grpNum)
+
     def query(self):
-        self.__ConnectWifiBridge()
+        # No need to reconnect to an unreachable bridge, its breaker probes it in background
+        if self.poly.getNode('controller').getBreaker(self.milight_host).allow():
+            self.connectBridge()
 
     drivers = [{'driver': 'ST', 'value': 0, 'uom': 78},
                {'driver': 'GV1', 'value': 0, 'uom': 100},
                {'driver': 'GV2', 'value': 0, 'uom': 51},
                {'driver': 'GV3', 'value': 0, 'uom': 51},
-               {'driver': 'GV5', 'value': 1, 'uom': 25},
-               {'driver': 'GV4', 'value': 1, 'uom': 25}]
+               {'driver': 'GV5', 'value': 0, 'uom': 51},
+               {'driver': 'GV4', 'value': 1, 'uom': 25},
+               {'driver': 'CLITEMP', 'value': 2700, 'uom': 26}]
 
     id = 'MILIGHT_LIGHT'
     commands = {
@@ -274,138 +806,332 @@ class MiLightLight(udi_interface.Node):
                     'DOF': setOff,
                     "SET_COLOR_ID": setColorID,
                     "SET_COLOR": setColor,
+                    "SET_RGB": setRGB,
+                    "SET_HSV": setHSV,
                     "SET_SAT": setSaturation,
                     "SET_BRI": setBrightness,
+                    "BRT": brighten,
+                    "DIM": dim,
                     "CLITEMP": setTempColor,
+                    "SET_KELVIN": setKelvin,
                     "SET_EFFECT": setEffect,
                     "WHITE_MODE": setWhiteMode,
                     "NIGHT_MODE": setNightMode
                 }
 
-class MiLightBridge(udi_interface.Node):
+class MiLightBridge(MiLightCommandNode, udi_interface.Node):
 
-    COLOR_VALUE = [0x85,0xBA,0x7A,0xD9,0x54,0x1E,0xFF,0x3B]
-    WHITE_TEMP = [0,8,35,61,100]
+    COLOR_VALUE = COLOR_VALUE
+    WHITE_TEMP = WHITE_TEMP
+    STATE_DRIVERS = ['ST', 'GV1', 'GV3', 'GV4']
     
-    def __init__(self, controller, primary, address, name, bridge_host, bridge_port):
+    def __init__(self, controller, primary, address, name, bridge_host, bridge_port, client=None):
 
         super(MiLightBridge, self).__init__(controller, primary, address, name)
         self.queryON = True
-        self.milight_timeout = 30.0
+        self.milight_timeout = BRIDGE_TIMEOUT
         self.milight_host = bridge_host
         self.milight_port = bridge_port
-        self.myMilight = MilightWifiBridge()
+        self.myMilight = client if client is not None else MilightWifiBridge()
         self.parent = controller.getNode(primary)
+        # The wifi bridge lamp has no zone (0 in the journal)
+        self.grpNum = 0
+
+        # Last confirmed state (no request is sent to the bridge), given to PG3 with the node instead of reported
+        # driver by driver, and not saved again
+        state = self.poly.getNode('controller').savedState(self.address)
+        for item in self.drivers:
+            item['value'] = state.get(item['driver'], item['value'])
         
         controller.subscribe(controller.START, self.start, address)
 
     def start(self):
-        self.__ConnectWifiBridge()
-
-        # Init Value
-        self.setDriver('ST', 0, True)
-        self.setDriver('GV1', 0, True)
-        self.setDriver('GV3', 100, True)
-        self.setDriver('GV4', 1, True)
+        self.connectBridge()
 
     def setOn(self, command):
-        if ( self.myMilight.turnOnWifiBridgeLamp() == False ):
-            self.__ConnectWifiBridge()
-            if ( self.myMilight.turnOnWifiBridgeLamp() == False ):
-                LOGGER.warning('Unable to Turn ON Bridge Light')
-            else:
-                self.setDriver('ST', 100,True)
-        else:
-            self.setDriver('ST', 100,True)
+        self.sendCommand('Turn ON Bridge Light', [('turnOnWifiBridgeLamp', None, {'ST': 100})], self.myMilight.turnOnWifiBridgeLamp)
 
     def setOff(self, command):
-        if(self.myMilight.turnOffWifiBridgeLamp() == False):
-            self.__ConnectWifiBridge()
-            if(self.myMilight.turnOffWifiBridgeLamp() == False):
-                LOGGER.warning('Unable to Turn OFF Bridge Light')
-            else:
-                self.setDriver('ST', 0, True)
-        else:
-            self.setDriver('ST', 0, True)
+        self.sendCommand('Turn OFF Bridge Light', [('turnOffWifiBridgeLamp', None, {'ST': 0})], self.myMilight.turnOffWifiBridgeLamp)
 
     def setColorID(self, command):
         intColor = int(command.get('value'))
-        if (self.myMilight.setColorBridgeLamp(intColor) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setColorBridgeLamp(intColor) == False):
-                LOGGER.warning('Unable to setColorBridgeLamp')
-            else:
-                self.setDriver('GV1', intColor,True)
-        else:
-            self.setDriver('GV1', intColor,True)
+        self.sendCommand('setColorBridgeLamp', [('setColorBridgeLamp', intColor, {'GV1': intColor})], self.myMilight.setColorBridgeLamp, intColor)
 
     def setColor(self, command):
         intColor = self.COLOR_VALUE[int(command.get('value'))-1]
-        if (self.myMilight.setColorBridgeLamp(intColor) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setColorBridgeLamp(intColor) == False):
-                LOGGER.warning('Unable to SetColor ' + self.name )
-            else:
-                self.setDriver('GV1', intColor,True)
-        else:
-            self.setDriver('GV1', intColor,True)
+        self.sendCommand('SetColor ' + self.name, [('setColorBridgeLamp', intColor, {'GV1': intColor})], self.myMilight.setColorBridgeLamp, intColor)
 
     def setBrightness(self, command):
         intBri = int(command.get('value'))
-        if (self.myMilight.setBrightnessBridgeLamp(intBri) == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setBrightnessBridgeLamp(intBri) == False):
-                LOGGER.warning('Unable to setBrightnessBridgeLamp')
-            else:
-                self.setDriver('GV3', intBri,True)
-        else:
-            self.setDriver('GV3', intBri,True)
+        self.sendCommand('setBrightnessBridgeLamp', [('setBrightnessBridgeLamp', intBri, {'GV3': intBri})], self.myMilight.setBrightnessBridgeLamp, intBri)
+
+    def brighten(self, command):
+        intBri = self.poly.getNode('controller').steppedBrightness(self.address, 1)
+        self.sendCommand('brightenBridgeLamp', [('setBrightnessBridgeLamp', intBri, {'GV3': intBri})], self.myMilight.setBrightnessBridgeLamp, intBri)
+
+    def dim(self, command):
+        intBri = self.poly.getNode('controller').steppedBrightness(self.address, -1)
+        self.sendCommand('dimBridgeLamp', [('setBrightnessBridgeLamp', intBri, {'GV3': intBri})], self.myMilight.setBrightnessBridgeLamp, intBri)
+
+    def setRGB(self, command):
+        query = command.get('query')
+        color = MilightColorConverter.rgbToMilight(int(query.get('R.uom100')), int(query.get('G.uom100')), int(query.get('B.uom100')))
+        self.__setMilightColor('setRGBBridgeLamp', color)
+
+    def setHSV(self, command):
+        query = command.get('query')
+        color = MilightColorConverter.hsvToMilight(int(query.get('H.uom14')), int(query.get('S.uom51')), int(query.get('V.uom51')))
+        self.__setMilightColor('setHSVBridgeLamp', color)
+
+    def __setMilightColor(self, description, color):
+        # The bridge lamp has no saturation
+        self.sendCommand(description, [('setColorBridgeLamp', color.color, {'GV1': color.color}),
+                                       ('setBrightnessBridgeLamp', color.brightness, {'GV3': color.brightness})],
+                         self.sendFrames, self.myMilight, MilightColorConverter.buildBridgeLampFrames(color))
 
     def setEffect(self, command):
         intEffect = int(command.get('value'))
-        if(self.myMilight.setDiscoModeBridgeLamp(intEffect) == False):
-            self.__ConnectWifiBridge()
-            if(self.myMilight.setDiscoModeBridgeLamp(intEffect) == False):
-                LOGGER.warning('Unable to setDiscoModeBridgeLamp')
-            else:
-                self.setDriver('GV4', intEffect,True)
-        else:
-            self.setDriver('GV4', intEffect,True)
+        self.sendCommand('setDiscoModeBridgeLamp', [('setDiscoModeBridgeLamp', intEffect, {'GV4': intEffect})], self.myMilight.setDiscoModeBridgeLamp, intEffect)
 
     def setWhiteMode(self, command):
-        if (self.myMilight.setWhiteModeBridgeLamp() == False):
-            self.__ConnectWifiBridge()
-            if (self.myMilight.setWhiteModeBridgeLamp() == False):
-                LOGGER.warning('Unable to setWhiteModeBridgeLamp')
-
-    def __ConnectWifiBridge(self):
-        if ( self.myMilight.setup(self.milight_host,self.milight_port,self.milight_timeout) == False ):
-            LOGGER.error('Unable to setup MiLight')
+        self.sendCommand('setWhiteModeBridgeLamp', [('setWhiteModeBridgeLamp', None, {})], self.myMilight.setWhiteModeBridgeLamp)
 
     def query(self):
-        self.__ConnectWifiBridge()
+        # No need to reconnect to an unreachable bridge, its breaker probes it in background
+        if self.poly.getNode('controller').getBreaker(self.milight_host).allow():
+            self.connectBridge()
+        self.updateHealth()
+
+    def updateHealth(self):
+        identity = self.myMilight.getIdentity()
+        if identity:
+            self.poly.getNode('controller').checkIdentity(self.milight_host, identity)
+        statistics = self.myMilight.getStatistics()
+        if not statistics:
+            return
+        self.setDriver('GV10', 0 if statistics.averageRtt is None else int(round(statistics.averageRtt * 1000)))
+        self.setDriver('GV11', int(round(statistics.lossPercent)))
+        self.setDriver('GV12', statistics.timeouts)
+        self.setDriver('GV13', statistics.handshakeFailures)
 
     drivers = [{'driver': 'ST', 'value': 0, 'uom': 78},
                {'driver': 'GV1', 'value': 0, 'uom': 100},
                {'driver': 'GV3', 'value': 0, 'uom': 51},
-               {'driver': 'GV4', 'value': 1, 'uom': 25}]
+               {'driver': 'GV4', 'value': 1, 'uom': 25},
+               {'driver': 'GV10', 'value': 0, 'uom': 42},
+               {'driver': 'GV11', 'value': 0, 'uom': 51},
+               {'driver': 'GV12', 'value': 0, 'uom': 56},
+               {'driver': 'GV13', 'value': 0, 'uom': 56}]
     id = 'MILIGHT_BRIDGE'
     commands = {
                     'DON': setOn,
                     'DOF': setOff,
                     "SET_COLOR": setColor,
                     "SET_COLOR_ID": setColorID,
+                    "SET_RGB": setRGB,
+                    "SET_HSV": setHSV,
                     "SET_BRI": setBrightness,
+                    "BRT": brighten,
+                    "DIM": dim,
                     "SET_EFFECT": setEffect,
                     "WHITE_MODE": setWhiteMode
                 }
 
+class MiLightGroup(MiLightCommandNode, udi_interface.Node):
+    """ Zones of any bridges driven as one light, each command is sent to all the bridges in parallel """
+
+    COLOR_VALUE = COLOR_VALUE
+    WHITE_TEMP = WHITE_TEMP
+
+    def __init__(self, controller, primary, address, name, members, bridge_port):
+
+        super(MiLightGroup, self).__init__(controller, primary, address, name)
+        self.queryON = True
+        self.milight_timeout = BRIDGE_TIMEOUT
+        self.milight_port = bridge_port
+        self.plan = GroupPlan(members)
+        self.clients = {}
+        self.parent = controller.getNode(primary)
+
+        controller.subscribe(controller.START, self.start, address)
+
+    def start(self):
+        for host in self.plan.hosts():
+            self.__ConnectWifiBridge(host)
+        self.updateState(True)
+
+    def setMembers(self, members, bridge_port):
+        plan = GroupPlan(members)
+        portChanged = bridge_port != self.milight_port
+        self.milight_port = bridge_port
+        for host in plan.hosts():
+            if portChanged or host not in self.clients:
+                self.__ConnectWifiBridge(host)
+        for host in [host for host in self.clients if host not in plan.targets]:
+            self.clients.pop(host)
+        self.plan = plan
+        self.updateState()
+
+    def setOn(self, command):
+        self.__sendCommand('Turn ON', [('turnOn', None)], {'ST': 100})
+
+    def setOff(self, command):
+        self.__sendCommand('Turn OFF', [('turnOff', None)], {'ST': 0})
+
+    def setColorID(self, command):
+        intColor = int(command.get('value'))
+        self.__sendCommand('SetColor', [('setColor', intColor)], {'GV1': intColor})
+
+    def setColor(self, command):
+        intColor = self.COLOR_VALUE[int(command.get('value'))-1]
+        self.__sendCommand('SetColor', [('setColor', intColor)], {'GV1': intColor})
+
+    def setRGB(self, command):
+        query = command.get('query')
+        color = MilightColorConverter.rgbToMilight(int(query.get('R.uom100')), int(query.get('G.uom100')), int(query.get('B.uom100')))
+        self.__setMilightColor('setRGB', color)
+
+    def setHSV(self, command):
+        query = command.get('query')
+        color = MilightColorConverter.hsvToMilight(int(query.get('H.uom14')), int(query.get('S.uom51')), int(query.get('V.uom51')))
+        self.__setMilightColor('setHSV', color)
+
+    def __setMilightColor(self, description, color):
+        self.__sendCommand(description, [('setColor', color.color), ('setSaturation', color.saturation), ('setBrightness', color.brightness)],
+                           {'GV1': color.color, 'GV2': color.saturation, 'GV3': color.brightness})
+
+    def setSaturation(self, command):
+        intSat = int(command.get('value'))
+        self.__sendCommand('setSaturation', [('setSaturation', intSat)], {'GV2': intSat})
+
+    def setBrightness(self, command):
+        intBri = int(command.get('value'))
+        self.__sendCommand('setBrightness', [('setBrightness', intBri)], {'GV3': intBri})
+
+    def setTempColor(self, command):
+        intTemp = self.WHITE_TEMP[int(command.get('value'))-1]
+        self.__sendCommand('setTemperature', [('setTemperature', intTemp)],
+                           {'GV5': intTemp, 'CLITEMP': WHITE_KELVIN[int(command.get('value'))-1]})
+
+    def setKelvin(self, command):
+        # Each bridge may have its own Kelvin calibration
+        controller = self.poly.getNode('controller')
+        commands = {}
+        for host in self.plan.hosts():
+            kelvinTable = controller.getKelvinTable(host)
+            intKelvin = kelvinTable.clamp(int(command.get('value')))
+            intTemp = kelvinTable.toTemperature(intKelvin)
+            commands[host] = ([('setTemperature', intTemp)], {'GV5': intTemp, 'CLITEMP': intKelvin})
+        self.__fanOut('setTemperature', commands)
+
+    def setEffect(self, command):
+        intEffect = int(command.get('value'))
+        self.__sendCommand('setDiscoMode', [('setDiscoMode', intEffect)], {'GV4': intEffect})
+
+    def setWhiteMode(self, command):
+        self.__sendCommand('setWhiteMode', [('setWhiteMode', None)], {})
+
+    def setNightMode(self, command):
+        self.__sendCommand('setNightMode', [('setNightMode', None)], {})
+
+    def __sendCommand(self, description, actions, drivers):
+        return self.__fanOut(description, dict((host, (actions, drivers)) for host in self.plan.hosts()))
+
+    def __fanOut(self, description, commands):
+        """ Send {host: (actions, drivers of the members)} to all the bridges in parallel, return True if all succeeded """
+        results = {}
+        threads = [threading.Thread(target=self.__sendToBridge, args=(description, host, commands[host][0], commands[host][1], results),
+                                    name='milight-group-' + host) for host in commands]
+        if len(threads) == 1:
+            threads[0].run()
+        else:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Members of the bridges which acknowledged the command take its state, the group state follows them
+        for host, (actions, drivers) in commands.items():
+            if not results.get(host):
+                continue
+            for address in self.__memberAddresses(host):
+                node = self.poly.getNode(address)
+                if node is not None:
+                    for driver, value in drivers.items():
+                        node.setDriver(driver, value, True)
+        self.updateState()
+        return all(results.get(host) for host in commands)
+
+    def __sendToBridge(self, description, host, actions, drivers, results):
+        intents = [(action, value, drivers) for action, value in actions]
+        journal = lambda intents: self.__journalIntents(host, intents)
+        if not self.prepareBridge(description, host, self.__memberAddresses(host), intents, journal):
+            results[host] = False
+            return
+        frames = self.plan.frames(host, actions)
+        results[host] = self.requestBridge(description, host, intents, lambda: self.sendFrames(self.clients[host], frames),
+                                           lambda: self.__ConnectWifiBridge(host), journal)
+
+    def __memberAddresses(self, host):
+        bridges = self.poly.getNode('controller').bridges
+        if host not in bridges:
+            return []
+        return [bridges[host] + '_zone' + str(zone) for zone in sorted(self.plan.zones[host])]
+
+    def __journalIntents(self, host, intents):
+        # The intents are kept for each member zone, they are reconciled with the commands of the zone nodes
+        controller = self.poly.getNode('controller')
+        for address in self.__memberAddresses(host):
+            controller.journalIntents(host, address, ZoneStateTable.key(address)[1], intents)
+
+    def __ConnectWifiBridge(self, host):
+        if host not in self.clients:
+            self.clients[host] = self.poly.getNode('controller').newClient(host)
+        with MilightTracer.begin('setup', host=host):
+            if ( self.clients[host].setup(host,self.milight_port,self.milight_timeout) == False ):
+                LOGGER.error('Unable to setup MiLight')
+
+    def updateState(self, force=False):
+        controller = self.poly.getNode('controller')
+        rows = [controller.zoneState.row(controller.bridges[host], zone, True)
+                for host, zone in self.plan.members if host in controller.bridges]
+        for driver, value in deriveState(rows).items():
+            self.setDriver(driver, value, True, force)
+
+    def query(self):
+        # Members may have been changed by their own nodes
+        self.updateState()
+
+    drivers = [{'driver': 'ST', 'value': 0, 'uom': 78},
+               {'driver': 'GV1', 'value': 0, 'uom': 100},
+               {'driver': 'GV2', 'value': 0, 'uom': 51},
+               {'driver': 'GV3', 'value': 0, 'uom': 51},
+               {'driver': 'GV5', 'value': 0, 'uom': 51},
+               {'driver': 'GV4', 'value': 1, 'uom': 25},
+               {'driver': 'CLITEMP', 'value': 2700, 'uom': 26}]
+
+    id = 'MILIGHT_GROUP'
+    commands = {
+                    'DON': setOn,
+                    'DOF': setOff,
+                    "SET_COLOR_ID": setColorID,
+                    "SET_COLOR": setColor,
+                    "SET_RGB": setRGB,
+                    "SET_HSV": setHSV,
+                    "SET_SAT": setSaturation,
+                    "SET_BRI": setBrightness,
+                    "CLITEMP": setTempColor,
+                    "SET_KELVIN": setKelvin,
+                    "SET_EFFECT": setEffect,
+                    "WHITE_MODE": setWhiteMode,
+                    "NIGHT_MODE": setNightMode
+                }
+
 if __name__ == "__main__":
     try:
         polyglot = udi_interface.Interface([])
         polyglot.start()
-        polyglot.updateProfile()
-        polyglot.setCustomParamsDoc()
         Controller(polyglot, 'controller', 'controller', 'MiLightNodeServer')
         polyglot.runForever()
     except (KeyboardInterrupt, SystemExit):
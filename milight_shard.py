@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+Process-per-bridge sharding for the MiLight NodeServer.
+
+Bridges are spread over worker processes (by host) so that the blocking UDP I/O of large installs is not
+limited by a single interpreter. Each worker owns the MilightWifiBridge clients of its bridges and runs one
+thread per bridge; the NodeServer talks to them through ShardedMilightClient, which exposes the same
+methods as MilightWifiBridge. A crashed worker is restarted and only fails the pending commands of its bridges.
+"""
+
+import logging
+import multiprocessing
+import queue
+import threading
+import zlib
+from itertools import count
+
+from MilightWifiBridge import MilightWifiBridge
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _bridge_loop(requests, conn, send_lock, client):
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        request_id, method, args, kwargs = request
+        try:
+            result = getattr(client, method)(*args, **kwargs)
+        except Exception as ex:
+            LOGGER.error('Worker call {0} failed: {1}'.format(method, ex))
+            result = False
+        with send_lock:
+            conn.send((request_id, result))
+
+
+def _worker_main(conn):
+    """ Worker process: dispatch the requests to one thread per bridge """
+    send_lock = threading.Lock()
+    bridges = {}
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        request_id, host, port, setup, method, args, kwargs = message
+        key = (host, port)
+        if key not in bridges:
+            # Clients are (re)created lazily so that a restarted worker recovers its bridges by itself, with the
+            # last setup of the NodeServer (unless the request is the setup itself)
+            client = MilightWifiBridge()
+            if method != 'setup':
+                client.setup(*setup[0], **setup[1])
+            requests = queue.Queue()
+            threading.Thread(target=_bridge_loop, args=(requests, conn, send_lock, client), daemon=True).start()
+            bridges[key] = requests
+        bridges[key].put((request_id, method, args, kwargs))
+
+    for requests in bridges.values():
+        requests.put(None)
+
+
+class _Worker(object):
+
+    def __init__(self, index, context):
+        self.index = index
+        self.context = context
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.conn = None
+        self.process = None
+        self.start()
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, args=(child_conn,),
+                                            name='milight-worker-' + str(self.index), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        threading.Thread(target=self.receive, args=(parent_conn, self.process), daemon=True).start()
+        LOGGER.info('MiLight worker {0} started (pid {1})'.format(self.index, self.process.pid))
+
+    def receive(self, conn, process):
+        while True:
+            try:
+                request_id, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                waiter = self.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter[1] = result
+                waiter[0].set()
+
+        # Worker exited: fail its pending commands and restart it (unless the pool is stopping)
+        with self.lock:
+            if self.process is not process:
+                return
+            pending, self.pending = self.pending, {}
+            for waiter in pending.values():
+                waiter[0].set()
+            if self.conn is not None:
+                process.join(1)
+                LOGGER.error('MiLight worker {0} exited (code {1}), restarting it'.format(self.index, process.exitcode))
+                self.start()
+
+    def call(self, request_id, message, wait_sec):
+        waiter = [threading.Event(), False]
+        with self.lock:
+            if self.conn is None:
+                return False
+            self.pending[request_id] = waiter
+            try:
+                self.conn.send(message)
+            except (OSError, ValueError) as ex:
+                LOGGER.error('Unable to reach MiLight worker {0}: {1}'.format(self.index, ex))
+                self.pending.pop(request_id, None)
+                return False
+        if not waiter[0].wait(wait_sec):
+            with self.lock:
+                self.pending.pop(request_id, None)
+            LOGGER.warning('MiLight worker {0} did not answer in time'.format(self.index))
+        return waiter[1]
+
+    def stop(self):
+        with self.lock:
+            conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class BridgeWorkerPool(object):
+    """ Pool of worker processes owning the MilightWifiBridge clients (one worker per group of bridges) """
+
+    def __init__(self, workers):
+        # Spawn (not fork) so that the worker does not inherit the Polyglot threads
+        context = multiprocessing.get_context('spawn')
+        self.request_ids = count(1)
+        self.workers = [_Worker(index, context) for index in range(max(int(workers), 1))]
+
+    def worker(self, host):
+        return self.workers[zlib.crc32(host.encode()) % len(self.workers)]
+
+    def client(self):
+        return ShardedMilightClient(self)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+class ShardedMilightClient(object):
+    """ MilightWifiBridge stand-in forwarding each call to the worker process owning the bridge """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.host = None
+        self.port = 5987
+        self.timeout = 5.0
+        self.setupArgs = None
+
+    def setup(self, ip, port=5987, timeout_sec=5.0, connected=True, keepSession=False):
+        self.host = ip
+        self.port = port
+        self.timeout = timeout_sec
+        self.setupArgs = ((ip, port, timeout_sec, connected), {'keepSession': keepSession})
+        return self.call('setup', ip, port, timeout_sec, connected, keepSession=keepSession)
+
+    def call(self, method, *args, **kwargs):
+        if self.host is None:
+            LOGGER.error('MiLight client must be setup before calling {0}'.format(method))
+            return False
+        message = (next(self.pool.request_ids), self.host, self.port, self.setupArgs, method, args, kwargs)
+        # A request does at most two exchanges (start session and command) plus the queueing in the worker
+        return self.pool.worker(self.host).call(message[0], message, self.timeout * 4 + 5)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not callable(getattr(MilightWifiBridge, name, None)):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
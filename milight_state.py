@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+"""
+Compact zone state table for the MiLight NodeServer.
+
+The last confirmed state of every zone is kept in one typed array indexed by (bridge, zone) instead of
+dictionaries spread over the nodes, so that hundreds of bridges only cost a few bytes per zone. Zone 0 is
+the lamp of the bridge itself, zones 1 to 4 are the MiLight zones. Snapshots are plain array copies and
+can be compared with the current state to get the changed drivers.
+
+The commands which could not reach their bridge are kept in a desired state journal, only the latest intent
+of each attribute of a zone is kept so that a recovered bridge is reconciled with one compact batch.
+"""
+
+import threading
+from array import array
+from collections import namedtuple, OrderedDict
+
+# Drivers kept for each zone and their value when the state is not known yet
+DRIVERS = ('ST', 'GV1', 'GV2', 'GV3', 'GV4', 'GV5', 'CLITEMP')
+DEFAULTS = (0, 0, 0, 100, 1, 0, 2700)
+ZONES = 5
+
+UNKNOWN = -1
+ROW_SIZE = len(DRIVERS)
+BRIDGE_SIZE = ZONES * ROW_SIZE
+
+# Change between a snapshot and the current state (old or new value is None when unknown)
+StateChange = namedtuple('StateChange', 'bridge zone driver old new')
+
+# Attribute of a zone set by each action (MilightWifiBridge action names) and the drivers showing it
+ACTION_ATTRIBUTES = {
+    'turnOn': 'power', 'turnOff': 'power', 'turnOnWifiBridgeLamp': 'power', 'turnOffWifiBridgeLamp': 'power',
+    'setColor': 'color', 'setColorBridgeLamp': 'color',
+    'setSaturation': 'saturation',
+    'setBrightness': 'brightness', 'setBrightnessBridgeLamp': 'brightness',
+    'setTemperature': 'temperature',
+    'setDiscoMode': 'effect', 'setDiscoModeBridgeLamp': 'effect',
+    'setWhiteMode': 'mode', 'setNightMode': 'mode', 'setWhiteModeBridgeLamp': 'mode'
+}
+ATTRIBUTE_DRIVERS = {
+    'power': ('ST',), 'color': ('GV1',), 'saturation': ('GV2',), 'brightness': ('GV3',),
+    'temperature': ('GV5', 'CLITEMP'), 'effect': ('GV4',), 'mode': ()
+}
+
+# Command to send to a zone (drivers are the values the node shows once the command is acknowledged)
+Intent = namedtuple('Intent', 'address zone action value drivers')
+
+
+class ZoneStateSnapshot(object):
+    """ Frozen copy of a ZoneStateTable """
+
+    def __init__(self, slots, values):
+        self.slots = slots
+        self.values = values
+
+    def get(self, bridge, zone, driver):
+        slot = self.slots.get(bridge)
+        if slot is None:
+            return None
+        value = self.values[slot * BRIDGE_SIZE + zone * ROW_SIZE + DRIVERS.index(driver)]
+        return None if value == UNKNOWN else value
+
+
+class ZoneStateTable(object):
+    """ State of every zone of every bridge, stored in a single array of shorts """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.free = []
+        self.values = array('h')
+
+    @staticmethod
+    def key(address):
+        """ Give the (bridge, zone) of a node address ('bridge1' or 'bridge1_zone3') """
+        bridge, separator, zone = address.partition('_zone')
+        return bridge, int(zone) if separator else 0
+
+    def addBridge(self, bridge):
+        with self.lock:
+            return self.__slot(bridge)
+
+    def __slot(self, bridge):
+        slot = self.slots.get(bridge)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.values) // BRIDGE_SIZE
+                self.values.extend([UNKNOWN] * BRIDGE_SIZE)
+            self.slots[bridge] = slot
+        return slot
+
+    def removeBridge(self, bridge):
+        with self.lock:
+            slot = self.slots.pop(bridge, None)
+            if slot is None:
+                return False
+            start = slot * BRIDGE_SIZE
+            self.values[start:start + BRIDGE_SIZE] = array('h', [UNKNOWN] * BRIDGE_SIZE)
+            self.free.append(slot)
+            return True
+
+    def bridges(self):
+        return list(self.slots)
+
+    def get(self, bridge, zone, driver, default=None):
+        slot = self.slots.get(bridge)
+        if slot is None:
+            return default
+        value = self.values[slot * BRIDGE_SIZE + zone * ROW_SIZE + DRIVERS.index(driver)]
+        return default if value == UNKNOWN else value
+
+    def set(self, bridge, zone, driver, value):
+        """ Update a driver of a zone, return True if its value changed """
+        if driver not in DRIVERS:
+            return False
+        with self.lock:
+            index = self.__slot(bridge) * BRIDGE_SIZE + zone * ROW_SIZE + DRIVERS.index(driver)
+            value = int(value)
+            if self.values[index] == value:
+                return False
+            self.values[index] = value
+            return True
+
+    def row(self, bridge, zone, defaults=False):
+        """ Give the known drivers of a zone (with the default value of the unknown ones if defaults is set) """
+        slot = self.slots.get(bridge)
+        start = None if slot is None else slot * BRIDGE_SIZE + zone * ROW_SIZE
+        state = {}
+        for index, driver in enumerate(DRIVERS):
+            value = UNKNOWN if start is None else self.values[start + index]
+            if value != UNKNOWN:
+                state[driver] = value
+            elif defaults:
+                state[driver] = DEFAULTS[index]
+        return state
+
+    def snapshot(self):
+        with self.lock:
+            return ZoneStateSnapshot(dict(self.slots), array('h', self.values))
+
+    def diff(self, snapshot):
+        """ Give the StateChange list between a snapshot and the current state """
+        current = self.snapshot()
+        changes = []
+        for bridge in sorted(set(current.slots) | set(snapshot.slots)):
+            newSlot = current.slots.get(bridge)
+            oldSlot = snapshot.slots.get(bridge)
+            new = current.values[newSlot * BRIDGE_SIZE:(newSlot + 1) * BRIDGE_SIZE] if newSlot is not None else None
+            old = snapshot.values[oldSlot * BRIDGE_SIZE:(oldSlot + 1) * BRIDGE_SIZE] if oldSlot is not None else None
+            if new == old:
+                continue
+            for index in range(BRIDGE_SIZE):
+                newValue = UNKNOWN if new is None else new[index]
+                oldValue = UNKNOWN if old is None else old[index]
+                if newValue != oldValue:
+                    changes.append(StateChange(bridge, index // ROW_SIZE, DRIVERS[index % ROW_SIZE],
+                                               None if oldValue == UNKNOWN else oldValue,
+                                               None if newValue == UNKNOWN else newValue))
+        return changes
+
+    def toData(self):
+        """ Give the state as {node address: {driver: value}} (format saved in the custom data) """
+        data = {}
+        for bridge in self.bridges():
+            for zone in range(ZONES):
+                state = self.row(bridge, zone)
+                if state:
+                    data[bridge if zone == 0 else bridge + '_zone' + str(zone)] = state
+        return data
+
+    def loadData(self, data):
+        for address, state in data.items():
+            bridge, zone = self.key(address)
+            if 0 <= zone < ZONES:
+                for driver, value in state.items():
+                    self.set(bridge, zone, driver, value)
+
+    def memoryUsage(self):
+        return self.values.buffer_info()[1] * self.values.itemsize
+
+
+class DesiredStateJournal(object):
+    """ Latest intent for each attribute of the zones whose commands did not reach their bridge """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = False
+        self.intents = {}
+        self.locks = {}
+
+    def hostLock(self, host):
+        """ Lock making the supersession and the taking of the intents of a bridge atomic (not held while sending) """
+        with self.lock:
+            if host not in self.locks:
+                self.locks[host] = threading.Lock()
+            return self.locks[host]
+
+    def record(self, host, address, zone, action, value, drivers):
+        """ Keep an intent, it replaces the previous intent for the same attribute of the zone """
+        attribute = ACTION_ATTRIBUTES[action]
+        drivers = dict((driver, drivers[driver]) for driver in ATTRIBUTE_DRIVERS[attribute] if driver in drivers)
+        with self.lock:
+            intents = self.intents.setdefault(host, OrderedDict())
+            # Latest intents last, so that they are sent in the order of the commands
+            intents.pop((address, attribute), None)
+            intents[(address, attribute)] = Intent(address, zone, action, value, drivers)
+            self.changed = True
+
+    def discard(self, host, address, action):
+        """ Forget the intent superseded by a command about to be sent """
+        with self.lock:
+            intents = self.intents.get(host)
+            if intents and intents.pop((address, ACTION_ATTRIBUTES[action]), None) is not None:
+                self.changed = True
+
+    def pending(self, host):
+        return len(self.intents.get(host, ()))
+
+    def take(self, host):
+        """ Remove and give the intents of a bridge, in the order of their commands """
+        with self.lock:
+            intents = self.intents.pop(host, None)
+            if not intents:
+                return []
+            self.changed = True
+            return list(intents.values())
+
+    def restore(self, host, intents):
+        """ Put back intents which could not be sent, unless newer intents replaced them """
+        with self.lock:
+            current = self.intents.get(host, OrderedDict())
+            restored = OrderedDict(((intent.address, ACTION_ATTRIBUTES[intent.action]), intent) for intent in intents)
+            for key in current:
+                restored.pop(key, None)
+            restored.update(current)
+            if restored:
+                self.intents[host] = restored
+                self.changed = True
+
+    def removeBridge(self, host):
+        with self.lock:
+            if self.intents.pop(host, None):
+                self.changed = True
+
+    def toData(self):
+        """ Give the intents as {host: [[address, zone, action, value, drivers]]} (format saved in the custom data) """
+        with self.lock:
+            return dict((host, [list(intent) for intent in intents.values()])
+                        for host, intents in self.intents.items() if intents)
+
+    def loadData(self, data):
+        for host, intents in data.items():
+            for address, zone, action, value, drivers in intents:
+                if action in ACTION_ATTRIBUTES:
+                    self.record(host, address, zone, action, value, drivers)
+        self.changed = False
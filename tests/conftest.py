@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the node server are at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from MilightReplay import MilightBridgeStandIn
+
+
+@pytest.fixture
+def standIn():
+    """ Started wifi bridge stand-in on a free local port """
+    standIn = MilightBridgeStandIn()
+    standIn.start()
+    yield standIn
+    standIn.stop()
+
+
+@pytest.fixture
+def bench():
+    """ Node server running against the udi_interface stand-in and one bridge stand-in (see milight_bench.py) """
+    from milight_bench import NodeServerBench
+    cwd = os.getcwd()
+    bench = NodeServerBench(bridges=1)
+    yield bench
+    bench.stop()
+    os.chdir(cwd)
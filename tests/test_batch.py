@@ -0,0 +1,27 @@
+import pytest
+
+from MilightWifiBridge import MilightWifiBridge
+
+
+def test_batch_encoder_matches_command_frames():
+    pytest.importorskip('numpy')
+    from MilightBatch import MilightBatchEncoder
+    encoder = MilightBatchEncoder()
+    actions, values, zones, expected = [], [], [], []
+    for index, action in enumerate(MilightBatchEncoder.ACTIONS):
+        for value in (0, 1, 50, 100, 255):
+            for zoneId in range(5):
+                actions.append(index)
+                values.append(value)
+                zones.append(zoneId)
+                expected.append(bytes(MilightWifiBridge.buildCommandFrame(action, zoneId, value)))
+    frames = encoder.encode(actions, values, zones)
+    assert [bytes(frame) for frame in MilightBatchEncoder.frameViews(frames)] == expected
+
+
+def test_batch_encoder_rejects_invalid_zone():
+    pytest.importorskip('numpy')
+    from MilightBatch import MilightBatchEncoder
+    encoder = MilightBatchEncoder()
+    with pytest.raises(ValueError):
+        encoder.encode([encoder.actionIndex('turnOn')], zones=5)
@@ -0,0 +1,39 @@
+import pytest
+
+from MilightWifiBridge import MilightWifiBridge
+from MilightColors import MilightColorConverter, MilightKelvinTable
+
+
+def test_color_frames():
+    color = MilightColorConverter.hsvToMilight(360 + 120, 150, 40)
+    assert color.color == MilightColorConverter.hsvToMilight(120, 100, 40).color
+    assert color.saturation == 100 and color.brightness == 40
+    frames = MilightColorConverter.buildFrames(color, 2)
+    assert [bytes(frame) for frame in frames] == [
+        bytes(MilightWifiBridge.buildCommandFrame('setColor', 2, color.color)),
+        bytes(MilightWifiBridge.buildCommandFrame('setSaturation', 2, color.saturation)),
+        bytes(MilightWifiBridge.buildCommandFrame('setBrightness', 2, color.brightness))]
+
+
+def test_rgb_brightness():
+    assert MilightColorConverter.rgbToMilight(255, 0, 0).brightness == 100
+    assert MilightColorConverter.rgbToMilight(0, 0, 0).brightness == 0
+    assert MilightColorConverter.rgbToMilight(300, -5, 0) == MilightColorConverter.rgbToMilight(255, 0, 0)
+
+
+def test_kelvin_table_default_calibration():
+    table = MilightKelvinTable()
+    for kelvin, percentage in MilightKelvinTable.DEFAULT_CALIBRATION:
+        assert table.toTemperature(kelvin) == percentage
+    assert table.toTemperature(1000) == table.toTemperature(2700)
+    assert table.toTemperature(10000) == table.toTemperature(6500)
+    assert table.clamp(10000) == 6500
+
+
+def test_kelvin_table_interpolation():
+    table = MilightKelvinTable.parse('2000:0, 3000:100')
+    assert table.toTemperature(2500) == 50
+    assert table.toTemperature(2250) == 25
+    assert bytes(table.buildFrame(2500, 1)) == bytes(MilightWifiBridge.buildCommandFrame('setTemperature', 1, 50))
+    with pytest.raises(ValueError):
+        MilightKelvinTable([(3000, 0)])
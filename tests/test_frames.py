@@ -0,0 +1,37 @@
+import pytest
+
+from MilightWifiBridge import MilightWifiBridge
+
+
+def checksum(frame):
+    return sum(frame[10:20]) & 0xFF
+
+
+def test_command_frame_layout():
+    frame = MilightWifiBridge.buildCommandFrame('setBrightness', MilightWifiBridge.eZone.THREE, 42)
+    assert len(frame) == 22
+    assert frame[0:5] == bytearray([0x80, 0x00, 0x00, 0x00, 0x11])
+    # Session IDs and sequence number are filled when sending
+    assert frame[5] == frame[6] == frame[8] == 0
+    assert frame[14] == 0x03 and frame[15] == 42
+    assert frame[19] == 3
+    assert frame[21] == checksum(frame)
+
+
+@pytest.mark.parametrize('action, value', [('turnOn', None), ('turnOff', None), ('setColor', 0xBA),
+                                           ('setSaturation', 80), ('setTemperature', 35), ('setDiscoMode', 4)])
+def test_command_frame_checksum(action, value):
+    for zoneId in range(5):
+        frame = MilightWifiBridge.buildCommandFrame(action, zoneId, value)
+        assert frame[19] == zoneId
+        assert frame[21] == checksum(frame)
+
+
+def test_command_frame_bridge_lamp_uses_zone_one():
+    frame = MilightWifiBridge.buildCommandFrame('turnOnWifiBridgeLamp', MilightWifiBridge.eZone.FOUR)
+    assert frame[19] == 1
+    assert frame[21] == checksum(frame)
+
+
+def test_command_frame_unknown_action():
+    assert MilightWifiBridge.buildCommandFrame('blink', 1) is None
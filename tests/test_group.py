@@ -0,0 +1,34 @@
+import pytest
+
+from MilightWifiBridge import MilightWifiBridge
+from milight_group import GroupPlan, parseMembers, deriveState
+
+
+def test_parse_members():
+    assert parseMembers(' 10.0.0.1:2, 10.0.0.2 ,10.0.0.1:2,') == [('10.0.0.1', 2), ('10.0.0.2', 1), ('10.0.0.2', 2),
+                                                                ('10.0.0.2', 3), ('10.0.0.2', 4)]
+
+
+@pytest.mark.parametrize('value', ['', '10.0.0.1:5', '10.0.0.1:x', ':1'])
+def test_parse_invalid_members(value):
+    with pytest.raises(ValueError):
+        parseMembers(value)
+
+
+def test_plan_collapses_full_bridges_to_zone_zero():
+    plan = GroupPlan(parseMembers('10.0.0.1,10.0.0.2:3,10.0.0.2:1'))
+    assert plan.targets == {'10.0.0.1': (MilightWifiBridge.eZone.ALL,), '10.0.0.2': (1, 3)}
+    actions = [('turnOn', None), ('setBrightness', 50)]
+    assert plan.frameCount(actions) == 6
+    frames = plan.frames('10.0.0.2', actions)
+    assert [bytes(frame) for frame in frames] == [bytes(MilightWifiBridge.buildCommandFrame(action, zone, value))
+                                                  for zone in (1, 3) for action, value in actions]
+    assert [frame[19] for frame in plan.frames('10.0.0.1', actions)] == [0, 0]
+
+
+def test_derive_state():
+    rows = [{'ST': 0, 'GV3': 20, 'GV1': 0x85, 'CLITEMP': 2700},
+            {'ST': 100, 'GV3': 41, 'GV1': 0x85},
+            {'GV1': 0xBA}]
+    assert deriveState(rows) == {'ST': 100, 'GV3': 30, 'GV1': 0x85, 'CLITEMP': 2700}
+    assert deriveState([]) == {}
@@ -0,0 +1,49 @@
+from milight_state import DesiredStateJournal
+
+
+def test_journal_keeps_latest_intent_per_attribute():
+    journal = DesiredStateJournal()
+    journal.record('host', 'bridge1_zone1', 1, 'turnOn', None, {'ST': 100})
+    journal.record('host', 'bridge1_zone1', 1, 'setBrightness', 40, {'GV3': 40})
+    journal.record('host', 'bridge1_zone1', 1, 'turnOff', None, {'ST': 0})
+    assert journal.pending('host') == 2
+    intents = journal.take('host')
+    # Latest intents last, in the order of the commands
+    assert [(intent.action, intent.drivers) for intent in intents] == [('setBrightness', {'GV3': 40}),
+                                                                      ('turnOff', {'ST': 0})]
+    assert journal.pending('host') == 0
+    assert journal.take('host') == []
+
+
+def test_journal_keeps_only_attribute_drivers():
+    journal = DesiredStateJournal()
+    journal.record('host', 'bridge1_zone1', 1, 'setTemperature', 35, {'GV5': 35, 'CLITEMP': 4000, 'ST': 100})
+    assert journal.take('host')[0].drivers == {'GV5': 35, 'CLITEMP': 4000}
+
+
+def test_journal_discard():
+    journal = DesiredStateJournal()
+    journal.record('host', 'bridge1_zone1', 1, 'turnOn', None, {'ST': 100})
+    journal.discard('host', 'bridge1_zone1', 'turnOff')
+    assert journal.pending('host') == 0
+
+
+def test_journal_restore_keeps_newer_intents():
+    journal = DesiredStateJournal()
+    journal.record('host', 'bridge1_zone1', 1, 'setBrightness', 40, {'GV3': 40})
+    journal.record('host', 'bridge1_zone1', 1, 'setColor', 0x85, {'GV1': 0x85})
+    failed = journal.take('host')
+    journal.record('host', 'bridge1_zone1', 1, 'setBrightness', 70, {'GV3': 70})
+    journal.restore('host', failed)
+    assert [(intent.action, intent.value) for intent in journal.take('host')] == [('setColor', 0x85),
+                                                                                 ('setBrightness', 70)]
+
+
+def test_journal_data_round_trip():
+    journal = DesiredStateJournal()
+    journal.record('host', 'bridge1_zone2', 2, 'setColor', 0x85, {'GV1': 0x85})
+    data = journal.toData()
+    loaded = DesiredStateJournal()
+    loaded.loadData(data)
+    assert loaded.toData() == data
+    assert not loaded.changed
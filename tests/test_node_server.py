@@ -0,0 +1,109 @@
+import time
+
+from MilightWifiBridge import MilightWifiBridge
+from MilightReplay import MilightBridgeStandIn
+
+
+def lightAddress(bench, zone):
+    return bench.controller.bridges[bench.standIns[0].address[0]] + '_zone' + str(zone)
+
+
+def test_light_command_updates_drivers_and_bridge(bench):
+    address = lightAddress(bench, 2)
+    light = bench.poly.getNode(address)
+    light.runCmd({'cmd': 'SET_BRI', 'value': '40'})
+    assert light.getDriver('GV3') == 40
+    expected = dict((zoneId, {}) for zoneId in range(1, 5))
+    MilightBridgeStandIn.applyFrame(expected, MilightWifiBridge.buildCommandFrame('setBrightness', 2, 40))
+    assert bench.standIns[0].zones == expected
+    bridge, zone = bench.controller.zoneState.key(address)
+    assert bench.controller.zoneState.get(bridge, zone, 'GV3') == 40
+
+
+def test_group_command_uses_zone_zero(bench):
+    requests = bench.standIns[0].requests
+    bench.poly.getNode(bench.controller.groupAddresses['house']).runCmd({'cmd': 'DOF'})
+    assert bench.standIns[0].requests - requests == 1
+    for zone in range(1, 5):
+        assert bench.poly.getNode(lightAddress(bench, zone)).getDriver('ST') == 0
+
+
+def test_unreachable_bridge_journals_commands(bench):
+    host = bench.standIns[0].address[0]
+    light = bench.poly.getNode(lightAddress(bench, 3))
+    light.myMilight.setup(light.milight_host, light.milight_port, 0.1)
+    light.milight_timeout = 0.1
+    light.runCmd({'cmd': 'DON'})
+    bench.standIns[0].answerLoss = 100.0
+    light.runCmd({'cmd': 'DOF'})
+    # The drivers keep the last acknowledged state, the command is kept until the bridge answers again
+    assert light.getDriver('ST') == 100
+    assert bench.controller.journal.pending(host) == 1
+    assert bench.controller.getBreaker(host).failures == 1
+    bench.standIns[0].answerLoss = 0.0
+    assert bench.controller.reconcile(host)
+    assert light.getDriver('ST') == 0
+    assert bench.controller.journal.pending(host) == 0
+
+
+def test_circuit_breaker_opens_after_threshold(bench):
+    breaker = bench.milight_poly.BridgeCircuitBreaker('127.0.0.1', 1, threshold=2, minBackoff=60.0)
+    try:
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert breaker.allow()
+        breaker.failure()
+        assert not breaker.allow()
+        # Only the probe closes an open breaker
+        breaker.success()
+        assert not breaker.allow()
+    finally:
+        breaker.stop()
+
+
+def test_kelvin_command_sets_temperature_percentage(bench):
+    light = bench.poly.getNode(lightAddress(bench, 1))
+    light.runCmd({'cmd': 'SET_KELVIN', 'value': '4000'})
+    assert light.getDriver('CLITEMP') == 4000
+    assert light.getDriver('GV5') == MilightWifiBridge.eTemperature.COOL_WHITE
+
+
+def test_invalid_workers_still_creates_the_nodes(bench):
+    from milight_bench import _StubInterface
+    standIn = bench.standIns[0]
+    poly = _StubInterface()
+    controller = bench.milight_poly.Controller(poly, 'controller', 'controller', 'MiLightNodeServer')
+    poly.publish(poly.CUSTOMPARAMS, {'host': standIn.address[0], 'port': str(standIn.address[1]), 'workers': 'x'})
+    poly.publish(poly.CUSTOMDATA, {})
+    poly.publish(poly.CONFIGDONE)
+    try:
+        assert 'workers' in poly.Notices
+        assert controller.workerPool is None
+        assert len(poly.nodes()) == 6
+        # Workers are only read at startup
+        poly.publish(poly.CUSTOMPARAMS, {'host': standIn.address[0], 'port': str(standIn.address[1]), 'workers': '2'})
+        assert controller.workerPool is None
+    finally:
+        poly.publish(poly.STOP)
+
+
+def test_optimistic_command_rolled_back_when_not_acknowledged(bench):
+    host = bench.standIns[0].address[0]
+    light = bench.poly.getNode(lightAddress(bench, 4))
+    light.myMilight.setup(light.milight_host, light.milight_port, 0.1)
+    light.milight_timeout = 0.1
+    bench.controller.optimistic = True
+    light.runCmd({'cmd': 'SET_BRI', 'value': '40'})
+    time.sleep(0.2)
+    assert light.setDriver('GV3', 40) is False
+    bench.standIns[0].answerLoss = 100.0
+    light.runCmd({'cmd': 'SET_BRI', 'value': '70'})
+    # Updated right away, rolled back once the retry failed on the worker thread
+    assert light.getDriver('GV3') == 70
+    deadline = time.monotonic() + 5.0
+    while bench.controller.journal.pending(host) == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert light.getDriver('GV3') == 40
+    assert bench.controller.journal.pending(host) == 1
+    assert bench.controller.getBreaker(host).failures == 1
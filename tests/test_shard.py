@@ -0,0 +1,17 @@
+from MilightWifiBridge import MilightWifiBridge
+from milight_shard import BridgeWorkerPool
+
+
+def test_sharded_client_forwards_keyword_arguments(standIn):
+    pool = BridgeWorkerPool(1)
+    try:
+        client = pool.client()
+        assert client.setup(standIn.address[0], standIn.address[1], 1.0, keepSession=True)
+        frames = [MilightWifiBridge.buildCommandFrame('setColor', zoneId, 0x85) for zoneId in range(1, 5)]
+        results = client.sendFrames(frames, window=2)
+        assert len(results) == 4 and None not in results
+        assert client.turnOn(MilightWifiBridge.eZone.ONE)
+    finally:
+        pool.stop()
+    # The client of the worker is only setup by the forwarded call, its session is kept
+    assert standIn.handshakes == 1
@@ -0,0 +1,27 @@
+from MilightWifiBridge import MilightWifiBridge, MilightSharedWifiBridge
+
+
+def test_shared_client_sends_frames_in_one_session(standIn):
+    milight = MilightSharedWifiBridge()
+    assert milight.setup(standIn.address[0], standIn.address[1], 1.0)
+    frames = [MilightWifiBridge.buildCommandFrame('setColor', zoneId, 0x85) for zoneId in range(1, 5)]
+    results = milight.sendFrames(frames)
+    assert None not in results
+    # Setting up again with the same parameters keeps the session
+    assert milight.setup(standIn.address[0], standIn.address[1], 1.0)
+    assert None not in milight.sendFrames(frames)
+    milight.close()
+    assert standIn.handshakes == 1
+    assert standIn.applied == 8
+
+
+def test_shared_client_starts_a_new_session_after_a_timeout(standIn):
+    milight = MilightSharedWifiBridge()
+    assert milight.setup(standIn.address[0], standIn.address[1], 0.2)
+    frame = MilightWifiBridge.buildCommandFrame('turnOff', 1)
+    standIn.answerLoss = 100.0
+    assert milight.sendFrames([frame]) == [None]
+    standIn.answerLoss = 0.0
+    assert None not in milight.sendFrames([frame])
+    milight.close()
+    assert standIn.handshakes == 2
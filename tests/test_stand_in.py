@@ -0,0 +1,28 @@
+from MilightWifiBridge import MilightWifiBridge
+from MilightReplay import MilightBridgeStandIn
+from MilightSoak import MilightSoakTest
+
+
+def test_commands_reach_the_stand_in(standIn):
+    milight = MilightWifiBridge()
+    assert milight.setup(standIn.address[0], standIn.address[1], 1.0, keepSession=True)
+    assert milight.turnOn(MilightWifiBridge.eZone.TWO)
+    assert milight.setBrightness(40, MilightWifiBridge.eZone.TWO)
+    milight.close()
+    expected = dict((zoneId, {}) for zoneId in range(1, 5))
+    MilightBridgeStandIn.applyFrame(expected, MilightWifiBridge.buildCommandFrame('turnOn', 2))
+    MilightBridgeStandIn.applyFrame(expected, MilightWifiBridge.buildCommandFrame('setBrightness', 2, 40))
+    assert standIn.zones == expected
+    assert standIn.handshakes == 1
+
+
+def test_soak_on_lossy_link_keeps_the_state():
+    standIn = MilightBridgeStandIn(requestLoss=5, answerLoss=5, seed=1)
+    standIn.start()
+    try:
+        result = MilightSoakTest(standIn, shared=True, timeout=0.1, seed=1).run(2.0)
+    finally:
+        standIn.stop()
+    assert result.commands > 0
+    assert result.falsePositives == 0
+    assert result.divergence == 0
@@ -0,0 +1,52 @@
+from milight_state import ZoneStateTable, StateChange, DEFAULTS, DRIVERS
+
+
+def test_key():
+    assert ZoneStateTable.key('bridge1') == ('bridge1', 0)
+    assert ZoneStateTable.key('bridge1_zone3') == ('bridge1', 3)
+
+
+def test_set_and_row():
+    table = ZoneStateTable()
+    assert table.set('bridge1', 2, 'GV3', '40')
+    assert not table.set('bridge1', 2, 'GV3', 40)
+    assert not table.set('bridge1', 2, 'GV9', 1)
+    assert table.get('bridge1', 2, 'GV3') == 40
+    assert table.get('bridge1', 1, 'GV3') is None
+    assert table.row('bridge1', 2) == {'GV3': 40}
+    row = table.row('bridge2', 1, defaults=True)
+    assert row == dict(zip(DRIVERS, DEFAULTS))
+
+
+def test_diff():
+    table = ZoneStateTable()
+    table.set('bridge1', 1, 'ST', 100)
+    snapshot = table.snapshot()
+    table.set('bridge1', 1, 'ST', 0)
+    table.set('bridge2', 4, 'GV1', 0x85)
+    assert table.diff(snapshot) == [StateChange('bridge1', 1, 'ST', 100, 0),
+                                    StateChange('bridge2', 4, 'GV1', None, 0x85)]
+    assert table.diff(table.snapshot()) == []
+
+
+def test_remove_bridge_reuses_slot():
+    table = ZoneStateTable()
+    table.set('bridge1', 1, 'ST', 100)
+    size = table.memoryUsage()
+    assert table.removeBridge('bridge1')
+    assert not table.removeBridge('bridge1')
+    table.set('bridge2', 1, 'ST', 0)
+    assert table.memoryUsage() == size
+    assert table.row('bridge2', 1) == {'ST': 0}
+    assert table.bridges() == ['bridge2']
+
+
+def test_data_round_trip():
+    table = ZoneStateTable()
+    table.set('bridge1', 0, 'ST', 100)
+    table.set('bridge1', 3, 'GV3', 40)
+    data = table.toData()
+    assert data == {'bridge1': {'ST': 100}, 'bridge1_zone3': {'GV3': 40}}
+    loaded = ZoneStateTable()
+    loaded.loadData(data)
+    assert loaded.toData() == data